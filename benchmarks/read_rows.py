@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+"""Benchmark of reading rows of query results into the result store.
+
+Rows of a synthetic file geodatabase are read through the Arrow C stream
+interface (GDAL 3.6+ with pyarrow) and feature by feature; the number of
+rows read per second is printed for both paths. An existing geodatabase
+can be read instead, e.g. when the installed GDAL cannot write file
+geodatabases (before GDAL 3.6).
+
+Usage: python benchmarks/read_rows.py [number of rows]
+       python benchmarks/read_rows.py <path to .gdb> <table name>
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+        'src',
+    ))
+
+import ogr  # noqa: E402
+
+from geodatabase import Geodatabase  # noqa: E402
+from result_store import BatchReader, ResultStore  # noqa: E402
+
+ogr.UseExceptions()
+
+DIALECTS = ('OGRSQL', 'SQLite')
+
+
+# ----------------------------------------------------------------------
+def can_create_gdb():
+    """Check whether the installed GDAL can write file geodatabases."""
+    driver = ogr.GetDriverByName('OpenFileGDB')
+    return bool(driver and driver.TestCapability(ogr.ODrCCreateDataSource))
+
+
+# ----------------------------------------------------------------------
+def create_gdb(path, number_of_rows):
+    """Create file geodatabase with a point feature class."""
+    ds = ogr.GetDriverByName('OpenFileGDB').CreateDataSource(path)
+    lyr = ds.CreateLayer('points', geom_type=ogr.wkbPoint)
+    lyr.CreateField(ogr.FieldDefn('code', ogr.OFTInteger))
+    lyr.CreateField(ogr.FieldDefn('value', ogr.OFTReal))
+    lyr.CreateField(ogr.FieldDefn('name', ogr.OFTString))
+    lyr.CreateField(ogr.FieldDefn('created', ogr.OFTDate))
+    defn = lyr.GetLayerDefn()
+
+    lyr.StartTransaction()
+    for i in range(number_of_rows):
+        feat = ogr.Feature(defn)
+        feat.SetField('code', i)
+        feat.SetField('value', i / 7.0)
+        if i % 10:
+            feat.SetField('name', 'Feature {0}'.format(i))
+        feat.SetField('created', 2000 + i % 20, 1 + i % 12, 1 + i % 28, 0, 0,
+                      0, 0)
+        geom = ogr.Geometry(ogr.wkbPoint)
+        geom.AddPoint_2D(i % 1000, i // 1000)
+        feat.SetGeometry(geom)
+        lyr.CreateFeature(feat)
+    lyr.CommitTransaction()
+    ds = None
+    return
+
+
+# ----------------------------------------------------------------------
+def read_all_rows(gdb, dialect, query, use_arrow, with_geometry):
+    """Read all rows of the query result; return (rows, seconds)."""
+    res, errors = gdb.execute_sql(query, dialect)
+    if res is None:
+        raise RuntimeError(errors)
+    start_time = time.time()
+    geom_column = res.GetGeometryColumn() if with_geometry else ''
+    reader = BatchReader(res, geom_column=geom_column, use_arrow=use_arrow)
+    store = ResultStore(reader.fields, geom_column)
+    while not reader.is_exhausted:
+        store.append_batch(*reader.read(10000))
+    elapsed = time.time() - start_time
+    reader.close()
+    gdb.release_result(res)
+    return store.row_count, elapsed
+
+
+# ----------------------------------------------------------------------
+def main(number_of_rows=200000, gdb_path=None, table_name='points'):
+    """Print rows per second of both ways of reading rows.
+
+    A synthetic geodatabase is created unless `gdb_path` is given.
+    """
+    if gdb_path is None and not can_create_gdb():
+        print('OpenFileGDB driver cannot create geodatabases (needs GDAL '
+              '3.6+); pass path of an existing geodatabase and a table')
+        return
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if gdb_path is None:
+            gdb_path = os.path.join(tmp_dir, 'synthetic.gdb')
+            create_gdb(gdb_path, number_of_rows)
+        gdb = Geodatabase(gdb_path)
+        query = 'SELECT * FROM {0}'.format(table_name)
+        res, errors = gdb.execute_sql(query + ' LIMIT 1')
+        if res is None:
+            raise RuntimeError(errors)
+        arrow_supported = BatchReader(res).use_arrow
+        gdb.release_result(res)
+        if not arrow_supported:
+            print('Arrow stream is not available (needs GDAL 3.6+ and '
+                  'pyarrow); reading feature by feature only')
+
+        print('{0:<8} {1:<10} {2:<9} {3:>10} {4:>14}'.format(
+            'dialect', 'path', 'geometry', 'rows', 'rows/s'))
+        for dialect in DIALECTS:
+            for with_geometry in (False, True):
+                for use_arrow in (False, True):
+                    if use_arrow and not arrow_supported:
+                        continue
+                    rows, elapsed = read_all_rows(gdb, dialect, query,
+                                                  use_arrow, with_geometry)
+                    print('{0:<8} {1:<10} {2:<9} {3:>10,} {4:>14,.0f}'.format(
+                        dialect, 'arrow' if use_arrow else 'features',
+                        'yes' if with_geometry else 'no', rows,
+                        rows / max(elapsed, 1e-9)))
+        gdb.close_connection()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        main(gdb_path=sys.argv[1], table_name=sys.argv[2])
+    elif len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
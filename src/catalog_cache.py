@@ -0,0 +1,140 @@
+# -*- coding: UTF-8 -*-
+"""Persistent on-disk cache of geodatabase schemas."""
+
+import os
+import json
+import sqlite3
+import hashlib
+
+from cfg import schema_cache_dir
+
+CACHE_FORMAT_VERSION = '1'
+
+
+########################################################################
+class SchemaCatalogCache(object):
+    """SQLite file storing layers and fields of a single file geodatabase.
+
+    Every layer is stored along with the `.gdbtable` file it lives in and
+    the size and modification time of that file so that only tables that
+    have changed since the last connect need to be introspected again.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, gdb_path, cache_dir=schema_cache_dir):
+        """Initialize SchemaCatalogCache with the cache file location."""
+        self.gdb_path = gdb_path
+        key = hashlib.sha1(
+            os.path.normcase(os.path.abspath(gdb_path)).encode(
+                'utf-8')).hexdigest()
+        self.cache_path = os.path.join(cache_dir, '{0}.sqlite'.format(key))
+        return
+
+    # ----------------------------------------------------------------------
+    def get_table_files_stats(self):
+        """Get {file_name: 'size:mtime'} for all `.gdbtable` files in gdb."""
+        files_stats = {}
+        try:
+            entries = list(os.scandir(self.gdb_path))
+        except OSError:
+            return files_stats
+        for entry in entries:
+            if entry.name.lower().endswith('.gdbtable'):
+                stat = entry.stat()
+                files_stats[entry.name.lower()] = '{0}:{1}'.format(
+                    stat.st_size, stat.st_mtime)
+        return files_stats
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def get_files_signature(files_stats):
+        """Get a single signature string of the table files state."""
+        return json.dumps(sorted(files_stats.items()))
+
+    # ----------------------------------------------------------------------
+    def _connect(self):
+        """Open the cache file creating its tables if necessary."""
+        cache_dir = os.path.dirname(self.cache_path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        conn = sqlite3.connect(self.cache_path, timeout=5)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS layers (
+                name TEXT PRIMARY KEY, table_file TEXT, signature TEXT);
+            CREATE TABLE IF NOT EXISTS fields (
+                layer TEXT, position INTEGER, name TEXT, type TEXT);
+            """)
+        return conn
+
+    # ----------------------------------------------------------------------
+    def load(self):
+        """Load cached layers.
+
+        Return tuple (files_signature, { layer_name: (table_file,
+        signature, {column_name: column_type}) }); empty if nothing cached.
+        """
+        if not os.path.exists(self.cache_path):
+            return None, {}
+        try:
+            conn = self._connect()
+            try:
+                meta = dict(conn.execute('SELECT key, value FROM meta'))
+                if meta.get('version') != CACHE_FORMAT_VERSION:
+                    return None, {}
+                layers = {
+                    name: (table_file, signature, {})
+                    for name, table_file, signature in conn.execute(
+                        'SELECT name, table_file, signature FROM layers')
+                }
+                for layer, name, type_ in conn.execute(
+                        'SELECT layer, name, type FROM fields '
+                        'ORDER BY layer, position'):
+                    if layer in layers:
+                        layers[layer][2][name] = type_
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None, {}
+        return meta.get('files_signature'), layers
+
+    # ----------------------------------------------------------------------
+    def save(self, files_signature, layers):
+        """Replace cached layers with the ones provided.
+
+        Layers are passed in the same form as returned by the `load` method.
+        """
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('DELETE FROM meta')
+                    conn.execute('DELETE FROM layers')
+                    conn.execute('DELETE FROM fields')
+                    conn.executemany(
+                        'INSERT INTO meta VALUES (?, ?)',
+                        [('version', CACHE_FORMAT_VERSION),
+                         ('files_signature', files_signature)])
+                    conn.executemany(
+                        'INSERT INTO layers VALUES (?, ?, ?)',
+                        [(name, table_file, signature)
+                         for name, (table_file, signature,
+                                    _fields) in layers.items()])
+                    conn.executemany(
+                        'INSERT INTO fields VALUES (?, ?, ?, ?)',
+                        [(name, position, col_name, col_type)
+                         for name, (_file, _sig, fields) in layers.items()
+                         for position, (col_name, col_type) in enumerate(
+                             fields.items())])
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+        return
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """Remove the cache file."""
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+        return
@@ -1,6 +1,9 @@
 # -*- coding: UTF-8 -*-
 """Configuration parameters to start application with."""
 
+import os
+import tempfile
+
 # define if application starts with a tab created with the geodatabase
 # and query executed with the result table drawn
 # set to False when running unit tests
@@ -14,3 +17,101 @@ project_name = 'GDBee'
 not_connected_to_gdb_message = 'Not connected to any geodatabase...'
 
 sql_dialects_names = ['SQLite', 'OGRSQL']  # SQLite is used by default
+
+# number of idle read-only dataset handles kept open per geodatabase;
+# handles are shared between all tabs connected to the same geodatabase
+connection_pool_max_idle = 4
+
+# geodatabase schemas are cached on disk and introspected again only for
+# the tables which have been modified since the last connect
+use_schema_cache = True
+schema_cache_dir = os.path.join(tempfile.gettempdir(), project_name.lower(),
+                                'schemas')
+
+# number of threads (each with its own dataset handle) introspecting
+# geodatabase layers in background when connecting to a geodatabase
+schema_loader_workers = 4
+
+# where SQL queries are executed: 'local' runs them in a thread of the
+# application process; 'process' runs them in a pool of worker processes
+# (each with its own dataset handles) so that tabs use multiple cores and
+# a GDAL crash does not take the application down
+query_execution_mode = 'local'
+query_server_max_idle_processes = 3
+
+# how the number of rows of a result set is found when the driver cannot
+# report it without reading the result: 'background' counts rows with a
+# separate query while rows are fetched, 'metadata' and 'unknown' leave the
+# total unknown until all rows have been fetched ('unknown' does not even
+# ask the driver for a count)
+row_count_strategy = 'background'
+
+# number of rows read along with executing the query to draw the table
+# with; the rest of the rows are fetched in background, up to the limit,
+# and further on as user scrolls down the table
+first_rows_count = 200
+progressive_fetch_max_rows = 10000
+
+# local result layers are read in record batches through the Arrow C stream
+# interface when GDAL (3.6+) and pyarrow provide it; features are read one
+# by one otherwise or when this is set to False
+use_arrow_stream = True
+arrow_batch_size = 10000
+
+# geometries are kept as WKB and the table shows WKT previews made only for
+# the cells being painted: cut to the length given and with coordinates
+# rounded to the number of decimals (None keeps them as they are); copying
+# and exporting use the full WKT
+wkt_preview_max_length = 250
+wkt_preview_precision = None
+wkt_preview_cache_size = 1000
+
+# number of loaded rows, evenly spread, measured to size the result table
+# columns; columns never get wider than the limit for their kind of values
+column_width_sample_rows = 100
+
+# results with more rows than the limit whose layer can seek to a row fast
+# (OLCFastSetNextByIndex) are not fetched sequentially; rows are read in
+# windows around the rows being shown and only the most recently used
+# windows are kept in memory
+random_access_min_rows = progressive_fetch_max_rows
+random_access_window_rows = 500
+random_access_max_windows = 20
+
+# rows of results that cannot seek to a row fast are written in background
+# into a temporary SQLite file which the table, sorting, copying and
+# exporting read from; the memory SQLite uses for its page cache is capped
+use_spill_file = True
+spill_dir = os.path.join(tempfile.gettempdir(), project_name.lower(),
+                         'results')
+spill_batch_rows = 10000
+spill_cache_size_mb = 64
+
+# exports read rows with a cursor of their own in batches of this size and
+# write them to files
+export_batch_rows = 10000
+
+# data frame and layer exports are written into new files with unique
+# names here
+export_dir = os.path.join(tempfile.gettempdir(), project_name.lower(),
+                          'exports')
+
+# Markdown tables are written into files batch by batch; column widths are
+# measured on this number of the first rows
+markdown_width_sample_rows = 1000
+
+# exported files are shown in the export window by pages of this number of
+# lines; only the page being shown is read from the file
+export_viewer_page_lines = 1000
+
+# query documents with more lines than the limit are highlighted around the
+# visible lines first (with a margin); the rest of the lines are highlighted
+# in slices while the application is idle; words are not highlighted at all
+# in documents with more characters than the limit
+large_document_blocks = 2000
+highlight_margin_blocks = 100
+highlight_slice_blocks = 500
+highlight_words_max_chars = 5 * 1024 * 1024
+
+# number of completions shown to user for the word being typed
+completion_max_items = 50
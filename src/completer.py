@@ -3,60 +3,174 @@
 
 import io
 from PyQt5.QtWidgets import QCompleter
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
 
+from vocabulary import PrefixIndex, EMPTY_VOCABULARY
+from cfg import completion_max_items
 
-########################################################################
-class Completer(object):
-    """Comleter class to use in the query text editor."""
+# keywords and functions indexes shared by all tabs
+_standard_indexes = None
 
-    # ----------------------------------------------------------------------
-    def __init__(self):
-        """Initialize Completer class with the keywords and functions."""
+
+# ----------------------------------------------------------------------
+def get_standard_indexes():
+    """Get indexes of SQL keywords and of functions."""
+    global _standard_indexes
+    if _standard_indexes is None:
         with io.open(
                 r'completer_data\keywords.txt', 'r', encoding='utf-8') as f:
-            lowercase_keywords = [k.rstrip().lower() for k in f.readlines()]
-            uppercase_keywords = [k.upper() for k in lowercase_keywords]
-            titlecase_keywords = [k.title() for k in lowercase_keywords]
+            keywords = [k.rstrip().lower() for k in f.readlines()]
 
         with io.open(
                 r'completer_data\functions.txt', 'r', encoding='utf-8') as f:
-            titlecase_funcs = [f.rstrip() for f in f.readlines()]
-            uppercase_funcs = [f.upper() for f in titlecase_funcs]
-            lowercase_funcs = [f.lower() for f in titlecase_funcs]
-
-        all_keywords_and_funcs = [
-            lowercase_keywords,
-            uppercase_keywords,
-            titlecase_keywords,
-            lowercase_funcs,
-            uppercase_funcs,
-            titlecase_funcs,
-        ]
+            funcs = [f.rstrip() for f in f.readlines()]
+        _standard_indexes = (PrefixIndex(keywords), PrefixIndex(funcs))
+    return _standard_indexes
+
+
+# ----------------------------------------------------------------------
+def match_case(word, prefix):
+    """Get word in the case of the prefix the user has typed."""
+    if prefix.isupper():
+        return word.upper()
+    if prefix[:1].isupper():
+        return word.title()
+    return word.lower()
+
+
+########################################################################
+class CompletionModel(QAbstractListModel):
+    """Model with the best completions of the prefix being typed.
+
+    Keywords are suggested in the case of the prefix; functions and
+    geodatabase items keep their own case.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, parent=None):
+        """Initialize CompletionModel with no completions."""
+        super(CompletionModel, self).__init__(parent)
+        self.keywords_index, self.functions_index = get_standard_indexes()
+        self.vocabulary = EMPTY_VOCABULARY
+        self.max_items = completion_max_items
+        self.matches = []
+        return
+
+    # ----------------------------------------------------------------------
+    def set_prefix(self, prefix, tables=None, qualifier=None):
+        """Find completions of the prefix.
+
+        `tables` are {table_name_or_alias_lowercase: table_name} of the
+        statement being edited; their columns come first and columns of
+        other tables are not suggested. After a table name or alias and a
+        dot (the `qualifier`), only columns of that table are suggested.
+        Columns of all tables are suggested when none of the tables is in
+        the vocabulary.
+        """
+        tables = tables or {}
+        qualified = self.get_known_tables(
+            [tables[qualifier.lower()]]
+            if qualifier is not None and qualifier.lower() in tables else [])
+        if qualified:
+            matches = self.vocabulary.get_columns_matches(
+                qualified, prefix, self.max_items)
+        else:
+            matches = self.get_matches(
+                prefix, self.get_known_tables(set(tables.values())))
+
+        self.beginResetModel()
+        self.matches = matches[:self.max_items]
+        self.endResetModel()
+        return
+
+    # ----------------------------------------------------------------------
+    def get_known_tables(self, table_names):
+        """Get names of the tables found in the vocabulary.
 
-        self.standard_items = [
-            keyword for sublist in all_keywords_and_funcs for keyword in sublist
+        A table qualified with its schema is also looked up by its name.
+        """
+        known = []
+        for table_name in table_names:
+            for name in (table_name, table_name.split('.')[-1]):
+                if name.lower() in self.vocabulary.tables:
+                    known.append(name)
+                    break
+        return known
+
+    # ----------------------------------------------------------------------
+    def get_matches(self, prefix, table_names):
+        """Get columns of the tables followed by other words to complete."""
+        keywords = [
+            match_case(keyword, prefix)
+            for keyword in self.keywords_index.get_matches(
+                prefix, self.max_items)
         ]
+        matches = set(keywords)
+        matches.update(self.functions_index.get_matches(
+            prefix, self.max_items))
+
+        columns = []
+        if table_names:
+            columns = self.vocabulary.get_columns_matches(
+                table_names, prefix, self.max_items)
+            matches.update(self.vocabulary.tables_index.get_matches(
+                prefix, self.max_items))
+        else:
+            matches.update(self.vocabulary.index.get_matches(
+                prefix, self.max_items))
+        matches.difference_update(columns)
+        return columns + sorted(matches, key=lambda x: x.lower())
 
-        self.completer = QCompleter(self.standard_items)
+    # ----------------------------------------------------------------------
+    def rowCount(self, parent=QModelIndex()):  # noqa: N802
+        """Override built-in method."""
+        if parent.isValid():
+            return 0
+        return len(self.matches)
+
+    # ----------------------------------------------------------------------
+    def data(self, index, role=Qt.DisplayRole):
+        """Override built-in method."""
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.matches[index.row()]
+        return None
 
-        self.completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+
+########################################################################
+class PrefixCompleter(QCompleter):
+    """Completer asking its model for the completions of the prefix.
+
+    Tables of the statement being edited in the text editor the completer
+    is set for are used to suggest their columns.
+    """
+
+    # ----------------------------------------------------------------------
+    def setCompletionPrefix(self, prefix):  # noqa: N802
+        """Override built-in method to find completions of the prefix."""
+        tables, qualifier = self.widget().get_completion_context()
+        self.model().set_prefix(prefix, tables, qualifier)
+        super(PrefixCompleter, self).setCompletionPrefix(prefix)
+        return
+
+
+########################################################################
+class Completer(object):
+    """Comleter class to use in the query text editor."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Initialize Completer class with the keywords and functions."""
+        self.model = CompletionModel()
+        self.completer = PrefixCompleter(self.model)
+
+        # the model has only the completions of the prefix already
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.completer.setCaseSensitivity(Qt.CaseInsensitive)
         self.completer.setWrapAround(False)
         return
 
     # ----------------------------------------------------------------------
-    def update_completer_string_list(self, items):
-        """Update completer string list to include additional strings.
-
-        The list of additional strings include geodatabase items.
-        """
-        cur_items = []
-        titlecase_items = [i.title() for i in items]
-        uppercase_items = [i.upper() for i in items]
-        lowercase_items = [i.lower() for i in items]
-
-        cur_items.extend(self.standard_items)
-        cur_items.extend(titlecase_items + uppercase_items + lowercase_items)
-        self.completer.model().setStringList(cur_items)
+    def set_vocabulary(self, vocabulary):
+        """Complete geodatabase items of the vocabulary."""
+        self.model.vocabulary = vocabulary
         return
@@ -0,0 +1,237 @@
+# -*- coding: UTF-8 -*-
+"""Exporting query results to files in batches."""
+
+import io
+import os
+import tempfile
+
+from result_store import BatchReader, ResultStore, INT_COLUMN, FLOAT_COLUMN, pa
+from cfg import export_batch_rows, export_dir, markdown_width_sample_rows
+
+
+########################################################################
+class ExportCursor(object):
+    """Cursor of its own over the rows of a result being exported.
+
+    Rows are read from the spill file of the result if all of them have
+    been written there (in the order the table is sorted by); otherwise
+    the query is executed once more with a dataset handle of its own.
+    Either way the cursor of the result drawn in the table is not used.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self,
+                 gdb,
+                 sql_query,
+                 dialect,
+                 with_geometry=True,
+                 spill=None,
+                 batch_rows=export_batch_rows):
+        """Initialize ExportCursor with the query the result comes from."""
+        self.gdb = gdb
+        self.sql_query = sql_query
+        self.dialect = dialect
+        self.with_geometry = with_geometry
+        self.spill = spill
+        self.batch_rows = batch_rows
+        self.res = None
+        self.reader = None
+        return
+
+    # ----------------------------------------------------------------------
+    def __enter__(self):
+        """Execute the query unless rows are read from the spill file."""
+        if self.spill is None:
+            self.res, errors = self.gdb.execute_sql(self.sql_query,
+                                                    self.dialect)
+            if self.res is None:
+                raise RuntimeError(errors)
+            geom_column = self.res.GetGeometryColumn(
+            ) if self.with_geometry else ''
+            self.reader = BatchReader(self.res, geom_column=geom_column)
+        return self
+
+    # ----------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release the result of the query executed for exporting."""
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.res is not None:
+            self.gdb.release_result(self.res)
+            self.res = None
+        return False
+
+    # ----------------------------------------------------------------------
+    def iter_batches(self):
+        """Yield stores with up to `batch_rows` rows each.
+
+        The first store is yielded even if the result has no rows so that
+        writers know the columns.
+        """
+        if self.spill is not None:
+            start = 0
+            while True:
+                store = self.spill.read_rows(start, self.batch_rows)
+                if store.row_count or not start:
+                    yield store
+                if store.row_count < self.batch_rows:
+                    break
+                start += store.row_count
+            return
+
+        is_first = True
+        while is_first or not self.reader.is_exhausted:
+            store = ResultStore(self.reader.fields, self.reader.geom_column)
+            store.append_batch(*self.reader.read(self.batch_rows))
+            if store.row_count or is_first:
+                yield store
+            is_first = False
+        return
+
+    # ----------------------------------------------------------------------
+    def get_geom_column(self):
+        """Get name of the geometry column rows are read with; '' if none."""
+        if self.spill is not None:
+            return self.spill.geom_column
+        return self.reader.geom_column
+
+    # ----------------------------------------------------------------------
+    def read_dataframe(self):
+        """Read all rows into a pandas data frame; use for small results."""
+        import pandas as pd
+        frames, start_index = [], 1
+        for store in self.iter_batches():
+            frames.append(store.to_dataframe(start_index))
+            start_index += store.row_count
+        return pd.concat(frames)
+
+
+# ----------------------------------------------------------------------
+def write_csv(cursor, path, sep=';'):
+    """Write rows into a CSV file; return number of rows written."""
+    number_of_rows = 0
+    with io.open(path, 'w', encoding='utf-8', newline='') as f:
+        for store in cursor.iter_batches():
+            df = store.to_dataframe(number_of_rows + 1)
+            df.to_csv(f, sep=sep, header=not number_of_rows)
+            number_of_rows += store.row_count
+    return number_of_rows
+
+
+# ----------------------------------------------------------------------
+def write_feather(cursor, path):
+    """Write rows into an Arrow IPC (Feather) file; return number of rows.
+
+    Column arrays of each batch are handed to arrow without copying;
+    types are kept and geometries are written as WKB.
+    """
+    number_of_rows = 0
+    writer = None
+    try:
+        for store in cursor.iter_batches():
+            batch = store.to_arrow()
+            if writer is None:
+                writer = pa.ipc.new_file(path, batch.schema)
+            writer.write_batch(batch)
+            number_of_rows += store.row_count
+    finally:
+        if writer is not None:
+            writer.close()
+    return number_of_rows
+
+
+# ----------------------------------------------------------------------
+def get_export_path(suffix):
+    """Get path of a new file in the export directory."""
+    if not os.path.exists(export_dir):
+        os.makedirs(export_dir)
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix='data_', dir=export_dir)
+    os.close(fd)
+    return path
+
+
+# ----------------------------------------------------------------------
+def export_dataframe(cursor):
+    """Write rows into a new file and get Python code to load them with.
+
+    Rows are written into a Feather file if pyarrow is installed and into
+    a CSV file otherwise.
+    """
+    if pa is None:
+        path = get_export_path('.csv')
+        write_csv(cursor, path, sep=';')
+        return ('import pandas as pd\n'
+                'df = pd.read_csv(r"{0}", sep=";", index_col=0)'.format(path))
+
+    path = get_export_path('.feather')
+    write_feather(cursor, path)
+    snippet = 'import pandas as pd\ndf = pd.read_feather(r"{0}")'.format(path)
+    geom_column = cursor.get_geom_column()
+    if geom_column:
+        snippet += (
+            '\n\n# to get a geopandas data frame\n'
+            'import geopandas as gpd\n'
+            'gdf = gpd.GeoDataFrame(\n'
+            '    df, geometry=gpd.GeoSeries.from_wkb(df.pop("{0}")))'.format(
+                geom_column))
+    return snippet
+
+
+# ----------------------------------------------------------------------
+def format_markdown_value(value):
+    """Get text of a value to put into a Markdown table cell."""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '{0:.4f}'.format(value)
+    return str(value).replace('|', '\\|').replace('\n', ' ')
+
+
+# ----------------------------------------------------------------------
+def format_markdown_row(cells, widths, is_right_aligned):
+    """Get line of a Markdown pipe table with cells padded to the widths."""
+    return u'| {0} |\n'.format(' | '.join(
+        cell.rjust(width) if is_right else cell.ljust(width)
+        for cell, width, is_right in zip(cells, widths, is_right_aligned)))
+
+
+# ----------------------------------------------------------------------
+def write_markdown(cursor, path, width_sample_rows=markdown_width_sample_rows):
+    """Write rows into a Markdown pipe table; return number of rows written.
+
+    Rows are written batch by batch keeping only one batch in memory.
+    Column widths are measured on the first rows only; longer values
+    further on make their cells wider without breaking the table.
+    """
+    number_of_rows = 0
+    widths = is_right_aligned = None
+    with io.open(path, 'w', encoding='utf-8') as f:
+        for store in cursor.iter_batches():
+            rows = [[str(number_of_rows + row + 1)] + [
+                format_markdown_value(column.get_value(row))
+                for column in store.columns
+            ] for row in range(store.row_count)]
+
+            if widths is None:
+                headers = [''] + store.headers
+                is_right_aligned = [True] + [
+                    column.kind in (INT_COLUMN, FLOAT_COLUMN)
+                    for column in store.columns
+                ]
+                sample = rows[:width_sample_rows]
+                widths = [
+                    max([len(header)] + [len(cells[idx]) for cells in sample])
+                    for idx, header in enumerate(headers)
+                ]
+                f.write(format_markdown_row(headers, widths, is_right_aligned))
+                f.write(u'|{0}|\n'.format('|'.join(
+                    '-' * (width + 1) + ':' if is_right else
+                    ':' + '-' * (width + 1)
+                    for width, is_right in zip(widths, is_right_aligned))))
+
+            f.write(''.join(
+                format_markdown_row(cells, widths, is_right_aligned)
+                for cells in rows))
+            number_of_rows += store.row_count
+    return number_of_rows
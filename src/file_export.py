@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+"""Exporting query results into geospatial files with OGR drivers."""
+
+import os
+import threading
+from collections import OrderedDict
+
+import gdal
+import ogr
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# name of the layer exported rows are written into
+EXPORT_LAYER_NAME = 'result'
+
+# name shown to user: (OGR driver name, file extension)
+FILE_FORMATS = OrderedDict([
+    ('GeoPackage', ('GPKG', '.gpkg')),
+    ('FlatGeobuf', ('FlatGeobuf', '.fgb')),
+    ('GeoParquet', ('Parquet', '.parquet')),
+    ('GeoJSONSeq', ('GeoJSONSeq', '.geojsonl')),
+])
+
+
+# ----------------------------------------------------------------------
+def get_file_formats():
+    """Get file formats which drivers of the installed GDAL can write."""
+    return OrderedDict((name, (driver_name, ext))
+                       for name, (driver_name, ext) in FILE_FORMATS.items()
+                       if ogr.GetDriverByName(driver_name) is not None)
+
+
+# ----------------------------------------------------------------------
+def get_file_filter(file_formats):
+    """Get filter of file formats to use in a file dialog."""
+    return ';;'.join('{0} (*{1})'.format(name, ext)
+                     for name, (_driver_name, ext) in file_formats.items())
+
+
+# ----------------------------------------------------------------------
+def translate_query(gdb_path,
+                    sql_query,
+                    dialect,
+                    out_path,
+                    driver_name,
+                    layer_name=EXPORT_LAYER_NAME,
+                    callback=None):
+    """Write rows the query returns into a new file with the OGR driver.
+
+    GDAL opens the geodatabase, executes the query and copies features
+    into the file itself, so no rows are read into Python and geometries
+    and field types are kept as the driver supports them.
+    """
+    if os.path.exists(out_path):
+        # an empty file only reserves the name, e.g. a temporary file
+        if os.path.getsize(out_path):
+            ogr.GetDriverByName(driver_name).DeleteDataSource(out_path)
+        else:
+            os.remove(out_path)
+    ds = gdal.VectorTranslate(
+        out_path,
+        gdb_path,
+        format=driver_name,
+        SQLStatement=sql_query.strip().rstrip(';'),
+        SQLDialect=dialect or 'sqlite',
+        layerName=layer_name,
+        callback=callback)
+    if ds is None:
+        raise RuntimeError(gdal.GetLastErrorMsg() or
+                           'Failed to export into {0}'.format(out_path))
+    ds = None
+    return out_path
+
+
+########################################################################
+class FileExporter(QObject):
+    """Export rows of a query into a file in a background thread.
+
+    The query is executed once more by GDAL with its own dataset handle,
+    so the result drawn in the table is not read from.
+    """
+
+    progress = pyqtSignal(float)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    # ----------------------------------------------------------------------
+    def __init__(self,
+                 gdb_path,
+                 sql_query,
+                 dialect,
+                 out_path,
+                 driver_name,
+                 parent=None):
+        """Initialize FileExporter with the query and the file to write."""
+        super(FileExporter, self).__init__(parent)
+        self.gdb_path = gdb_path
+        self.sql_query = sql_query
+        self.dialect = dialect
+        self.out_path = out_path
+        self.driver_name = driver_name
+        self.is_cancelled = False
+        self.thread = None
+        self._percent = None  # last percentage reported
+        return
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Start exporting in a background thread."""
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Stop exporting at the next progress report of GDAL."""
+        self.is_cancelled = True
+        return
+
+    # ----------------------------------------------------------------------
+    def is_running(self):
+        """Check whether the file is being written."""
+        return self.thread is not None and self.thread.is_alive()
+
+    # ----------------------------------------------------------------------
+    def _on_progress(self, complete, message, data):
+        """Report progress to GDAL; returning 0 makes it stop.
+
+        GDAL reports progress for every feature, so the signal is emitted
+        only when the whole percentage changes.
+        """
+        percent = int(complete * 100)
+        if percent != self._percent:
+            self._percent = percent
+            self.progress.emit(complete)
+        return 0 if self.is_cancelled else 1
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        """Write the file emitting the path once it is done."""
+        try:
+            translate_query(self.gdb_path, self.sql_query, self.dialect,
+                            self.out_path, self.driver_name,
+                            callback=self._on_progress)
+        except Exception as err:
+            # a file written partway is of no use whatever stopped GDAL
+            if os.path.exists(self.out_path):
+                os.remove(self.out_path)
+            self.failed.emit('Export cancelled' if self.is_cancelled else
+                             str(err))
+            return
+        self.finished.emit(self.out_path)
+        return
@@ -1,9 +1,239 @@
 # -*- coding: UTF-8 -*-
 """Geodatabase class representing a file geodatabase object."""
 
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
 import ogr
 ogr.UseExceptions()
 
+from catalog_cache import SchemaCatalogCache
+from vocabulary import get_vocabulary
+from cfg import (connection_pool_max_idle, use_schema_cache,
+                 query_execution_mode)
+
+
+########################################################################
+class CancelToken(object):
+    """Token to cancel a running query with callbacks interrupting it."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self):
+        """Initialize CancelToken in the not cancelled state."""
+        self.is_cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Cancel the query calling all registered callbacks."""
+        with self._lock:
+            self.is_cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return
+
+    # ----------------------------------------------------------------------
+    def add_callback(self, callback):
+        """Register callback; it is called at once if already cancelled."""
+        with self._lock:
+            if not self.is_cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+        return
+
+    # ----------------------------------------------------------------------
+    def remove_callback(self, callback):
+        """Unregister callback once the query can no longer be cancelled."""
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+        return
+
+
+########################################################################
+class PoolEntry(object):
+    """Dataset handles kept open for a single geodatabase path."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, path, signature):
+        """Initialize PoolEntry with the state of the gdb directory."""
+        self.path = path
+        self.signature = signature
+        self.idle = []  # handles ready to be borrowed
+        self.busy = set()  # handles borrowed or pinned by result layers
+        return
+
+
+########################################################################
+class ConnectionPool(object):
+    """Pool of long-lived read-only OGR dataset handles per gdb path.
+
+    Handles are shared by every tab connected to the same geodatabase.
+    A handle that has an outstanding result layer (returned by the
+    `ExecuteSQL` method) is pinned until the result is released so that
+    two result sets never share one dataset handle.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, max_idle=connection_pool_max_idle):
+        """Initialize ConnectionPool with no open handles."""
+        self.max_idle = max_idle
+        self._entries = {}
+        self._results = {}  # id(result layer) -> (path, result, handle)
+        self._stale = set()  # handles to close once they are given back
+        self._lock = threading.RLock()
+        return
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def get_key(path):
+        """Get the key a geodatabase path is pooled with."""
+        return os.path.normcase(os.path.abspath(path))
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def get_signature(path):
+        """Get the state of the gdb directory; None if it does not exist."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isdir(path):
+            return None
+        return (stat.st_mtime, stat.st_ino)
+
+    # ----------------------------------------------------------------------
+    def _get_entry(self, path):
+        """Get pool entry for the path revalidating it if gdb has changed."""
+        key = self.get_key(path)
+        signature = self.get_signature(path)
+        entry = self._entries.get(key)
+        if entry and entry.signature != signature:
+            self._retire_entry(entry)
+            entry = None
+        if signature is None:
+            return None
+        if not entry:
+            entry = PoolEntry(path, signature)
+            self._entries[key] = entry
+        return entry
+
+    # ----------------------------------------------------------------------
+    def _retire_entry(self, entry):
+        """Close idle handles of the entry; busy ones are closed on release."""
+        for ds in entry.idle:
+            ds.Destroy()
+        entry.idle = []
+        self._stale.update(entry.busy)
+        self._entries.pop(self.get_key(entry.path), None)
+        return
+
+    # ----------------------------------------------------------------------
+    def is_valid(self, path):
+        """Check if path is a valid file gdb opening it only if not cached."""
+        with self._lock:
+            entry = self._get_entry(path)
+            if not entry:
+                return False
+            if entry.idle or entry.busy:
+                return True
+        try:
+            ds = self.acquire(path)
+        except Exception:
+            return False
+        self.release(path, ds)
+        return True
+
+    # ----------------------------------------------------------------------
+    def acquire(self, path):
+        """Borrow a dataset handle for the path opening a new one if needed."""
+        with self._lock:
+            entry = self._get_entry(path)
+            if entry and entry.idle:
+                ds = entry.idle.pop()
+                entry.busy.add(ds)
+                return ds
+
+        ds = ogr.Open(path, 0)
+        if not ds:
+            raise RuntimeError('Failed to open {0}'.format(path))
+        with self._lock:
+            entry = self._get_entry(path)
+            if entry:
+                entry.busy.add(ds)
+        return ds
+
+    # ----------------------------------------------------------------------
+    def release(self, path, ds):
+        """Give the dataset handle back to the pool."""
+        with self._lock:
+            entry = self._entries.get(self.get_key(path))
+            if entry:
+                entry.busy.discard(ds)
+            if (entry and ds not in self._stale
+                    and len(entry.idle) < self.max_idle):
+                entry.idle.append(ds)
+                return
+            self._stale.discard(ds)
+        ds.Destroy()
+        return
+
+    # ----------------------------------------------------------------------
+    @contextmanager
+    def connection(self, path):
+        """Borrow a dataset handle for the duration of the `with` block."""
+        ds = self.acquire(path)
+        try:
+            yield ds
+        finally:
+            self.release(path, ds)
+
+    # ----------------------------------------------------------------------
+    def pin_result(self, path, ds, res):
+        """Keep the handle borrowed while its result layer is in use."""
+        with self._lock:
+            self._results[id(res)] = (path, res, ds)
+        return
+
+    # ----------------------------------------------------------------------
+    def release_result(self, res):
+        """Release the result layer and give its handle back to the pool."""
+        with self._lock:
+            path, res, ds = self._results.pop(id(res), (None, None, None))
+        if ds is None:
+            return
+        ds.ReleaseResultSet(res)
+        self.release(path, ds)
+        return
+
+    # ----------------------------------------------------------------------
+    def get_outstanding_results_count(self, path):
+        """Get number of result layers not released yet for the path."""
+        key = self.get_key(path)
+        with self._lock:
+            return len([
+                1 for res_path, _res, _ds in self._results.values()
+                if self.get_key(res_path) == key
+            ])
+
+    # ----------------------------------------------------------------------
+    def clear(self, path):
+        """Close all idle handles of the path."""
+        with self._lock:
+            entry = self._entries.get(self.get_key(path))
+            if entry:
+                self._retire_entry(entry)
+        return
+
+
+connection_pool = ConnectionPool()
+
 
 ########################################################################
 class Geodatabase(object):
@@ -13,17 +243,18 @@ class Geodatabase(object):
     def __init__(self, path):
         """Initialize Geodatabase class with basic properties."""
         self.path = path
-        self.ds = None
+        self.pool = connection_pool
+        self.execution_mode = query_execution_mode
+        self.schema_cache = SchemaCatalogCache(path)
+        self._schemas = None
+        self._schemas_signature = None
         return
 
     # ----------------------------------------------------------------------
     def get_items(self):
         """Get list of tables and feature classes inside a file gdb."""
-        ds = ogr.Open(self.path, 0)
-        return list({
-            ds.GetLayerByIndex(i).GetName()
-            for i in range(0, ds.GetLayerCount())
-        })
+        with self.pool.connection(self.path) as ds:
+            return self._get_items(ds)
 
     # ----------------------------------------------------------------------
     def get_schemas(self):
@@ -31,72 +262,234 @@ class Geodatabase(object):
 
         Return dict { layer_name: [ {columns_name: column_type} ] }
         """
-        ds = ogr.Open(self.path, 0)
-        schemas = {}
-        for item in self.get_items():
-            cols_names = []
-            lyr = ds.GetLayerByName(item)
-            lyr_defn = lyr.GetLayerDefn()
-            geom_col = lyr.GetGeometryColumn()
-            cols_names.extend([col.GetName() for col in lyr.schema])
-            field_types = {
-                col_name: lyr_defn.GetFieldDefn(
-                    lyr_defn.GetFieldIndex(col_name)).GetTypeName()
-                for col_name in cols_names
-            }
-            if geom_col:
-                field_types[geom_col] = 'Geometry'
-            schemas[item] = field_types
-        return schemas
+        return self.load_schemas()
 
     # ----------------------------------------------------------------------
-    def is_valid(self):
-        """Check if .gdb folder provided by user is a valid file gdb."""
+    def get_cached_schemas(self):
+        """Get schemas without opening the gdb; None if any table changed."""
+        files_stats = self.schema_cache.get_table_files_stats()
+        files_signature = self.schema_cache.get_files_signature(files_stats)
+        if self._schemas is not None and (
+                self._schemas_signature == files_signature):
+            return dict(self._schemas)
+
+        if use_schema_cache:
+            cached_signature, cached_layers = self.schema_cache.load()
+            if cached_layers and cached_signature == files_signature:
+                self._set_schemas(cached_layers, files_signature)
+                return dict(self._schemas)
+        return None
+
+    # ----------------------------------------------------------------------
+    def get_vocabulary(self):
+        """Get vocabulary of the loaded schemas; None if not loaded yet.
+
+        The vocabulary is shared by all tabs connected to the geodatabase.
+        """
+        if self._schemas is None:
+            return None
+        return get_vocabulary(
+            self.pool.get_key(self.path), self._schemas_signature,
+            self._schemas)
+
+    # ----------------------------------------------------------------------
+    def load_schemas(self, callback=None, workers=1, cancel_event=None):
+        """Load schemas of all tables and feature classes inside a file gdb.
+
+        Schemas are read from the on-disk catalog cache; only the layers
+        whose `.gdbtable` files have changed since they were cached are
+        introspected again, by a pool of `workers` threads each borrowing
+        its own dataset handle. The `callback` is called with dicts
+        { layer_name: {column_name: column_type} } as layers become known.
+        Return the same dict for all layers.
+        """
+        schemas = self.get_cached_schemas()
+        if schemas is not None:
+            if callback:
+                callback(schemas)
+            return schemas
+
+        files_stats = self.schema_cache.get_table_files_stats()
+        files_signature = self.schema_cache.get_files_signature(files_stats)
+        cached_layers = {}
+        if use_schema_cache:
+            _cached_signature, cached_layers = self.schema_cache.load()
+
+        layers, items_to_load = {}, []
+        with self.pool.connection(self.path) as ds:
+            tables_files = self._get_tables_files(ds)
+            for item in self._get_items(ds):
+                table_file = tables_files.get(item.lower())
+                signature = files_stats.get(table_file, files_signature)
+                cached_layer = cached_layers.get(item)
+                if cached_layer and cached_layer[:2] == (table_file,
+                                                         signature):
+                    layers[item] = cached_layer
+                else:
+                    items_to_load.append((item, table_file, signature))
+
+        if callback and layers:
+            callback({item: layer[2] for item, layer in layers.items()})
+
+        # spread the layers between workers, each with its own handle
+        chunks = [items_to_load[i::workers] for i in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loaded_chunks = executor.map(
+                lambda chunk: self._load_layers(chunk, callback, cancel_event),
+                [chunk for chunk in chunks if chunk])
+            for loaded_layers in loaded_chunks:
+                layers.update(loaded_layers)
+
+        if cancel_event and cancel_event.is_set():
+            return {item: layer[2] for item, layer in layers.items()}
+
+        if use_schema_cache:
+            self.schema_cache.save(files_signature, layers)
+        self._set_schemas(layers, files_signature)
+        return dict(self._schemas)
+
+    # ----------------------------------------------------------------------
+    def _load_layers(self, items, callback, cancel_event):
+        """Introspect layers using a dataset handle borrowed from the pool."""
+        layers = {}
+        with self.pool.connection(self.path) as ds:
+            for item, table_file, signature in items:
+                if cancel_event and cancel_event.is_set():
+                    break
+                field_types = self._get_layer_schema(ds.GetLayerByName(item))
+                layers[item] = (table_file, signature, field_types)
+                if callback:
+                    callback({item: field_types})
+        return layers
+
+    # ----------------------------------------------------------------------
+    def _set_schemas(self, layers, files_signature):
+        """Keep schemas of the layers in memory for the tabs sharing gdb."""
+        self._schemas = {
+            item: field_types
+            for item, (_file, _sig, field_types) in layers.items()
+        }
+        self._schemas_signature = files_signature
+        return
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _get_tables_files(ds):
+        """Get {layer_name_lowercase: gdbtable_file_name} of the gdb tables.
+
+        Rows of the `GDB_SystemCatalog` table are numbered in the same way
+        as the `a<hex row id>.gdbtable` files that store the tables.
+        Return empty dict if the system catalog cannot be read in which case
+        the layers are cached against the state of the whole gdb.
+        """
         try:
-            ds = ogr.Open(self.path, 0)
+            catalog = ds.GetLayerByName('GDB_SystemCatalog')
         except Exception:
-            return False
+            return {}
+        if not catalog:
+            return {}
+        tables_files = {}
+        catalog.ResetReading()
+        feat = catalog.GetNextFeature()
+        while feat:
+            tables_files[feat.GetField('Name').lower()] = (
+                'a{0:08x}.gdbtable'.format(feat.GetFID()))
+            feat = catalog.GetNextFeature()
+        return tables_files
 
-        if ds:
-            ds.Destroy()
-            return True
-        return False
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _get_items(ds):
+        """Get names of the layers in the open dataset."""
+        return list({
+            ds.GetLayerByIndex(i).GetName()
+            for i in range(0, ds.GetLayerCount())
+        })
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def _get_layer_schema(lyr):
+        """Get dict {column_name: column_type} of the OGR layer."""
+        lyr_defn = lyr.GetLayerDefn()
+        field_types = {}
+        for i in range(lyr_defn.GetFieldCount()):
+            field_defn = lyr_defn.GetFieldDefn(i)
+            field_types[field_defn.GetName()] = field_defn.GetTypeName()
+        geom_col = lyr.GetGeometryColumn()
+        if geom_col:
+            field_types[geom_col] = 'Geometry'
+        return field_types
+
+    # ----------------------------------------------------------------------
+    def is_valid(self):
+        """Check if .gdb folder provided by user is a valid file gdb."""
+        return self.pool.is_valid(self.path)
 
     # ----------------------------------------------------------------------
     def open_connection(self):
         """Open geodatabase for reading.
 
-        Need to keep open for interacting with layers returned after
-        running the `ExecuteSQL` method.
+        Warms up the pooled handle so that the first query does not have
+        to wait for the geodatabase to be opened.
         """
-        self.ds = ogr.Open(self.path, 0)
+        with self.pool.connection(self.path):
+            pass
         return
 
     # ----------------------------------------------------------------------
     def close_connection(self):
-        """Close connection to geodatabase."""
-        if self.ds:
-            self.ds.Destroy()
+        """Close idle pooled connections to geodatabase."""
+        self.pool.clear(self.path)
         return
 
     # ----------------------------------------------------------------------
-    def execute_sql(self, query, dialect='sqlite'):
+    def release_result(self, res):
+        """Release result layer returned by `execute_sql` method."""
+        if res is None:
+            return
+        if hasattr(res, 'release'):  # result living in a worker process
+            res.release()
+        else:
+            self.pool.release_result(res)
+        return
+
+    # ----------------------------------------------------------------------
+    def execute_sql(self, query, dialect='sqlite', cancel_token=None):
         """Execute SQL query against a geodatabase using a `ExecuteSQL` method.
 
         http://gdal.org/python/osgeo.ogr.DataSource-class.html#ExecuteSQL.
+
+        The result layer keeps its dataset handle borrowed from the pool
+        until it is given back with the `release_result` method. In the
+        `process` execution mode the query is executed by a worker process
+        which can be killed with the `cancel_token`.
         """
+        if self.execution_mode == 'process':
+            from query_server import query_server
+            return query_server.execute(self.path, query, dialect,
+                                        cancel_token)
+
         # TODO trigger using spatial index in SQLite?
+        res, errors = None, None
+        try:
+            ds = self.pool.acquire(self.path)
+        except Exception as err:
+            return res, err.args[0]
+
         try:
             if not dialect:
                 dialect = 'sqlite'
-            res, errors = None, None
             do_commit_transaction = True
             if dialect.lower() == 'sqlite':
                 do_commit_transaction = False
-            res = self.ds.ExecuteSQL(query, dialect=dialect)
+            res = ds.ExecuteSQL(query, dialect=dialect)
             if do_commit_transaction:
                 res.CommitTransaction()
         except Exception as err:
             errors = err.args[0]
 
+        if res is not None:
+            self.pool.pin_result(self.path, ds, res)
+        else:
+            self.pool.release(self.path, ds)
         return res, errors
@@ -47,13 +47,42 @@ syntaxhighlighter.py
 """
 
 import io
-from PyQt5.QtCore import Qt, QRegExp
+import re
+
+from PyQt5.QtCore import Qt, QPoint, QTimer
 from PyQt5.QtGui import (QTextCharFormat, QColor, QFont, QSyntaxHighlighter)
 
+from vocabulary import EMPTY_VOCABULARY
+from cfg import (large_document_blocks, highlight_margin_blocks,
+                 highlight_slice_blocks, highlight_words_max_chars)
+
+# tokens a block of the query is split into with a single scan; comments
+# and strings come first so that words within them are not highlighted
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>--.*)
+    |(?P<block_comment>/\*)
+    |(?P<string>'[^']*'?|"[^"]*"?)
+    |(?P<number>(?<![\w.])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<word>[A-Za-z_][A-Za-z0-9_]*)(?P<call>\s*\()?
+    """, re.VERBOSE)
+
+# block state of a block which ends within a multi-line comment
+IN_BLOCK_COMMENT = 1
+# block state of a block of a large document not highlighted yet
+PENDING_BLOCK = -2
+
 
 ########################################################################
 class Highlighter(QSyntaxHighlighter):
-    """Highlighter class to provide text coloring in the query panel."""
+    """Highlighter class to provide text coloring in the query panel.
+
+    A block is tokenized in one pass; words are looked up in sets of
+    keywords and geodatabase tables and columns, so the cost of
+    highlighting does not depend on the number of geodatabase items.
+    Blocks of large documents away from the visible lines are left pending
+    and highlighted in slices while the application is idle.
+    """
 
     # ----------------------------------------------------------------------
     def __init__(self, parent=None):
@@ -70,116 +99,211 @@ class Highlighter(QSyntaxHighlighter):
                 'FontWeight': QFont.Normal,
             },
         }
+        self.gdb_formats = {}
+        for item_type, settings in self.gdb_highlight_settings.items():
+            fmt = QTextCharFormat()
+            fmt.setForeground(settings['Foreground'])
+            fmt.setFontWeight(settings['FontWeight'])
+            self.gdb_formats[item_type] = fmt
+        self.vocabulary = EMPTY_VOCABULARY
 
         # SQL keywords to show as bold and blue
-        keyword_format = QTextCharFormat()
-        keyword_format.setForeground(Qt.darkBlue)
-        keyword_format.setFontWeight(QFont.Bold)
+        self.keyword_format = QTextCharFormat()
+        self.keyword_format.setForeground(Qt.darkBlue)
+        self.keyword_format.setFontWeight(QFont.Bold)
 
         with io.open(
                 r'completer_data\keywords.txt', 'r', encoding='utf-8') as f:
             self.plain_keywords = [k.rstrip() for k in f.readlines()]
+        self.keywords = set(k.lower() for k in self.plain_keywords)
 
-        keyword_patterns = [
-            '\\b{0}\\b'.format(plain_keyword)
-            for plain_keyword in self.plain_keywords
-        ]
-
-        self.highlight_rules = []
-        for pattern in keyword_patterns:
-            regexp = QRegExp(pattern)
-            regexp.setCaseSensitivity(Qt.CaseInsensitive)
-            self.highlight_rules.append((regexp, keyword_format))
-
-        numeric_format = QTextCharFormat()
-        numeric_format.setForeground(Qt.blue)
-        regex = QRegExp(r'\s[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?')
-        self.highlight_rules.append((regex, numeric_format))
+        self.numeric_format = QTextCharFormat()
+        self.numeric_format.setForeground(Qt.blue)
 
         # TODO: highlight parens around such as st_x(shape)
-        self.set_highlight_rules_comments()
-        self.multi_line_comment_format = QTextCharFormat()
-        self.multi_line_comment_format.setForeground(Qt.darkGreen)
+        # single- and multi-line comments to show as green
+        self.comment_format = QTextCharFormat()
+        self.comment_format.setForeground(Qt.darkGreen)
 
-        self.set_highlight_rules_quotes()
+        # strings in quotes (both single and double) to show as red
+        self.quote_format = QTextCharFormat()
+        self.quote_format.setForeground(Qt.red)
 
         # function names to show as italic and pink
-        function_format = QTextCharFormat()
-        function_format.setFontItalic(True)
-        function_format.setForeground(QColor(255, 105, 255))
-        self.highlight_rules.append((QRegExp('\\b[A-Za-z0-9_]+(?=\\()'),
-                                     function_format))
-
-        self.comment_start_expression = QRegExp('/\\*')
-        self.comment_end_expression = QRegExp('\\*/')
+        self.function_format = QTextCharFormat()
+        self.function_format.setFontItalic(True)
+        self.function_format.setForeground(QColor(255, 105, 255))
+
+        self.editor = None
+        self.viewport_blocks = None
+        self.forced_block = None  # number of the block to highlight now
+        self.fill_block_number = 0
+        self.fill_timer = QTimer(self)
+        self.fill_timer.setInterval(0)
+        self.fill_timer.timeout.connect(self._fill_pending_blocks)
         return
 
     # ----------------------------------------------------------------------
-    def set_highlight_rules_quotes(self):
-        """Strings in quotes (both single and double) to show as red."""
-        quote_format = QTextCharFormat()
-        quote_format.setForeground(Qt.red)
-        self.highlight_rules.append((QRegExp('\".*\"'), quote_format))
-        self.highlight_rules.append((QRegExp("'.*\'"), quote_format))
+    def set_editor(self, editor):
+        """Highlight large documents around the lines shown in the editor."""
+        self.editor = editor
+        editor.verticalScrollBar().valueChanged.connect(
+            self._on_viewport_changed)
         return
 
     # ----------------------------------------------------------------------
-    def set_highlight_rules_comments(self):
-        """Single- and multi-line comments to show as green."""
-        single_line_comment_format = QTextCharFormat()
-        single_line_comment_format.setForeground(Qt.darkGreen)
-        self.highlight_rules.append((QRegExp('--[^\n]*'),
-                                     single_line_comment_format))
+    def get_viewport_blocks(self):
+        """Get numbers of the first and the last block to highlight now."""
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).blockNumber()
+        last = self.editor.cursorForPosition(QPoint(
+            0, viewport.height())).blockNumber()
+        return (first - highlight_margin_blocks,
+                last + highlight_margin_blocks)
+
+    # ----------------------------------------------------------------------
+    def is_block_deferred(self, block_number):
+        """Check whether highlighting the block can wait for idle time."""
+        if (block_number == self.forced_block or self.editor is None
+                or self.document().blockCount() <= large_document_blocks):
+            return False
+        # the visible blocks are found once per pass over the document
+        if self.viewport_blocks is None:
+            self.viewport_blocks = self.get_viewport_blocks()
+            QTimer.singleShot(0, self._reset_viewport_blocks)
+        first, last = self.viewport_blocks
+        return not first <= block_number <= last
+
+    # ----------------------------------------------------------------------
+    def _reset_viewport_blocks(self):
+        """Find the visible blocks again on the next pass."""
+        self.viewport_blocks = None
         return
 
     # ----------------------------------------------------------------------
-    def set_highlight_rules_gdb_items(self, items, item_type):
-        """Update highlight rules to include geodatabase datasets."""
-        for item in items:
-            fmt = QTextCharFormat()
-            fmt.setForeground(
-                self.gdb_highlight_settings[item_type]['Foreground'])
-            fmt.setFontWeight(
-                self.gdb_highlight_settings[item_type]['FontWeight'])
-            regexp = QRegExp('\\b{0}\\b'.format(item))
-            regexp.setCaseSensitivity(Qt.CaseInsensitive)
-            self.highlight_rules.append((regexp, fmt))
-
-        # need to put the single line comment rules afterwards;
-        # otherwise table names are highlighted even when are part of comment
-        self.set_highlight_rules_comments()
-        self.set_highlight_rules_quotes()
+    def _on_viewport_changed(self):
+        """Highlight pending blocks that have been scrolled into view."""
+        if self.document().blockCount() <= large_document_blocks:
+            return
+        first, last = self.get_viewport_blocks()
+        block = self.document().findBlockByNumber(max(first, 0))
+        while block.isValid() and block.blockNumber() <= last:
+            if block.userState() == PENDING_BLOCK:
+                self._rehighlight_block(block)
+            block = block.next()
+        return
+
+    # ----------------------------------------------------------------------
+    def _defer_block(self, block_number):
+        """Leave the block pending until idle time."""
+        self.setCurrentBlockState(PENDING_BLOCK)
+        if not self.fill_timer.isActive():
+            self.fill_block_number = block_number
+            self.fill_timer.start()
+        else:
+            self.fill_block_number = min(self.fill_block_number, block_number)
         return
 
+    # ----------------------------------------------------------------------
+    def _fill_pending_blocks(self):
+        """Highlight a slice of pending blocks."""
+        block = self.document().findBlockByNumber(self.fill_block_number)
+        count = 0
+        while block.isValid() and count < highlight_slice_blocks:
+            if block.userState() == PENDING_BLOCK:
+                self._rehighlight_block(block)
+                count += 1
+            block = block.next()
+        if block.isValid():
+            self.fill_block_number = block.blockNumber()
+        else:
+            self.fill_timer.stop()
+        return
+
+    # ----------------------------------------------------------------------
+    def _rehighlight_block(self, block):
+        """Highlight the block even if it is not visible.
+
+        Only this block is forced; the following blocks Qt highlights again
+        as the state of this one changes are left pending.
+        """
+        self.forced_block = block.blockNumber()
+        try:
+            self.rehighlightBlock(block)
+        finally:
+            self.forced_block = None
+        return
+
+    # ----------------------------------------------------------------------
+    def set_vocabulary(self, vocabulary):
+        """Highlight geodatabase tables and columns of the vocabulary."""
+        if vocabulary is not self.vocabulary:
+            self.vocabulary = vocabulary
+            self.rehighlight()
+        return
+
+    # ----------------------------------------------------------------------
+    def get_word_format(self, word, is_call):
+        """Get format of a word; None if it is not highlighted."""
+        word = word.lower()
+        if word in self.vocabulary.tables:
+            return self.gdb_formats['Table']
+        if word in self.vocabulary.columns:
+            return self.gdb_formats['Column']
+        if is_call:
+            return self.function_format
+        if word in self.keywords:
+            return self.keyword_format
+        return None
+
     # ----------------------------------------------------------------------
     def highlightBlock(self, text):  # noqa: N802
         """Reimplementation of the built-in method."""
-        for pattern, format_ in self.highlight_rules:
-            expression = QRegExp(pattern)
-            idx = expression.indexIn(text)
-            while idx >= 0:
-                length = expression.matchedLength()
-                self.setFormat(idx, length, format_)
-                idx = expression.indexIn(text, idx + length)
+        block_number = self.currentBlock().blockNumber()
+        if self.is_block_deferred(block_number):
+            self._defer_block(block_number)
+            return
 
         self.setCurrentBlockState(0)
+        pos = 0
+        if self.previousBlockState() == IN_BLOCK_COMMENT:
+            pos = self.format_block_comment(text, 0, 0)
+        has_words = self.document().characterCount(
+        ) <= highlight_words_max_chars
 
-        start_idx = 0
-        if self.previousBlockState() != 1:
-            start_idx = self.comment_start_expression.indexIn(text)
-
-        while start_idx >= 0:
-            end_index = self.comment_end_expression.indexIn(text, start_idx)
-
-            if end_index == -1:
-                self.setCurrentBlockState(1)
-                comment_length = len(text) - start_idx
+        length = len(text)
+        while pos < length:
+            match = TOKEN_RE.search(text, pos)
+            if match is None:
+                break
+            kind = match.lastgroup
+            start, end = match.span()
+            if kind == 'block_comment':
+                end = self.format_block_comment(text, start, end)
+            elif kind == 'comment':
+                self.setFormat(start, end - start, self.comment_format)
+            elif kind == 'string':
+                self.setFormat(start, end - start, self.quote_format)
+            elif kind == 'number':
+                self.setFormat(start, end - start, self.numeric_format)
             else:
-                matched_length = self.comment_end_expression.matchedLength()
-                comment_length = end_index - start_idx + matched_length
-
-            self.setFormat(start_idx, comment_length,
-                           self.multi_line_comment_format)
-            start_idx = self.comment_start_expression.indexIn(
-                text, start_idx + comment_length)
+                end = match.end('word')
+                fmt = self.get_word_format(
+                    match.group('word'),
+                    match.group('call') is not None) if has_words else None
+                if fmt is not None:
+                    self.setFormat(start, end - start, fmt)
+            pos = end
         return
+
+    # ----------------------------------------------------------------------
+    def format_block_comment(self, text, start, pos):
+        """Format multi-line comment starting at `start`; get where it ends."""
+        end = text.find('*/', pos)
+        if end == -1:
+            self.setCurrentBlockState(IN_BLOCK_COMMENT)
+            end = len(text)
+        else:
+            end += 2
+        self.setFormat(start, end - start, self.comment_format)
+        return end
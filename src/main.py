@@ -6,7 +6,9 @@ import sys
 from PyQt5.QtWidgets import QApplication
 from window import Window
 
-APP = QApplication([])
-WINDOW = Window()
-WINDOW.show()
-sys.exit(APP.exec_())
+# guarded as query worker processes import the main module when started
+if __name__ == '__main__':
+    APP = QApplication([])
+    WINDOW = Window()
+    WINDOW.show()
+    sys.exit(APP.exec_())
@@ -0,0 +1,401 @@
+# -*- coding: UTF-8 -*-
+"""Execution of SQL queries in a pool of worker processes.
+
+Every worker process keeps its own dataset handles and executes one query
+at a time. Features of the result layer are sent back to the application
+in columnar batches placed into shared memory blocks; only the small
+description of the batch layout goes through the pipe.
+"""
+
+import threading
+import multiprocessing
+
+import numpy as np
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8; batches are sent through the pipe
+    shared_memory = None
+
+import ogr
+
+from cfg import query_server_max_idle_processes
+from result_store import BatchReader, get_result_fields, get_column_values
+
+
+# ----------------------------------------------------------------------
+def put_batch(columns):
+    """Place column arrays of a batch into a shared memory block.
+
+    Return tuple (shared memory name, layout) where layout describes the
+    columns as [(name, kind, [(array_name, dtype, offset, length)])];
+    without shared memory support the arrays go into the layout itself.
+    """
+    total_size = sum(
+        array.nbytes for _name, _kind, arrays in columns
+        for array in arrays.values())
+    if shared_memory is None or not total_size:
+        return None, [(name, kind, [(array_name, array.dtype.str, array, len(
+            array)) for array_name, array in arrays.items()])
+                      for name, kind, arrays in columns]
+
+    shm = shared_memory.SharedMemory(create=True, size=total_size)
+    layout, offset = [], 0
+    for name, kind, arrays in columns:
+        col_layout = []
+        for array_name, array in arrays.items():
+            shm.buf[offset:offset + array.nbytes] = array.tobytes()
+            col_layout.append((array_name, array.dtype.str, offset, len(array)))
+            offset += array.nbytes
+        layout.append((name, kind, col_layout))
+    shm.close()
+    return shm.name, layout
+
+
+# ----------------------------------------------------------------------
+def take_batch(shm_name, layout):
+    """Copy column arrays of a batch out of the shared memory block.
+
+    The shared memory block is freed afterwards.
+    Return [(name, kind, {array_name: array})].
+    """
+    if shm_name is None:
+        return [(name, kind, {
+            array_name: np.asarray(array, dtype=dtype)
+            for array_name, dtype, array, _length in col_layout
+        }) for name, kind, col_layout in layout]
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        columns = []
+        for name, kind, col_layout in layout:
+            arrays = {}
+            for array_name, dtype, offset, length in col_layout:
+                arrays[array_name] = np.frombuffer(
+                    shm.buf, dtype=dtype, count=length, offset=offset).copy()
+            columns.append((name, kind, arrays))
+    finally:
+        shm.close()
+        shm.unlink()
+    return columns
+
+
+# ----------------------------------------------------------------------
+def serve(conn):
+    """Worker process loop executing requests received through the pipe."""
+    from geodatabase import Geodatabase
+
+    gdb, res, reader, fields, geom_column = None, None, None, [], ''
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        command = request[0]
+        try:
+            if command == 'execute':
+                if reader is not None:
+                    reader.close()
+                if res is not None:
+                    gdb.release_result(res)
+                res, reader, fields, geom_column = None, None, [], ''
+                _command, path, query, dialect = request
+                gdb = Geodatabase(path)
+                gdb.execution_mode = 'local'
+                res, errors = gdb.execute_sql(query, dialect)
+                if res is not None:
+                    fields = get_result_fields(res)
+                    geom_column = res.GetGeometryColumn()
+                conn.send(('result', res is not None, fields, geom_column,
+                           errors))
+            elif command == 'fetch':
+                _command, limit, with_geometry = request
+                if reader is None:
+                    reader = BatchReader(res, fields, geom_column
+                                         if with_geometry else '')
+                number_of_rows, columns = reader.read(limit)
+                shm_name, layout = put_batch(columns)
+                conn.send(('batch', number_of_rows, shm_name, layout))
+            elif command == 'count':
+                _command, force = request
+                conn.send(('count', res.GetFeatureCount(force)))
+            elif command == 'reset':
+                if reader is not None:
+                    reader.reset()
+                else:
+                    res.ResetReading()
+                conn.send(('reset', ))
+            elif command == 'close':
+                if reader is not None:
+                    reader.close()
+                if res is not None:
+                    gdb.release_result(res)
+                res, reader = None, None
+                conn.send(('closed', ))
+            elif command == 'stop':
+                conn.send(('stopped', ))
+                break
+        except Exception as err:
+            conn.send(('error', str(err)))
+    if reader is not None:
+        reader.close()
+    if res is not None:
+        gdb.release_result(res)
+    conn.close()
+    return
+
+
+########################################################################
+class QueryServerError(Exception):
+    """Worker process failed to respond to a request."""
+
+    pass
+
+
+########################################################################
+class WorkerProcess(object):
+    """Worker process and the pipe to talk to it.
+
+    Every request and its response go through the pipe under a lock, so
+    threads sharing the worker never read each other's responses.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, context):
+        """Start the worker process."""
+        self.is_terminated = False
+        self._lock = threading.Lock()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve, args=(child_conn, ))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        return
+
+    # ----------------------------------------------------------------------
+    def request(self, *request):
+        """Send request to the worker process and wait for the response."""
+        with self._lock:
+            try:
+                if self.is_terminated:
+                    raise EOFError
+                self.conn.send(request)
+                response = self.conn.recv()
+            except (EOFError, OSError):
+                self.conn.close()
+                raise QueryServerError('Query worker process has stopped')
+        if response[0] == 'error':
+            raise QueryServerError(response[1])
+        return response
+
+    # ----------------------------------------------------------------------
+    def is_alive(self):
+        """Check whether the worker process is running."""
+        return not self.is_terminated and self.process.is_alive()
+
+    # ----------------------------------------------------------------------
+    def stop(self):
+        """Let the worker process finish once its result is released."""
+        try:
+            self.request('stop')
+        except QueryServerError:
+            self.terminate()
+            return
+        self.process.join()
+        self.conn.close()
+        return
+
+    # ----------------------------------------------------------------------
+    def terminate(self):
+        """Kill the worker process interrupting whatever it is doing.
+
+        The worker is marked terminated first; a request blocked on the
+        pipe in another thread fails and closes the pipe itself.
+        """
+        self.is_terminated = True
+        self.process.terminate()
+        if self._lock.acquire(False):
+            self.conn.close()
+            self._lock.release()
+        return
+
+
+########################################################################
+class RemoteResult(object):
+    """Result layer living in a worker process.
+
+    Provides columnar batches with the `fetch_batch` method along with the
+    part of OGR layer interface used by the result table.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, server, worker, fields, geom_column):
+        """Initialize RemoteResult with the layer definition."""
+        self.server = server
+        self.worker = worker
+        self.fields = fields
+        self.geom_column = geom_column
+        self.schema = [
+            ogr.FieldDefn(name, field_type) for name, field_type in fields
+        ]
+        self.batch_size = 200
+        self._count = None
+        self._buffer = []
+        return
+
+    # ----------------------------------------------------------------------
+    def fetch_batch(self, limit, with_geometry=True):
+        """Fetch next features as [(name, kind, {array_name: array})].
+
+        Return tuple (number of rows fetched, columns).
+        """
+        _response, number_of_rows, shm_name, layout = self.worker.request(
+            'fetch', limit, with_geometry)
+        return number_of_rows, take_batch(shm_name, layout)
+
+    # ----------------------------------------------------------------------
+    def GetGeometryColumn(self):  # noqa: N802
+        """Get name of the geometry column of the result layer."""
+        return self.geom_column
+
+    # ----------------------------------------------------------------------
+    def GetFeatureCount(self, force=1):  # noqa: N802
+        """Get number of features in the result layer."""
+        if self._count is None:
+            count = self.worker.request('count', force)[1]
+            if count < 0:
+                return count
+            self._count = count
+        return self._count
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        """Get number of features in the result layer."""
+        return self.GetFeatureCount()
+
+    # ----------------------------------------------------------------------
+    def ResetReading(self):  # noqa: N802
+        """Start reading features from the beginning."""
+        self._buffer = []
+        self.worker.request('reset')
+        return
+
+    # ----------------------------------------------------------------------
+    def GetNextFeature(self):  # noqa: N802
+        """Get next feature of the result layer; None when exhausted."""
+        if not self._buffer:
+            number_of_rows, columns = self.fetch_batch(self.batch_size)
+            names = [name for name, _kind, _arrays in columns]
+            values = [
+                get_column_values(kind, arrays)
+                for _name, kind, arrays in columns
+            ]
+            self._buffer = [
+                RemoteFeature(names, row_values, self.geom_column)
+                for row_values in zip(*values)
+            ][::-1]
+            if not number_of_rows:
+                return None
+        return self._buffer.pop()
+
+    # ----------------------------------------------------------------------
+    def release(self):
+        """Release the result layer and give the worker back to the pool."""
+        if self.worker:
+            self.server.release(self.worker)
+            self.worker = None
+        return
+
+
+########################################################################
+class RemoteFeature(object):
+    """Feature of the result layer living in a worker process."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, names, values, geom_column):
+        """Initialize RemoteFeature with the values of its columns."""
+        self.attributes = dict(zip(names, values))
+        self.wkb = self.attributes.pop(geom_column, None)
+        return
+
+    # ----------------------------------------------------------------------
+    def items(self):
+        """Get dict {column_name: value} of the feature attributes."""
+        return dict(self.attributes)
+
+    # ----------------------------------------------------------------------
+    def geometry(self):
+        """Get OGR geometry of the feature; None if it has no geometry."""
+        if not self.wkb:
+            return None
+        return ogr.CreateGeometryFromWkb(self.wkb)
+
+
+########################################################################
+class QueryServer(object):
+    """Pool of worker processes executing SQL queries.
+
+    A worker process is busy while the result of its query is in use;
+    a new worker process is started when no idle one is available.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, max_idle=query_server_max_idle_processes):
+        """Initialize QueryServer without starting any process."""
+        self.max_idle = max_idle
+        self.context = multiprocessing.get_context('spawn')
+        self._idle = []
+        self._lock = threading.Lock()
+        return
+
+    # ----------------------------------------------------------------------
+    def acquire(self):
+        """Get an idle worker process starting a new one if necessary."""
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    return worker
+        return WorkerProcess(self.context)
+
+    # ----------------------------------------------------------------------
+    def release(self, worker):
+        """Close the worker result and keep the worker for further queries."""
+        try:
+            worker.request('close')
+        except QueryServerError:
+            worker.terminate()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(worker)
+                return
+        worker.stop()
+        return
+
+    # ----------------------------------------------------------------------
+    def execute(self, path, query, dialect, cancel_token=None):
+        """Execute SQL query in a worker process.
+
+        Return tuple (RemoteResult or None, errors). Cancelling the token
+        kills the worker process interrupting the query.
+        """
+        worker = self.acquire()
+        if cancel_token:
+            cancel_token.add_callback(worker.terminate)
+        try:
+            (_response, has_result, fields, geom_column,
+             errors) = worker.request('execute', path, query, dialect)
+        except QueryServerError as err:
+            worker.terminate()
+            return None, err.args[0]
+        finally:
+            if cancel_token:
+                cancel_token.remove_callback(worker.terminate)
+
+        if not has_result:
+            self.release(worker)
+            return None, errors
+        return RemoteResult(self, worker, fields, geom_column), errors
+
+
+query_server = QueryServer()
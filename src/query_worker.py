@@ -0,0 +1,111 @@
+# -*- coding: UTF-8 -*-
+"""Execution of SQL queries in background."""
+
+import time
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from geodatabase import CancelToken
+from row_count import get_metadata_row_count, UNKNOWN_COUNT
+from result_store import BatchReader
+from cfg import row_count_strategy, first_rows_count
+
+
+########################################################################
+class QueryWorker(QThread):
+    """Thread executing SQL query against a geodatabase.
+
+    GDAL does not provide a way to interrupt the `ExecuteSQL` method, nor
+    does it take a progress callback, so a cancelled worker is detached
+    from its tab and the result layer it gets is given back to the
+    connection pool as soon as GDAL returns; no rows are read from it.
+    When queries are executed in worker processes, cancelling kills the
+    worker process running the query.
+    """
+
+    query_finished = pyqtSignal(object, object, object, float, object, object,
+                                float)
+
+    # keep references to running workers so that closing a tab does not
+    # destroy a thread that is still waiting for GDAL
+    running = set()
+
+    # ----------------------------------------------------------------------
+    def __init__(self, gdb, sql_query, dialect, with_geometry=True):
+        """Initialize QueryWorker with the query to execute."""
+        super(QueryWorker, self).__init__()
+        self.gdb = gdb
+        self.sql_query = sql_query
+        self.dialect = dialect
+        self.with_geometry = with_geometry
+        self.cancel_token = CancelToken()
+        self.finished.connect(self._on_finished)
+        return
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Override built-in method to keep the worker alive while running."""
+        QueryWorker.running.add(self)
+        super(QueryWorker, self).start()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Detach the worker; its result is released once GDAL returns."""
+        self.cancel_token.cancel()
+        return
+
+    # ----------------------------------------------------------------------
+    def is_interruptible(self):
+        """Check whether cancelling stops the query being executed."""
+        return self.gdb.execution_mode == 'process'
+
+    # ----------------------------------------------------------------------
+    @property
+    def is_cancelled(self):
+        """Check whether the query has been cancelled."""
+        return self.cancel_token.is_cancelled
+
+    # ----------------------------------------------------------------------
+    def run(self):
+        """Override built-in method; execute query and read the first rows.
+
+        The first rows are read here so that the table can be drawn as soon
+        as they are available; the rest is fetched by the table model with
+        the same batch reader.
+        """
+        start_time = time.time()
+        res, errors = self.gdb.execute_sql(self.sql_query, self.dialect,
+                                           self.cancel_token)
+        exec_time = time.time() - start_time
+
+        # the count is taken only if it does not require reading the result
+        number_layer_rows = None
+        reader, first_batch = None, None
+        if (res is not None and not self.is_cancelled
+                and row_count_strategy != UNKNOWN_COUNT):
+            number_layer_rows = get_metadata_row_count(res)
+
+        if res is not None and not self.is_cancelled:
+            geom_column = res.GetGeometryColumn() if self.with_geometry else ''
+            reader = BatchReader(res, geom_column=geom_column)
+            try:
+                first_batch = reader.read(first_rows_count)
+            except Exception as err:
+                errors = err.args[0]
+        first_rows_time = time.time() - start_time
+
+        if self.is_cancelled:
+            if reader is not None:
+                reader.close()
+            self.gdb.release_result(res)
+            return
+        self.query_finished.emit(res, errors, number_layer_rows, exec_time,
+                                 reader, first_batch, first_rows_time)
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_finished(self):
+        """Forget the worker once the thread has finished."""
+        QueryWorker.running.discard(self)
+        return
@@ -0,0 +1,654 @@
+# -*- coding: UTF-8 -*-
+"""Columnar storage of query result rows.
+
+Features of a result layer are read in batches of typed arrays, one per
+column, and appended to a store keeping every column in a single growing
+array so that no Python object is created per row or per cell.
+"""
+
+import re
+import binascii
+from collections import OrderedDict
+
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+except ImportError:  # features are read one by one
+    pa = None
+
+import ogr
+
+from cfg import (use_arrow_stream, arrow_batch_size, wkt_preview_max_length,
+                 wkt_preview_precision, wkt_preview_cache_size)
+
+# kinds of columns in a batch and the arrays each of them consists of
+INT_COLUMN = 'int'  # values (int64), nulls (bool)
+FLOAT_COLUMN = 'float'  # values (float64), nulls (bool)
+DATE_COLUMN = 'date'  # values (int64 milliseconds since epoch), nulls (bool)
+DATETIME_COLUMN = 'datetime'  # same arrays as date columns
+STRING_COLUMN = 'str'  # data (utf-8 bytes), offsets (int64), nulls (bool)
+BINARY_COLUMN = 'binary'  # data (raw bytes), offsets (int64), nulls (bool)
+GEOMETRY_COLUMN = 'geom'  # data (WKB bytes), offsets (int64), nulls (bool)
+
+INT_FIELD_TYPES = (ogr.OFTInteger, ogr.OFTInteger64)
+FLOAT_FIELD_TYPES = (ogr.OFTReal, )
+DATE_FIELD_TYPES = (ogr.OFTDate, )
+DATETIME_FIELD_TYPES = (ogr.OFTDateTime, )
+BINARY_FIELD_TYPES = (ogr.OFTBinary, )
+
+COORDINATE_RE = re.compile(r'-?\d+\.\d+(?:[eE][-+]?\d+)?')
+ELLIPSIS = u'\u2026'
+
+
+# ----------------------------------------------------------------------
+def get_column_kind(field_type):
+    """Get kind of the batch column used for OGR field type."""
+    if field_type in INT_FIELD_TYPES:
+        return INT_COLUMN
+    if field_type in FLOAT_FIELD_TYPES:
+        return FLOAT_COLUMN
+    if field_type in DATE_FIELD_TYPES:
+        return DATE_COLUMN
+    if field_type in DATETIME_FIELD_TYPES:
+        return DATETIME_COLUMN
+    if field_type in BINARY_FIELD_TYPES:
+        return BINARY_COLUMN
+    return STRING_COLUMN
+
+
+# ----------------------------------------------------------------------
+def get_result_fields(res):
+    """Get [(name, OGR field type)] of the result layer columns."""
+    return [(field.GetName(), field.GetType()) for field in res.schema]
+
+
+# ----------------------------------------------------------------------
+def read_batch(lyr, fields, geom_column, limit):
+    """Read up to `limit` features of the layer into columnar arrays.
+
+    Return tuple (number of rows read, [(name, kind, {array_name: array})]).
+    """
+    kinds = [get_column_kind(field_type) for _name, field_type in fields]
+    values = [[] for _field in fields]
+    nulls = [[] for _field in fields]
+    geoms, geom_nulls = [], []
+    number_of_rows = 0
+    while number_of_rows < limit:
+        feat = lyr.GetNextFeature()
+        if not feat:
+            break
+        number_of_rows += 1
+        for idx, kind in enumerate(kinds):
+            is_null = not feat.IsFieldSetAndNotNull(idx)
+            nulls[idx].append(is_null)
+            if kind == INT_COLUMN:
+                values[idx].append(0 if is_null else feat.GetFieldAsInteger64(
+                    idx))
+            elif kind == FLOAT_COLUMN:
+                values[idx].append(0.0 if is_null else feat.GetFieldAsDouble(
+                    idx))
+            elif kind in (DATE_COLUMN, DATETIME_COLUMN):
+                values[idx].append('NaT' if is_null else get_iso_datetime(
+                    feat.GetFieldAsDateTime(idx)))
+            elif kind == BINARY_COLUMN:
+                values[idx].append(b'' if is_null else feat.GetFieldAsBinary(
+                    idx))
+            else:
+                values[idx].append(b'' if is_null else feat.GetFieldAsString(
+                    idx).encode('utf-8'))
+        if geom_column:
+            geom = feat.GetGeometryRef()
+            geom_nulls.append(geom is None)
+            geoms.append(bytes(geom.ExportToWkb()) if geom else b'')
+
+    columns = []
+    for (name, _field_type), kind, col_values, col_nulls in zip(
+            fields, kinds, values, nulls):
+        if kind == INT_COLUMN:
+            arrays = {'values': np.array(col_values, dtype=np.int64)}
+        elif kind == FLOAT_COLUMN:
+            arrays = {'values': np.array(col_values, dtype=np.float64)}
+        elif kind in (DATE_COLUMN, DATETIME_COLUMN):
+            arrays = {
+                'values':
+                np.array(col_values, dtype='datetime64[ms]').view(np.int64)
+            }
+        else:
+            arrays = pack_bytes(col_values)
+        arrays['nulls'] = np.array(col_nulls, dtype=np.bool_)
+        columns.append((name, kind, arrays))
+    if geom_column:
+        arrays = pack_bytes(geoms)
+        arrays['nulls'] = np.array(geom_nulls, dtype=np.bool_)
+        columns.append((geom_column, GEOMETRY_COLUMN, arrays))
+    return number_of_rows, columns
+
+
+# ----------------------------------------------------------------------
+def get_arrow_arrays(arr, kind):
+    """Get batch column arrays from a pyarrow array of the kind of column."""
+    if isinstance(arr.type, pa.ExtensionType):  # e.g. geoarrow.wkb
+        arr = arr.storage
+    nulls = arr.is_null().to_numpy(zero_copy_only=False).astype(np.bool_)
+    if kind in (INT_COLUMN, FLOAT_COLUMN):
+        dtype = np.int64 if kind == INT_COLUMN else np.float64
+        return {
+            'values':
+            arr.fill_null(0).to_numpy(zero_copy_only=False).astype(dtype),
+            'nulls': nulls,
+        }
+    if kind in (DATE_COLUMN, DATETIME_COLUMN):
+        if pa.types.is_timestamp(arr.type) and arr.type.tz is not None:
+            # features give the local time of the value, not the UTC time
+            arr = pa.compute.local_timestamp(arr)
+        values = arr.to_numpy(zero_copy_only=False).astype('datetime64[ms]')
+        return {'values': values.view(np.int64), 'nulls': nulls}
+
+    if not (pa.types.is_string(arr.type) or pa.types.is_binary(arr.type)
+            or pa.types.is_large_string(arr.type)
+            or pa.types.is_large_binary(arr.type)):
+        arrays = pack_bytes([
+            b'' if value is None else str(value).encode('utf-8')
+            for value in arr.to_pylist()
+        ])
+        arrays['nulls'] = nulls
+        return arrays
+
+    # use the offsets and the data buffers of the arrow array as they are
+    arr = arr.cast(pa.large_binary())
+    _validity, offsets, data = arr.buffers()
+    offsets = np.frombuffer(
+        offsets, dtype=np.int64)[arr.offset:arr.offset + len(arr) + 1]
+    data = np.frombuffer(data, dtype=np.uint8) if data else np.zeros(
+        0, dtype=np.uint8)
+    return {
+        'data': data[offsets[0]:offsets[-1]],
+        'offsets': offsets - offsets[0],
+        'nulls': nulls,
+    }
+
+
+# ----------------------------------------------------------------------
+def get_iso_datetime(parts):
+    """Get ISO 8601 string from the parts OGR gives for date fields."""
+    year, month, day, hour, minute, second = parts[:6]
+    return '{0:04d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:06.3f}'.format(
+        year, month, day, hour, minute, second)
+
+
+# ----------------------------------------------------------------------
+def format_datetime(value, kind):
+    """Format milliseconds since epoch the way OGR shows dates."""
+    text = str(np.datetime64(int(value), 'ms')).replace('-', '/')
+    if kind == DATE_COLUMN:
+        return text[:10]
+    return text[:19].replace('T', ' ')
+
+
+# ----------------------------------------------------------------------
+def format_binary(value):
+    """Format bytes of a binary field as hex the way OGR shows them."""
+    return binascii.hexlify(value).decode('ascii').upper()
+
+
+# ----------------------------------------------------------------------
+def get_wkt_preview(wkb, max_length=None, precision=None):
+    """Get WKT of the geometry cut to the length with rounded coordinates."""
+    wkt = ogr.CreateGeometryFromWkb(wkb).ExportToWkt()
+    if precision is not None:
+        # the preview is cut anyway, so only its beginning is rounded
+        if max_length:
+            wkt = wkt[:max_length * 4]
+        wkt = COORDINATE_RE.sub(
+            lambda match: '{0:.{1}f}'.format(float(match.group()), precision),
+            wkt)
+    if max_length and len(wkt) > max_length:
+        wkt = wkt[:max_length - 1] + ELLIPSIS
+    return wkt
+
+
+# ----------------------------------------------------------------------
+def pack_bytes(items):
+    """Pack list of bytes into a single data buffer and offsets array."""
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in items], dtype=np.int64)
+    return {
+        'data': np.frombuffer(b''.join(items), dtype=np.uint8),
+        'offsets': offsets,
+    }
+
+
+# ----------------------------------------------------------------------
+def unpack_bytes(arrays):
+    """Get list of bytes (None for nulls) from packed column arrays."""
+    data = arrays['data'].tobytes()
+    offsets = arrays['offsets'].tolist()
+    return [
+        None if is_null else data[offsets[i]:offsets[i + 1]]
+        for i, is_null in enumerate(arrays['nulls'].tolist())
+    ]
+
+
+# ----------------------------------------------------------------------
+def get_column_values(kind, arrays):
+    """Get Python values (None for nulls) of a batch column."""
+    if kind in (INT_COLUMN, FLOAT_COLUMN):
+        return [
+            None if is_null else value for value, is_null in zip(
+                arrays['values'].tolist(), arrays['nulls'].tolist())
+        ]
+    if kind in (DATE_COLUMN, DATETIME_COLUMN):
+        return [
+            None if is_null else format_datetime(value, kind)
+            for value, is_null in zip(arrays['values'].tolist(),
+                                      arrays['nulls'].tolist())
+        ]
+    values = unpack_bytes(arrays)
+    if kind == STRING_COLUMN:
+        return [None if v is None else v.decode('utf-8') for v in values]
+    return values
+
+
+########################################################################
+class BatchReader(object):
+    """Cursor reading columnar batches from a local or a remote result layer.
+
+    Local layers are read through the Arrow C stream interface when GDAL
+    and pyarrow support it; a stream cannot be mixed with `GetNextFeature`
+    calls, so all the rows of a result should be read with one reader.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, res, fields=None, geom_column='',
+                 use_arrow=use_arrow_stream):
+        """Initialize BatchReader with the columns to read."""
+        self.res = res
+        self.fields = get_result_fields(res) if fields is None else fields
+        self.geom_column = geom_column
+        self.is_remote = hasattr(res, 'fetch_batch')
+        self.use_arrow = bool(use_arrow and pa is not None
+                              and not self.is_remote
+                              and hasattr(res, 'GetArrowStreamAsPyArrow'))
+        self.is_exhausted = False
+        self._stream = None
+        self._batches = None
+        self._pending = None  # part of an arrow batch not read yet
+        self._ignores_geometry = False
+        return
+
+    # ----------------------------------------------------------------------
+    def read(self, limit):
+        """Read next rows of the result layer.
+
+        Return tuple (number of rows read, [(name, kind, {name: array})]).
+        """
+        if self.is_remote:
+            batch = self.res.fetch_batch(limit, bool(self.geom_column))
+        elif self.use_arrow:
+            batch = self._read_arrow(limit)
+        else:
+            batch = read_batch(self.res, self.fields, self.geom_column, limit)
+        if batch[0] < limit:
+            self.is_exhausted = True
+        return batch
+
+    # ----------------------------------------------------------------------
+    def reset(self):
+        """Start reading rows from the beginning of the result layer."""
+        self.close()
+        self.res.ResetReading()
+        self.is_exhausted = False
+        return
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """Release the arrow stream; needed before releasing the result."""
+        self._pending = None
+        self._batches = None
+        self._stream = None
+        if self._ignores_geometry:
+            self.res.SetIgnoredFields([])
+            self._ignores_geometry = False
+        return
+
+    # ----------------------------------------------------------------------
+    def _read_arrow(self, limit):
+        """Read next rows from record batches of the arrow stream."""
+        if self._stream is None:
+            if not self.geom_column and (
+                    self.res.GetLayerDefn().GetGeomFieldCount()):
+                # geometries not shown are not read from the layer at all
+                self.res.SetIgnoredFields(['OGR_GEOMETRY'])
+                self._ignores_geometry = True
+            self._stream = self.res.GetArrowStreamAsPyArrow([
+                'MAX_FEATURES_IN_BATCH={0}'.format(arrow_batch_size),
+                'INCLUDE_FID=NO',
+            ])
+            self._batches = iter(self._stream)
+
+        parts, number_of_rows = [], 0
+        while number_of_rows < limit:
+            if self._pending is None or not self._pending.num_rows:
+                self._pending = next(self._batches, None)
+                if self._pending is None:
+                    break
+                continue
+            size = min(limit - number_of_rows, self._pending.num_rows)
+            parts.append(self._pending.slice(0, size))
+            self._pending = self._pending.slice(size)
+            number_of_rows += size
+        if not parts:
+            return read_batch(self.res, self.fields, self.geom_column, 0)
+
+        # geometry, if any, follows the fields in the arrow schema
+        names_kinds = [(name, get_column_kind(field_type))
+                       for name, field_type in self.fields]
+        if self.geom_column:
+            names_kinds.append((self.geom_column, GEOMETRY_COLUMN))
+        columns = []
+        for idx, (name, kind) in enumerate(names_kinds):
+            arr = pa.concat_arrays([part.column(idx) for part in parts])
+            columns.append((name, kind, get_arrow_arrays(arr, kind)))
+        return number_of_rows, columns
+
+
+########################################################################
+class GrowableArray(object):
+    """Typed array growing by doubling its capacity as items are appended."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, dtype, capacity=1024):
+        """Initialize GrowableArray with no items."""
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+        return
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        """Get number of items in the array."""
+        return self._size
+
+    # ----------------------------------------------------------------------
+    def __getitem__(self, idx):
+        """Get item or a slice of the filled part of the array."""
+        return self.values[idx]
+
+    # ----------------------------------------------------------------------
+    @property
+    def values(self):
+        """Get view of the filled part of the array."""
+        return self._data[:self._size]
+
+    # ----------------------------------------------------------------------
+    @property
+    def nbytes(self):
+        """Get number of bytes allocated for the array."""
+        return self._data.nbytes
+
+    # ----------------------------------------------------------------------
+    def extend(self, items):
+        """Append array of items growing the capacity if necessary."""
+        size = self._size + len(items)
+        if size > len(self._data):
+            capacity = max(size, len(self._data) * 2)
+            data = np.empty(capacity, dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:size] = items
+        self._size = size
+        return
+
+
+########################################################################
+class ValuesColumn(object):
+    """Integer, real or date column kept in a typed array with null mask."""
+
+    dtypes = {
+        INT_COLUMN: np.int64,
+        FLOAT_COLUMN: np.float64,
+        DATE_COLUMN: np.int64,
+        DATETIME_COLUMN: np.int64,
+    }
+
+    # ----------------------------------------------------------------------
+    def __init__(self, name, kind):
+        """Initialize ValuesColumn with no rows."""
+        self.name = name
+        self.kind = kind
+        self.values = GrowableArray(self.dtypes[kind])
+        self.nulls = GrowableArray(np.bool_)
+        return
+
+    # ----------------------------------------------------------------------
+    def append(self, arrays):
+        """Append values of a batch column."""
+        self.values.extend(arrays['values'])
+        self.nulls.extend(arrays['nulls'])
+        return
+
+    # ----------------------------------------------------------------------
+    def get_value(self, row):
+        """Get value to show in the cell of the row; None for nulls."""
+        if self.nulls[row]:
+            return None
+        value = self.values[row]
+        if self.kind in (DATE_COLUMN, DATETIME_COLUMN):
+            return format_datetime(value, self.kind)
+        return value.item()
+
+    # ----------------------------------------------------------------------
+    def to_array(self):
+        """Get column values as an array for a data frame."""
+        values, nulls = self.values.values, self.nulls.values
+        if self.kind in (DATE_COLUMN, DATETIME_COLUMN):
+            values = values.view('datetime64[ms]').copy()
+            values[nulls] = np.datetime64('NaT')
+        elif nulls.any():
+            values = values.astype(np.float64)
+            values[nulls] = np.nan
+        else:
+            values = values.copy()
+        return values
+
+    # ----------------------------------------------------------------------
+    def to_arrow(self):
+        """Get column values as an arrow array sharing the typed array."""
+        arrow_types = {
+            INT_COLUMN: pa.int64(),
+            FLOAT_COLUMN: pa.float64(),
+            DATE_COLUMN: pa.timestamp('ms'),
+            DATETIME_COLUMN: pa.timestamp('ms'),
+        }
+        nulls = self.nulls.values
+        return pa.array(
+            self.values.values,
+            type=arrow_types[self.kind],
+            mask=nulls if nulls.any() else None)
+
+    # ----------------------------------------------------------------------
+    @property
+    def nbytes(self):
+        """Get number of bytes allocated for the column."""
+        return self.values.nbytes + self.nulls.nbytes
+
+
+########################################################################
+class BytesColumn(object):
+    """Text or geometry column kept in one byte buffer with offsets."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, name, kind):
+        """Initialize BytesColumn with no rows."""
+        self.name = name
+        self.kind = kind
+        self.data = GrowableArray(np.uint8, 64 * 1024)
+        self.offsets = GrowableArray(np.int64)
+        self.offsets.extend([0])
+        self.nulls = GrowableArray(np.bool_)
+        return
+
+    # ----------------------------------------------------------------------
+    def append(self, arrays):
+        """Append values of a batch column."""
+        self.data.extend(arrays['data'])
+        self.offsets.extend(arrays['offsets'][1:] + self.offsets[-1])
+        self.nulls.extend(arrays['nulls'])
+        return
+
+    # ----------------------------------------------------------------------
+    def get_bytes(self, row):
+        """Get bytes stored for the row; None for nulls."""
+        if self.nulls[row]:
+            return None
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes()
+
+    # ----------------------------------------------------------------------
+    def get_value(self, row):
+        """Get value to show in the cell of the row; None for nulls."""
+        value = self.get_bytes(row)
+        if value is None:
+            return None
+        if self.kind == GEOMETRY_COLUMN:
+            return ogr.CreateGeometryFromWkb(value).ExportToWkt()
+        if self.kind == BINARY_COLUMN:
+            return format_binary(value)
+        return value.decode('utf-8')
+
+    # ----------------------------------------------------------------------
+    def to_array(self):
+        """Get column values as an array of objects for a data frame."""
+        return np.array(
+            [self.get_value(row) for row in range(len(self.nulls))],
+            dtype=object)
+
+    # ----------------------------------------------------------------------
+    def to_arrow(self):
+        """Get column values as an arrow array sharing the byte buffers.
+
+        Strings are kept as utf-8 text, binary values and geometries as
+        bytes.
+        """
+        nulls = self.nulls.values
+        validity = None
+        if nulls.any():
+            validity = pa.py_buffer(np.packbits(~nulls, bitorder='little'))
+        return pa.Array.from_buffers(
+            pa.large_string()
+            if self.kind == STRING_COLUMN else pa.large_binary(),
+            len(nulls), [
+                validity,
+                pa.py_buffer(self.offsets.values),
+                pa.py_buffer(self.data.values)
+            ],
+            null_count=int(nulls.sum()))
+
+    # ----------------------------------------------------------------------
+    @property
+    def nbytes(self):
+        """Get number of bytes allocated for the column."""
+        return self.data.nbytes + self.offsets.nbytes + self.nulls.nbytes
+
+
+########################################################################
+class WktPreviewCache(object):
+    """Least recently used WKT previews of geometries shown in the table."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self,
+                 max_size=wkt_preview_cache_size,
+                 max_length=wkt_preview_max_length,
+                 precision=wkt_preview_precision):
+        """Initialize WktPreviewCache with no previews."""
+        self.max_size = max_size
+        self.max_length = max_length
+        self.precision = precision
+        self._previews = OrderedDict()
+        return
+
+    # ----------------------------------------------------------------------
+    def get(self, key, column, row):
+        """Get WKT preview of the geometry in the row of the column."""
+        if key in self._previews:
+            self._previews.move_to_end(key)
+            return self._previews[key]
+        wkb = column.get_bytes(row)
+        preview = None if wkb is None else get_wkt_preview(
+            wkb, self.max_length, self.precision)
+        self._previews[key] = preview
+        if len(self._previews) > self.max_size:
+            self._previews.popitem(last=False)
+        return preview
+
+    # ----------------------------------------------------------------------
+    def clear(self):
+        """Forget all previews."""
+        self._previews.clear()
+        return
+
+
+########################################################################
+class ResultStore(object):
+    """Rows of a query result kept column by column."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, fields, geom_column=''):
+        """Initialize ResultStore with the columns of the result layer."""
+        self.columns = [
+            self.make_column(name, get_column_kind(field_type))
+            for name, field_type in fields
+        ]
+        if geom_column:
+            self.columns.append(BytesColumn(geom_column, GEOMETRY_COLUMN))
+        self.row_count = 0
+        return
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def make_column(name, kind):
+        """Create an empty column for the kind of batch column."""
+        if kind in ValuesColumn.dtypes:
+            return ValuesColumn(name, kind)
+        return BytesColumn(name, kind)
+
+    # ----------------------------------------------------------------------
+    @property
+    def headers(self):
+        """Get names of the columns."""
+        return [column.name for column in self.columns]
+
+    # ----------------------------------------------------------------------
+    @property
+    def nbytes(self):
+        """Get number of bytes allocated for all the columns."""
+        return sum(column.nbytes for column in self.columns)
+
+    # ----------------------------------------------------------------------
+    def append_batch(self, number_of_rows, batch_columns):
+        """Append rows of a batch read from the result layer."""
+        for column, (_name, _kind, arrays) in zip(self.columns,
+                                                   batch_columns):
+            column.append(arrays)
+        self.row_count += number_of_rows
+        return
+
+    # ----------------------------------------------------------------------
+    def get_value(self, row, col):
+        """Get value to show in the cell; None for nulls."""
+        return self.columns[col].get_value(row)
+
+    # ----------------------------------------------------------------------
+    def to_arrow(self):
+        """Get rows as an arrow record batch; pyarrow must be installed."""
+        return pa.RecordBatch.from_arrays(
+            [column.to_arrow() for column in self.columns], self.headers)
+
+    # ----------------------------------------------------------------------
+    def to_dataframe(self, start_index=1):
+        """Get rows as pandas data frame."""
+        import pandas as pd
+        return pd.DataFrame(
+            {column.name: column.to_array()
+             for column in self.columns},
+            columns=self.headers,
+            index=range(start_index, start_index + self.row_count))
@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+"""Strategies of counting rows of a query result set."""
+
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# count rows only if the driver can do it without scanning the result
+METADATA_COUNT = 'metadata'
+# count rows by a separate query in background while the rows are fetched
+BACKGROUND_COUNT = 'background'
+# do not count rows; the total is known once all rows have been fetched
+UNKNOWN_COUNT = 'unknown'
+
+
+# ----------------------------------------------------------------------
+def get_metadata_row_count(res):
+    """Get number of rows if it is cheap to get; None otherwise."""
+    try:
+        count = res.GetFeatureCount(force=False)
+    except Exception:
+        return None
+    if count is None or count < 0:
+        return None
+    return count
+
+
+########################################################################
+class BackgroundRowCounter(QObject):
+    """Count rows of a query result by executing the query once more.
+
+    The count runs in a background thread against its own dataset handle
+    borrowed from the connection pool so that it does not interfere with
+    fetching rows of the result drawn in the table.
+    """
+
+    count_ready = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    # ----------------------------------------------------------------------
+    def __init__(self, gdb, sql_query, dialect, parent=None):
+        """Initialize BackgroundRowCounter with the query to count rows of."""
+        super(BackgroundRowCounter, self).__init__(parent)
+        self.gdb = gdb
+        self.sql_query = sql_query.strip().rstrip(';')
+        self.dialect = dialect or 'sqlite'
+        self.is_cancelled = False
+        return
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Start counting rows in a background thread."""
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Ignore the count once it is ready."""
+        self.is_cancelled = True
+        return
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        """Count rows emitting the result."""
+        try:
+            count = self.count_rows()
+        except Exception as err:
+            if not self.is_cancelled:
+                self.failed.emit(str(err))
+            return
+        if not self.is_cancelled:
+            self.count_ready.emit(count)
+        return
+
+    # ----------------------------------------------------------------------
+    def count_rows(self):
+        """Get number of rows the query returns.
+
+        SQLite can count rows of a subquery without reading its columns;
+        other dialects have the query executed once more and counted.
+        """
+        if self.dialect.lower() == 'sqlite':
+            res, errors = self.gdb.execute_sql(
+                'SELECT COUNT(*) FROM ({0})'.format(self.sql_query),
+                self.dialect)
+            if res is not None:
+                try:
+                    feat = res.GetNextFeature()
+                    return int(list(feat.items().values())[0])
+                finally:
+                    self.gdb.release_result(res)
+
+        res, errors = self.gdb.execute_sql(self.sql_query, self.dialect)
+        if res is None:
+            raise RuntimeError(errors)
+        try:
+            return len(res)
+        finally:
+            self.gdb.release_result(res)
@@ -0,0 +1,148 @@
+# -*- coding: UTF-8 -*-
+"""Reading rows of query results in background threads."""
+
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+########################################################################
+class RowFetcher(QObject):
+    """Read batches of rows of a result layer in a background thread.
+
+    The fetcher reads with the batch reader handed over by the table model,
+    which must not read from the result layer meanwhile. Rows are read
+    until the result is exhausted or there are `max_rows` rows, counting
+    the `row_count` rows read before; the limit can be raised while the
+    rows are being read. Subclasses handle every batch read.
+    """
+
+    finished = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    # ----------------------------------------------------------------------
+    def __init__(self,
+                 reader,
+                 max_rows=None,
+                 row_count=0,
+                 batch_rows=1000,
+                 parent=None):
+        """Initialize RowFetcher with the reader and the limit of rows."""
+        super(RowFetcher, self).__init__(parent)
+        self.reader = reader
+        self.max_rows = max_rows
+        self.row_count = row_count
+        self.batch_rows = batch_rows
+        self.is_stopped = False
+        self._cancel_event = threading.Event()
+        self._on_stopped = []
+        self._lock = threading.Lock()
+        self._thread = None
+        return
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Start reading rows in a background thread."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def set_max_rows(self, max_rows):
+        """Raise the number of rows to read; None to read all of them.
+
+        Return False if the fetcher has already stopped.
+        """
+        with self._lock:
+            if self.is_stopped:
+                return False
+            if max_rows is None or self.max_rows is not None and (
+                    max_rows > self.max_rows):
+                self.max_rows = max_rows
+            return True
+
+    # ----------------------------------------------------------------------
+    def cancel(self, on_stopped=None):
+        """Stop reading rows after the batch being read.
+
+        The `on_stopped` callback is called once nothing is read from the
+        result layer any more, in the background thread if it is running.
+        """
+        self._cancel_event.set()
+        with self._lock:
+            if on_stopped is not None and (self._thread is not None
+                                           and not self.is_stopped):
+                self._on_stopped.append(on_stopped)
+                return
+        if on_stopped is not None:
+            on_stopped()
+        return
+
+    # ----------------------------------------------------------------------
+    def is_running(self):
+        """Check whether rows are still being read."""
+        return bool(self._thread and self._thread.is_alive())
+
+    # ----------------------------------------------------------------------
+    def handle_batch(self, number_of_rows, columns):
+        """Handle a batch read; called in the background thread."""
+        raise NotImplementedError
+
+    # ----------------------------------------------------------------------
+    def _get_limit(self):
+        """Get number of rows to read next; 0 once the fetcher stops."""
+        with self._lock:
+            if (self.reader.is_exhausted or self._cancel_event.is_set()
+                    or self.max_rows is not None
+                    and self.row_count >= self.max_rows):
+                self.is_stopped = True
+                return 0
+            if self.max_rows is None:
+                return self.batch_rows
+            return min(self.batch_rows, self.max_rows - self.row_count)
+
+    # ----------------------------------------------------------------------
+    def _stop(self):
+        """Mark the fetcher stopped and call the callbacks waiting for it."""
+        with self._lock:
+            self.is_stopped = True
+            on_stopped, self._on_stopped = self._on_stopped, []
+        for callback in on_stopped:
+            callback()
+        return
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        """Read batches of rows emitting the number of rows once done."""
+        try:
+            limit = self._get_limit()
+            while limit:
+                number_of_rows, columns = self.reader.read(limit)
+                self.handle_batch(number_of_rows, columns)
+                with self._lock:
+                    self.row_count += number_of_rows
+                limit = self._get_limit()
+        except Exception as err:
+            self._stop()
+            if not self._cancel_event.is_set():
+                self.failed.emit(str(err))
+            return
+        self._stop()
+        if not self._cancel_event.is_set():
+            self.finished.emit(self.row_count)
+        return
+
+
+########################################################################
+class RowPrefetcher(RowFetcher):
+    """Read rows behind the drawn table posting every batch to the model."""
+
+    batch_read = pyqtSignal(int, object)
+
+    # ----------------------------------------------------------------------
+    def handle_batch(self, number_of_rows, columns):
+        """Post the batch to be appended to the result store."""
+        if number_of_rows:
+            self.batch_read.emit(number_of_rows, columns)
+        return
@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+"""Background loading of geodatabase schemas."""
+
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from cfg import schema_loader_workers
+
+
+########################################################################
+class SchemaLoader(QObject):
+    """Introspect geodatabase layers off the GUI thread.
+
+    Layers are streamed with the `layers_loaded` signal as soon as they
+    are known so that the tab can fill its TOC, highlighter and completer
+    while the rest of the geodatabase is being loaded.
+    """
+
+    layers_loaded = pyqtSignal(dict)
+    finished = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+    # ----------------------------------------------------------------------
+    def __init__(self, gdb, parent=None):
+        """Initialize SchemaLoader with the geodatabase to introspect."""
+        super(SchemaLoader, self).__init__(parent)
+        self.gdb = gdb
+        self._cancel_event = threading.Event()
+        self._thread = None
+        return
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Start loading schemas in a background thread."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel(self):
+        """Stop introspecting layers that have not been loaded yet."""
+        self._cancel_event.set()
+        return
+
+    # ----------------------------------------------------------------------
+    def is_running(self):
+        """Check whether the schemas are still being loaded."""
+        return bool(self._thread and self._thread.is_alive())
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        """Load schemas emitting the layers as they become known."""
+        try:
+            schemas = self.gdb.load_schemas(
+                callback=self.layers_loaded.emit,
+                workers=schema_loader_workers,
+                cancel_event=self._cancel_event)
+        except Exception as err:
+            self.failed.emit(str(err))
+            return
+        if not self._cancel_event.is_set():
+            self.finished.emit(schemas)
+        return
@@ -0,0 +1,330 @@
+# -*- coding: UTF-8 -*-
+"""Materialization of query results in local spill files."""
+
+import os
+import uuid
+import sqlite3
+import threading
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from result_store import (ResultStore, get_column_kind, get_column_values,
+                          pack_bytes, INT_COLUMN, FLOAT_COLUMN, DATE_COLUMN,
+                          DATETIME_COLUMN, STRING_COLUMN, BINARY_COLUMN,
+                          GEOMETRY_COLUMN)
+from row_fetcher import RowFetcher
+from cfg import spill_dir, spill_batch_rows, spill_cache_size_mb
+
+SQL_TYPES = {
+    INT_COLUMN: 'INTEGER',
+    FLOAT_COLUMN: 'REAL',
+    DATE_COLUMN: 'INTEGER',  # milliseconds since epoch
+    DATETIME_COLUMN: 'INTEGER',
+    STRING_COLUMN: 'TEXT',
+    BINARY_COLUMN: 'BLOB',
+    GEOMETRY_COLUMN: 'BLOB',  # WKB
+}
+
+
+########################################################################
+class SpillFile(object):
+    """Rows of a query result written into a temporary SQLite database.
+
+    Rows are appended by one thread and read with random access by others;
+    every thread uses its own connection. Sorted views of the rows are kept
+    in tables mapping positions to row ids so that a window of sorted rows
+    is read without scanning the rows before it.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, fields, geom_column='', directory=spill_dir):
+        """Initialize SpillFile creating the database."""
+        self.fields = fields
+        self.geom_column = geom_column
+        self.names_kinds = [(name, get_column_kind(field_type))
+                            for name, field_type in fields]
+        if geom_column:
+            self.names_kinds.append((geom_column, GEOMETRY_COLUMN))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory,
+                                 '{0}.sqlite'.format(uuid.uuid4().hex))
+        self.row_count = 0
+        self.order = None  # (column, is descending) of the sorted view
+        self._order_tables = set()
+        self._order_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        columns = ''.join(
+            ', c{0} {1}'.format(idx, SQL_TYPES[kind])
+            for idx, (_name, kind) in enumerate(self.names_kinds))
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE rows (id INTEGER PRIMARY KEY{0})'.format(columns))
+        conn.commit()
+        return
+
+    # ----------------------------------------------------------------------
+    def _connect(self):
+        """Get connection of the current thread to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA cache_size=-{0}'.format(
+                spill_cache_size_mb * 1024))
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    # ----------------------------------------------------------------------
+    def append_batch(self, number_of_rows, columns):
+        """Write rows of a batch read from the result layer."""
+        if not number_of_rows:
+            return
+        values = [
+            self.get_sql_values(kind, arrays)
+            for _name, kind, arrays in columns
+        ]
+        conn = self._connect()
+        conn.executemany(
+            'INSERT INTO rows VALUES (NULL{0})'.format(', ?' * len(values)),
+            zip(*values) if values else [()] * number_of_rows)
+        conn.commit()
+        self.row_count += number_of_rows
+        return
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def get_sql_values(kind, arrays):
+        """Get values of a batch column to write into the database."""
+        if kind in (DATE_COLUMN, DATETIME_COLUMN):
+            return [
+                None if is_null else value
+                for value, is_null in zip(arrays['values'].tolist(),
+                                          arrays['nulls'].tolist())
+            ]
+        return get_column_values(kind, arrays)
+
+    # ----------------------------------------------------------------------
+    def read_rows(self, start, count):
+        """Read `count` rows (all if negative) from position `start`.
+
+        Rows are read in the order of the sorted view if there is one.
+        """
+        conn = self._connect()
+        if self.order is None:
+            rows = conn.execute(
+                'SELECT * FROM rows WHERE id > ? ORDER BY id LIMIT ?',
+                (start, count)).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT rows.* FROM {0} AS o JOIN rows ON rows.id = o.row_id '
+                'WHERE o.id > ? ORDER BY o.id LIMIT ?'.format(
+                    self.get_order_table(*self.order)),
+                (start, count)).fetchall()
+
+        columns = []
+        for idx, (name, kind) in enumerate(self.names_kinds):
+            values = [row[idx + 1] for row in rows]
+            if kind in (INT_COLUMN, DATE_COLUMN, DATETIME_COLUMN):
+                arrays = {
+                    'values':
+                    np.array([0 if v is None else v for v in values],
+                             dtype=np.int64)
+                }
+            elif kind == FLOAT_COLUMN:
+                arrays = {
+                    'values':
+                    np.array([0.0 if v is None else v for v in values],
+                             dtype=np.float64)
+                }
+            elif kind == STRING_COLUMN:
+                arrays = pack_bytes([
+                    b'' if v is None else str(v).encode('utf-8')
+                    for v in values
+                ])
+            else:
+                arrays = pack_bytes([b'' if v is None else bytes(v)
+                                     for v in values])
+            arrays['nulls'] = np.array([v is None for v in values],
+                                       dtype=np.bool_)
+            columns.append((name, kind, arrays))
+
+        store = ResultStore(self.fields, self.geom_column)
+        store.append_batch(len(rows), columns)
+        return store
+
+    # ----------------------------------------------------------------------
+    def get_order_table(self, column, is_descending):
+        """Get table with row ids sorted by the column, creating it once.
+
+        Creating the table sorts all rows, so it is done by `SpillSorter`
+        in background before the sorted view is set.
+        """
+        table = 'order_{0}_{1}'.format(column,
+                                       'desc' if is_descending else 'asc')
+        if table in self._order_tables:
+            return table
+        with self._order_lock:
+            if table in self._order_tables:
+                return table
+            conn = self._connect()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS {0} '
+                '(id INTEGER PRIMARY KEY, row_id INTEGER)'.format(table))
+            conn.execute('DELETE FROM {0}'.format(table))
+            conn.execute('INSERT INTO {0} (row_id) SELECT id FROM rows '
+                         'ORDER BY c{1} {2}, id'.format(
+                             table, column,
+                             'DESC' if is_descending else 'ASC'))
+            conn.commit()
+            self._order_tables.add(table)
+        return table
+
+    # ----------------------------------------------------------------------
+    def set_order(self, column=None, is_descending=False):
+        """Sort the rows being read by the column; None for the row order."""
+        if column is None:
+            self.order = None
+            return
+        self.get_order_table(column, is_descending)
+        self.order = (column, is_descending)
+        return
+
+    # ----------------------------------------------------------------------
+    def interrupt(self):
+        """Stop the statements being executed, e.g. a sort, on all threads."""
+        with self._lock:
+            for conn in self._connections:
+                conn.interrupt()
+        return
+
+    # ----------------------------------------------------------------------
+    def close(self):
+        """Close all connections and delete the database files."""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+        return
+
+
+########################################################################
+class ResultSpiller(RowFetcher):
+    """Write rows of a result layer into a spill file in background.
+
+    Rows are written until the result is exhausted or `max_rows` rows are
+    in the file.
+    """
+
+    rows_spilled = pyqtSignal(int)
+
+    # ----------------------------------------------------------------------
+    def __init__(self,
+                 reader,
+                 spill,
+                 max_rows=None,
+                 batch_rows=spill_batch_rows,
+                 parent=None):
+        """Initialize ResultSpiller with the reader and the spill file."""
+        super(ResultSpiller, self).__init__(reader, max_rows, spill.row_count,
+                                            batch_rows, parent)
+        self.spill = spill
+        return
+
+    # ----------------------------------------------------------------------
+    def handle_batch(self, number_of_rows, columns):
+        """Write the batch emitting the number of rows in the file."""
+        self.spill.append_batch(number_of_rows, columns)
+        self.rows_spilled.emit(self.spill.row_count)
+        return
+
+
+########################################################################
+class SpillSorter(QObject):
+    """Sort rows of a spill file by a column in a background thread.
+
+    The sorted view is set by the table model once the rows are sorted, so
+    the grid keeps responding while SQLite sorts millions of rows.
+    """
+
+    finished = pyqtSignal(int, bool)
+    failed = pyqtSignal(str)
+
+    # ----------------------------------------------------------------------
+    def __init__(self, spill, column, is_descending=False, parent=None):
+        """Initialize SpillSorter with the spill file and the column."""
+        super(SpillSorter, self).__init__(parent)
+        self.spill = spill
+        self.column = column
+        self.is_descending = is_descending
+        self.is_stopped = False
+        self.is_cancelled = False
+        self._on_stopped = []
+        self._lock = threading.Lock()
+        self._thread = None
+        return
+
+    # ----------------------------------------------------------------------
+    def start(self):
+        """Start sorting rows in a background thread."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel(self, on_stopped=None):
+        """Stop sorting rows.
+
+        The `on_stopped` callback is called once the spill file is not used
+        any more, in the background thread if it is running.
+        """
+        with self._lock:
+            self.is_cancelled = True
+            if on_stopped is not None and (self._thread is not None
+                                           and not self.is_stopped):
+                self._on_stopped.append(on_stopped)
+                self.spill.interrupt()
+                return
+        if on_stopped is not None:
+            on_stopped()
+        return
+
+    # ----------------------------------------------------------------------
+    def _stop(self):
+        """Mark the sorter stopped and call the callbacks waiting for it."""
+        with self._lock:
+            self.is_stopped = True
+            on_stopped, self._on_stopped = self._on_stopped, []
+        for callback in on_stopped:
+            callback()
+        return
+
+    # ----------------------------------------------------------------------
+    def _run(self):
+        """Create the table of sorted row ids emitting the column once done."""
+        try:
+            self.spill.get_order_table(self.column, self.is_descending)
+        except Exception as err:
+            self._stop()
+            if not self.is_cancelled:
+                self.failed.emit(str(err))
+            return
+        self._stop()
+        if not self.is_cancelled:
+            self.finished.emit(self.column, self.is_descending)
+        return
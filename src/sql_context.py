@@ -0,0 +1,86 @@
+# -*- coding: UTF-8 -*-
+"""Context of the SQL statement being edited to complete words with."""
+
+import re
+
+# comments and strings are matched to be skipped as a whole; a name may be
+# qualified with the name of its schema or database, e.g. `DB1.Parcels`
+SQL_TOKEN_RE = re.compile(
+    r"--[^\n]*|/\*.*?(?:\*/|$)|'[^']*'?|\"[^\"]*\"?"
+    r"|[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*|[,()]",
+    re.DOTALL)
+
+# words following a table name which are not its alias
+NOT_ALIASES = frozenset([
+    'as', 'on', 'using', 'where', 'join', 'inner', 'left', 'right', 'full',
+    'outer', 'cross', 'natural', 'group', 'order', 'having', 'limit',
+    'offset', 'union', 'intersect', 'except', 'window'
+])
+
+
+# ----------------------------------------------------------------------
+def get_tokens(sql, cursor=None):
+    """Get names and punctuation of the statement skipping the typed word.
+
+    The name ending at the `cursor` position is being typed, so it is
+    neither a table nor an alias yet.
+    """
+    return [
+        match.group() for match in SQL_TOKEN_RE.finditer(sql)
+        if not match.group().startswith(('--', '/*', "'", '"'))
+        and not (match.end() == cursor and match.group()[0] not in ',()')
+    ]
+
+
+# ----------------------------------------------------------------------
+def get_alias(tokens, idx):
+    """Get (alias or None, index of the last token) of the item at `idx`."""
+    if idx + 1 < len(tokens) and tokens[idx + 1].lower() == 'as':
+        idx += 1
+    if idx + 1 < len(tokens) and tokens[idx + 1] not in (
+            ',', '(', ')') and tokens[idx + 1].lower() not in NOT_ALIASES:
+        return tokens[idx + 1], idx + 1
+    return None, idx
+
+
+# ----------------------------------------------------------------------
+def get_query_tables(sql, cursor=None):
+    """Get tables of FROM and JOIN clauses of the statement.
+
+    Qualified tables are also found by their own name; subqueries are
+    skipped with their aliases. Return dict
+    {table_name_or_alias_lowercase: table_name}.
+    """
+    tokens = get_tokens(sql, cursor)
+    tables = {}
+    depth = 0
+    subquery_depths = []  # depths at which subqueries of FROM are open
+    idx, expects_table = 0, False
+    while idx < len(tokens):
+        token = tokens[idx]
+        word = token.lower()
+        if token == '(':
+            if expects_table:
+                subquery_depths.append(depth)
+            depth += 1
+            expects_table = False
+        elif token == ')':
+            depth -= 1
+            if subquery_depths and subquery_depths[-1] == depth:
+                subquery_depths.pop()
+                _alias, idx = get_alias(tokens, idx)
+                expects_table = idx + 1 < len(tokens) and (
+                    tokens[idx + 1] == ',')
+        elif word in ('from', 'join'):
+            expects_table = True
+        elif expects_table and token != ',':
+            tables[word] = token
+            tables[word.split('.')[-1]] = token
+            alias, idx = get_alias(tokens, idx)
+            if alias is not None:
+                tables[alias.lower()] = token
+            expects_table = idx + 1 < len(tokens) and tokens[idx + 1] == ','
+        elif token != ',':
+            expects_table = False
+        idx += 1
+    return tables
@@ -3,20 +3,26 @@
 
 import re
 import time
-import itertools
 
 from highlighter import Highlighter
 from text_editor import TextEditor
 from completer import Completer
 from table import ResultTable
-from cfg import not_connected_to_gdb_message, sql_dialects_names
+from cfg import (not_connected_to_gdb_message, sql_dialects_names,
+                 row_count_strategy, progressive_fetch_max_rows)
 from geodatabase import Geodatabase
+from schema_loader import SchemaLoader
+from toc import Toc
+from vocabulary import GdbVocabulary, EMPTY_VOCABULARY
+from query_worker import QueryWorker
+from export import ExportCursor
+from row_count import BackgroundRowCounter, BACKGROUND_COUNT
 
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QAction, QPlainTextEdit,
                              QSplitter, QApplication, QStyleFactory, QLabel,
                              QPushButton, QToolBar, QFileDialog, QMessageBox,
-                             QTreeWidget, QTreeWidgetItem, QComboBox)
-from PyQt5.QtCore import Qt, QMargins
+                             QComboBox, QProgressBar)
+from PyQt5.QtCore import Qt, QMargins, QTimer
 from PyQt5.QtGui import QKeySequence, QFont
 
 
@@ -38,9 +44,16 @@ class Tab(QWidget):
 
         # define gdb props
         self.gdb = None
-        self.gdb_items = None
-        self.gdb_columns_names = None
         self.gdb_schemas = None
+        self.vocabulary = EMPTY_VOCABULARY
+        self.schema_loader = None
+        self._pending_schemas = {}
+
+        # layers streamed by the schema loader are applied in batches
+        self.schemas_flush_timer = QTimer(self)
+        self.schemas_flush_timer.setSingleShot(True)
+        self.schemas_flush_timer.setInterval(200)
+        self.schemas_flush_timer.timeout.connect(self._flush_gdb_schemas)
 
         # connected geodatabase path toolbar
         self.connected_gdb_path_label = QLabel('')
@@ -67,6 +80,33 @@ class Tab(QWidget):
         self.gdb_browse_toolbar.addSeparator()
         self.gdb_browse_toolbar.addWidget(self.gdb_sql_dialect_combobox)
 
+        # query execution state
+        self.query_worker = None
+        # cancelled worker GDAL is still executing the query of
+        self.cancelled_worker = None
+        self.query_start_time = None
+        self.drawn_query = None
+        self.exec_time = 0
+        self.first_rows_time = 0
+        self.total_time = None
+        self.row_counter = None
+        self.cancel_query_button = QPushButton('Cancel')
+        self.cancel_query_button.setToolTip('Stop waiting for the query')
+        self.cancel_query_button.setEnabled(False)
+        self.cancel_query_button.clicked.connect(self.cancel_query)
+        self.query_progress = QProgressBar()
+        self.query_progress.setRange(0, 0)  # busy indicator
+        self.query_progress.setMaximumWidth(100)
+        self.elapsed_time_timer = QTimer(self)
+        self.elapsed_time_timer.setInterval(100)
+        self.elapsed_time_timer.timeout.connect(self._show_elapsed_time)
+
+        self.gdb_browse_toolbar.addSeparator()
+        self.gdb_browse_toolbar.addWidget(self.cancel_query_button)
+        self.query_progress_action = self.gdb_browse_toolbar.addWidget(
+            self.query_progress)
+        self.query_progress_action.setVisible(False)
+
         # table with results
         self.table = ResultTable()
 
@@ -90,6 +130,7 @@ class Tab(QWidget):
         self.query.setFont(font)
         self.query.setTabStopWidth(20)
         self.highlighter = Highlighter(self.query.document())
+        self.highlighter.set_editor(self.query)
 
         # TODO select block of text - Ctrl+/ and they become comments
         self.completer = Completer()
@@ -121,13 +162,14 @@ class Tab(QWidget):
         self.table.hide()
 
         # TOC
-        self.toc = QTreeWidget()
-        self.toc.setHeaderHidden(True)
+        self.toc_panel = Toc()
+        self.toc = self.toc_panel.tree
+        self.toc_model = self.toc_panel.model
 
         # second splitter between the TOC to the left and the query/table to the
         # right
         toc_splitter = QSplitter(Qt.Horizontal)
-        toc_splitter.addWidget(self.toc)
+        toc_splitter.addWidget(self.toc_panel)
         toc_splitter.addWidget(splitter)
         toc_splitter.setCollapsible(0, True)
         toc_splitter.setSizes((200, 800))  # set the TOC vs data panel
@@ -161,9 +203,7 @@ class Tab(QWidget):
                 self.gdb = Geodatabase(gdb_path)
                 if self.gdb.is_valid():
                     self.connected_gdb_path_label.setText(self.gdb.path)
-                    self._set_gdb_items_highlight()
-                    self._set_gdb_items_complete()
-                    self._fill_toc()
+                    self.load_gdb_schemas()
                 else:
                     msg = QMessageBox()
                     msg.setText('This is not a valid file geodatabase')
@@ -172,11 +212,122 @@ class Tab(QWidget):
                     msg.exec_()
         else:
             if self.gdb.is_valid():
-                self._set_gdb_items_highlight()
-                self._set_gdb_items_complete()
+                self.load_gdb_schemas()
+
+        return
+
+    # ----------------------------------------------------------------------
+    def load_gdb_schemas(self):
+        """Load geodatabase schemas streaming them into the tab.
+
+        Cached schemas are applied right away; otherwise the geodatabase is
+        introspected in background and the TOC, highlighter and completer
+        are filled as the layers arrive.
+        """
+        if self.schema_loader:
+            self.schema_loader.cancel()
+            self.schema_loader = None
+        self.gdb_schemas = {}
+        self._pending_schemas = {}
+        self._fill_toc()
+
+        schemas = self.gdb.get_cached_schemas()
+        if schemas is not None:
+            self._add_gdb_schemas(schemas)
+            self._flush_gdb_schemas(is_complete=True)
+            return
+
+        loader = SchemaLoader(self.gdb, self)
+        loader.layers_loaded.connect(
+            lambda schemas, loader=loader: self._on_layers_loaded(
+                loader, schemas))
+        loader.finished.connect(
+            lambda schemas, loader=loader: self._on_schemas_loaded(
+                loader, schemas))
+        loader.failed.connect(
+            lambda err, loader=loader: self._on_schemas_failed(loader, err))
+        self.schema_loader = loader
+        self.update_app_status_bar('Loading geodatabase schemas...')
+        loader.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_layers_loaded(self, loader, schemas):
+        """Collect layers streamed by the schema loader."""
+        if loader is self.schema_loader:
+            self._add_gdb_schemas(schemas)
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_schemas_loaded(self, loader, schemas):
+        """Apply the rest of the layers once all of them are loaded."""
+        if loader is not self.schema_loader:
+            return
+        self.schema_loader = None
+        self._flush_gdb_schemas(is_complete=True)
+        self.update_app_status_bar('Loaded {0} tables'.format(len(schemas)))
+        return
 
+    # ----------------------------------------------------------------------
+    def _on_schemas_failed(self, loader, err):
+        """Show the error which stopped the schemas from loading."""
+        if loader is not self.schema_loader:
+            return
+        self.schema_loader = None
+        self._flush_gdb_schemas()
+        self.print_sql_execute_errors(err)
         return
 
+    # ----------------------------------------------------------------------
+    def _add_gdb_schemas(self, schemas):
+        """Queue layers to be shown in the TOC, highlighter and completer."""
+        self.gdb_schemas.update(schemas)
+        self._pending_schemas.update(schemas)
+        if not self.schemas_flush_timer.isActive():
+            self.schemas_flush_timer.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def _flush_gdb_schemas(self, is_complete=False):
+        """Push queued layers into the TOC, highlighter and completer.
+
+        Once all layers are loaded, the vocabulary of the geodatabase shared
+        by all tabs is used; layers streamed before that go into a
+        vocabulary of the tab.
+        """
+        self.schemas_flush_timer.stop()
+        new_schemas, self._pending_schemas = self._pending_schemas, {}
+        if not new_schemas and not is_complete:
+            return
+
+        vocabulary = self.gdb.get_vocabulary() if is_complete else None
+        if vocabulary is None:
+            vocabulary = GdbVocabulary(self.gdb_schemas)
+        self._set_vocabulary(vocabulary)
+        self._add_toc_items(new_schemas)
+        return
+
+    # ----------------------------------------------------------------------
+    def _set_vocabulary(self, vocabulary):
+        """Highlight and complete geodatabase items of the vocabulary."""
+        if vocabulary is not self.vocabulary:
+            self.vocabulary = vocabulary
+            self.highlighter.set_vocabulary(vocabulary)
+            self.completer.set_vocabulary(vocabulary)
+        return
+
+    # ----------------------------------------------------------------------
+    @property
+    def gdb_items(self):
+        """Get names of the geodatabase tables."""
+        return self.vocabulary.table_names
+
+    # ----------------------------------------------------------------------
+    @property
+    def gdb_columns_names(self):
+        """Get names of the columns of the geodatabase tables."""
+        return self.vocabulary.column_names
+
     # ----------------------------------------------------------------------
     def wheelEvent(self, event):  # noqa: N802
         """Override built-in method to handle mouse wheel scrolling.
@@ -218,29 +369,219 @@ class Tab(QWidget):
             else:
                 return
 
-            # TODO: add threading to allow user to cancel a long running query
-            QApplication.setOverrideCursor(Qt.WaitCursor)
-            start_time = time.time()
-            self.gdb.open_connection()
-            res, errors = self.gdb.execute_sql(
-                sql_query, self.gdb_sql_dialect_combobox.currentText())
-            end_time = time.time()
-            if errors:
-                self.print_sql_execute_errors(errors)
-
-            if res:
-                self.table.show()
-                self.errors_panel.hide()
-                self.draw_result_table(res)
-                msg = 'Executed in {exec_time:.1f} secs | {rows} rows'.format(
-                    exec_time=end_time - start_time,
-                    rows=self.table.table_data.number_layer_rows)
-                self.update_app_status_bar(msg)
+            if self.is_query_running():
+                return
+            if self.cancelled_worker is not None:
+                self.update_app_status_bar(
+                    'The cancelled query is still being executed by GDAL')
+                return
+
+            worker = QueryWorker(
+                self.gdb, sql_query,
+                self.gdb_sql_dialect_combobox.currentText(),
+                bool(self.result_should_include_geometry()))
+            worker.query_finished.connect(
+                lambda res, errors, rows, exec_time, reader, first_batch,
+                first_rows_time, worker=worker: self._on_query_finished(
+                    worker, res, errors, rows, exec_time, reader, first_batch,
+                    first_rows_time))
+            self.query_worker = worker
+            self._set_query_running(True)
+            worker.start()
 
         except Exception as err:
             print(err)
-        finally:
-            QApplication.restoreOverrideCursor()
+        return
+
+    # ----------------------------------------------------------------------
+    def is_query_running(self):
+        """Check whether a query of this tab is being executed."""
+        return self.query_worker is not None
+
+    # ----------------------------------------------------------------------
+    def cancel_query(self):
+        """Stop waiting for the query being executed."""
+        if not self.query_worker:
+            return
+        worker = self.query_worker
+        worker.cancel()
+        self.query_worker = None
+        self._set_query_running(False)
+        message = 'Cancelled after {0:.1f} secs'.format(
+            time.time() - self.query_start_time)
+        # GDAL keeps executing the query in the thread until it returns;
+        # no other query is run meanwhile not to pile them up
+        if not worker.is_interruptible() and worker.isRunning():
+            self.cancelled_worker = worker
+            self.execute.setEnabled(False)
+            worker.finished.connect(
+                lambda worker=worker: self._on_cancelled_worker_finished(
+                    worker))
+            message += ' | Waiting for GDAL to return'
+        self.update_app_status_bar(message)
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_cancelled_worker_finished(self, worker):
+        """Allow running queries again once GDAL returns."""
+        if worker is self.cancelled_worker:
+            self.cancelled_worker = None
+            self.execute.setEnabled(not self.is_query_running())
+        return
+
+    # ----------------------------------------------------------------------
+    def _set_query_running(self, is_running):
+        """Switch the tab controls between running and idle state."""
+        self.execute.setEnabled(not is_running)
+        self.cancel_query_button.setEnabled(is_running)
+        self.query_progress_action.setVisible(is_running)
+        if is_running:
+            self.query_start_time = time.time()
+            self.elapsed_time_timer.start()
+            self._show_elapsed_time()
+        else:
+            self.elapsed_time_timer.stop()
+        return
+
+    # ----------------------------------------------------------------------
+    def _show_elapsed_time(self):
+        """Show how long the running query has been executing."""
+        self.update_app_status_bar('Executing... {0:.1f} secs'.format(
+            time.time() - self.query_start_time))
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_query_finished(self, worker, res, errors, number_layer_rows,
+                           exec_time, reader, first_batch, first_rows_time):
+        """Draw the first rows received from the query worker.
+
+        The rest of the rows are fetched progressively behind the drawn
+        table; the time to the first rows is reported separately from the
+        total time.
+        """
+        if worker is not self.query_worker:  # the query has been cancelled
+            if reader is not None:
+                reader.close()
+            self.release_result(res)
+            return
+        self.query_worker = None
+        self._set_query_running(False)
+
+        if errors:
+            self.print_sql_execute_errors(errors)
+
+        if res is not None:
+            self.table.show()
+            self.errors_panel.hide()
+            previous_table_data = getattr(self.table, 'table_data', None)
+            self._cancel_row_counter()
+            self.draw_result_table(res, number_layer_rows, reader, first_batch,
+                                   worker.with_geometry)
+            if previous_table_data is not None:
+                previous_table_data.close(self.release_result)
+            self.drawn_query = (worker.sql_query, worker.dialect)
+            self.exec_time = exec_time
+            self.first_rows_time = first_rows_time
+            self.total_time = None
+            table_data = self.table.table_data
+            table_data.row_count_changed.connect(self.show_execution_summary)
+            table_data.prefetch_finished.connect(self._on_prefetch_finished)
+            table_data.fetch_failed.connect(self._on_fetch_failed)
+            table_data.sort_failed.connect(self._on_sort_failed)
+            table_data.start_prefetch(progressive_fetch_max_rows)
+            # rows written into a spill file are counted unless there are
+            # more of them than are written up front
+            if table_data.spill is None:
+                self._count_rows_if_unknown()
+            self.show_execution_summary()
+        else:
+            self.update_app_status_bar('')
+        return
+
+    # ----------------------------------------------------------------------
+    def _count_rows_if_unknown(self):
+        """Count rows of the drawn result unless their number is known."""
+        table_data = self.table.table_data
+        if (not table_data.is_row_count_known() and not self.row_counter
+                and row_count_strategy == BACKGROUND_COUNT):
+            self.count_rows(*self.drawn_query)
+        return
+
+    # ----------------------------------------------------------------------
+    def count_rows(self, sql_query, dialect):
+        """Count rows of the drawn result set in background."""
+        counter = BackgroundRowCounter(self.gdb, sql_query, dialect, self)
+        table_data = self.table.table_data
+        counter.count_ready.connect(
+            lambda count, counter=counter: self._on_rows_counted(
+                counter, table_data, count))
+        counter.failed.connect(
+            lambda err, counter=counter: self._on_rows_counted(
+                counter, table_data, None))
+        self.row_counter = counter
+        counter.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def _cancel_row_counter(self):
+        """Stop waiting for the rows of the previous result to be counted."""
+        if self.row_counter:
+            self.row_counter.cancel()
+            self.row_counter = None
+        return
+
+    # ----------------------------------------------------------------------
+    def is_counting_rows(self):
+        """Check whether rows of the drawn result are being counted."""
+        return self.row_counter is not None
+
+    # ----------------------------------------------------------------------
+    def _on_rows_counted(self, counter, table_data, count):
+        """Set the total number of rows once counted in background."""
+        if counter is self.row_counter:
+            self.row_counter = None
+        if count is not None:
+            table_data.set_number_layer_rows(count)
+        return
+
+    # ----------------------------------------------------------------------
+    def show_execution_summary(self):
+        """Show execution time and number of rows in the app status bar."""
+        table_data = getattr(self.table, 'table_data', None)
+        if table_data is None:
+            return
+        if self.total_time is None:
+            total = 'Executed in {0:.1f} secs'.format(self.exec_time)
+        else:
+            total = 'Total {0:.1f} secs'.format(self.total_time)
+        msg = 'First rows in {first:.1f} secs | {total} | {rows}'.format(
+            first=self.first_rows_time,
+            total=total,
+            rows=table_data.get_row_count_label())
+        self.update_app_status_bar(msg)
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_prefetch_finished(self):
+        """Report the total time once rows have been fetched behind."""
+        if self.total_time is None:
+            self.total_time = time.time() - self.query_start_time
+        self._count_rows_if_unknown()
+        self.show_execution_summary()
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_fetch_failed(self, err):
+        """Report that the rest of the rows could not be fetched."""
+        self.update_app_status_bar(
+            'Fetching rows failed: {0} | Showing {1:,} rows'.format(
+                err, self.table.table_data.rowCount()))
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_sort_failed(self, err):
+        """Report that the rows could not be sorted."""
+        self.update_app_status_bar('Sorting rows failed: {0}'.format(err))
         return
 
     # ----------------------------------------------------------------------
@@ -263,82 +604,102 @@ class Tab(QWidget):
         return
 
     # ----------------------------------------------------------------------
-    def draw_result_table(self, res):
+    def draw_result_table(self,
+                          res,
+                          number_layer_rows=None,
+                          reader=None,
+                          first_batch=None,
+                          show_shapes=None):
         """Draw table with the record set received from the geodatabase."""
         geom_col_name = res.GetGeometryColumn(
         )  # shape col was in the sql query
         self.geometry_isin_query = bool(geom_col_name)
+        if show_shapes is None:
+            show_shapes = bool(self.result_should_include_geometry())
 
         self.table.draw_result(
-            res, show_shapes=bool(self.result_should_include_geometry()))
-        self.table.view.resizeColumnsToContents()
+            res,
+            show_shapes=show_shapes,
+            number_layer_rows=number_layer_rows,
+            reader=reader,
+            first_batch=first_batch)
+        self.table.resize_columns()
         return
 
     # ----------------------------------------------------------------------
-    def print_sql_execute_errors(self, err):
-        """Print to a special panel errors that occurred during execution."""
-        self.table.hide()
-        self.errors_panel.show()
-        self.errors_panel.setPlainText(err)
-        return
+    def get_drawn_result(self):
+        """Get the OGR layer currently drawn in the result table."""
+        table_data = getattr(self.table, 'table_data', None)
+        if table_data is None:
+            return None
+        return table_data.result
 
     # ----------------------------------------------------------------------
-    def _set_gdb_items_highlight(self):
-        """Set completer and highlight properties for geodatabase items."""
-        self.gdb_items = self.gdb.get_items()
-        self.highlighter.set_highlight_rules_gdb_items(self.gdb_items, 'Table')
+    def get_export_cursor(self, **kwargs):
+        """Get cursor of its own over the drawn result to export rows with.
 
-        self.gdb_schemas = self.gdb.get_schemas()
-        self.gdb_columns_names = sorted(
-            list(
-                set(
-                    itertools.chain.from_iterable(
-                        [i.keys() for i in self.gdb_schemas.values()]))),
-            key=lambda x: x.lower())
+        Rows are read from the spill file once all rows have been written
+        there; otherwise the query of the drawn result is executed again.
+        """
+        table_data = self.table.table_data
+        spill = table_data.spill if table_data.spill is not None and (
+            table_data.is_exhausted) else None
+        sql_query, dialect = self.drawn_query
+        return ExportCursor(self.gdb, sql_query, dialect,
+                            bool(table_data.fetched_geom_column), spill,
+                            **kwargs)
 
     # ----------------------------------------------------------------------
-    def _set_gdb_items_complete(self):
-        """Update completer rules to include geodatabase items."""
-        self.completer.update_completer_string_list(self.gdb_items +
-                                                    self.gdb_columns_names)
-        self.highlighter.set_highlight_rules_gdb_items(self.gdb_columns_names,
-                                                       'Column')
+    def release_result(self, res):
+        """Give the result layer back to the geodatabase connection pool."""
+        if res is not None and self.gdb:
+            self.gdb.release_result(res)
         return
 
     # ----------------------------------------------------------------------
-    def _fill_toc(self):
-        """Fill TOC with geodatabase datasets and columns."""
-        self.toc.clear()
-        if not self.gdb_items:
-            return
+    def close_connection(self):
+        """Release the result drawn in the table before closing the tab."""
+        if self.schema_loader:
+            self.schema_loader.cancel()
+            self.schema_loader = None
+        self.cancel_query()
+        self._cancel_row_counter()
+        res = self.get_drawn_result()
+        if res is not None:
+            self.table.table_data.close(self.release_result)
+            self.table.view.setModel(None)
+            del self.table.table_data
+        return
 
-        for tbl_name in sorted(self.gdb_items, key=lambda i: i.lower()):
-            if tbl_name.islower() or tbl_name.isupper():
-                item = QTreeWidgetItem([tbl_name.title()])
-            else:
-                item = QTreeWidgetItem([tbl_name])
-            font = QFont()
-            font.setBold(True)
-            item.setFont(0, font)
+    # ----------------------------------------------------------------------
+    def print_sql_execute_errors(self, err):
+        """Print to a special panel errors that occurred during execution."""
+        self.table.hide()
+        self.errors_panel.show()
+        self.errors_panel.setPlainText(err)
+        return
 
-            for col_name, col_type in sorted(
-                    self.gdb_schemas[tbl_name].items()):
-                if col_name.islower() or col_name.isupper():
-                    col_name = col_name.title()
+    # ----------------------------------------------------------------------
+    def _fill_toc(self):
+        """Fill TOC with geodatabase datasets and columns."""
+        self.toc_model.set_schemas(dict(self.gdb_schemas or {}))
+        return
 
-                item_child = QTreeWidgetItem(
-                    ['{0} ({1})'.format(col_name, col_type)])
-                item.addChild(item_child)
-            self.toc.addTopLevelItem(item)
+    # ----------------------------------------------------------------------
+    def _add_toc_items(self, tbl_names):
+        """Insert geodatabase datasets into TOC keeping them sorted."""
+        self.toc_model.add_schemas(
+            {tbl_name: self.gdb_schemas[tbl_name]
+             for tbl_name in tbl_names})
         return
 
     # ----------------------------------------------------------------------
     def _do_toc_hide_show(self):
         """Hide TOC with tables and columns."""
-        if self.toc.isVisible():
-            self.toc.setVisible(False)
+        if self.toc_panel.isVisible():
+            self.toc_panel.setVisible(False)
         else:
-            self.toc.setVisible(True)
+            self.toc_panel.setVisible(True)
         return
 
     # ----------------------------------------------------------------------
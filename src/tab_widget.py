@@ -69,12 +69,20 @@ class TabWidget(QTabWidget):
         if dev_mode:
             empty_tab.gdb = Geodatabase('NYC.gdb')
             empty_tab.connected_gdb_path_label.setText(empty_tab.gdb.path)
-            empty_tab._set_gdb_items_highlight()
-            empty_tab._fill_toc()
+            empty_tab.load_gdb_schemas()
             empty_tab.query.setText('select * from streets limit 1000')
             empty_tab.run_query()
         return
 
+    # ----------------------------------------------------------------------
+    def removeTab(self, index):  # noqa: N802
+        """Override built-in method to release the tab result set."""
+        tab_to_close = self.widget(index)
+        if tab_to_close:
+            tab_to_close.close_connection()
+        super(TabWidget, self).removeTab(index)
+        return
+
     # ----------------------------------------------------------------------
     def on_close_tab_mouse(self, index):
         """Close the tab upon clicking on the close icon confirming first."""
@@ -2,79 +2,147 @@
 """Table with result set."""
 
 from collections import OrderedDict
-import pandas as pd
+
+import ogr
 
 from PyQt5.Qt import QApplication
 from PyQt5.Qt import QMainWindow, QAbstractTableModel, QModelIndex
 from PyQt5.Qt import Qt, QVariant
 from PyQt5 import QtGui
 from PyQt5 import QtCore
-from PyQt5.QtWidgets import QTableView, QAbstractItemView
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import (QTableView, QAbstractItemView,
+                             QStyledItemDelegate)
+
+from result_store import (ResultStore, BatchReader, WktPreviewCache,
+                          get_result_fields, read_batch, INT_COLUMN,
+                          FLOAT_COLUMN, DATE_COLUMN, DATETIME_COLUMN,
+                          STRING_COLUMN, BINARY_COLUMN, GEOMETRY_COLUMN)
+from spill_file import SpillFile, ResultSpiller, SpillSorter
+from row_fetcher import RowPrefetcher
+from cfg import (column_width_sample_rows, random_access_min_rows,
+                 random_access_window_rows, random_access_max_windows,
+                 use_spill_file)
 
 QMODEL_INDEX = QModelIndex()
+# role of the full cell value used for copying; cells show previews only
+FULL_TEXT_ROLE = Qt.UserRole + 1
 
 
 ########################################################################
-class Row(object):
-    """Row of the returned database result set."""
+class ElideDelegate(QStyledItemDelegate):
+    """Item delegate painting long values cut to fit into the cell.
+
+    Qt lays out the whole text of a cell before eliding it, so the text
+    is cut to a number of characters no cell is wide enough to show.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, parent=None, max_chars=500):
+        """Initialize ElideDelegate with the longest text to lay out."""
+        super(ElideDelegate, self).__init__(parent)
+        self.max_chars = max_chars
+        return
 
     # ----------------------------------------------------------------------
-    def __init__(self, **kwargs):
-        """Initialize Row with basic properties."""
-        self.__dict__.update(kwargs)
+    def initStyleOption(self, option, index):  # noqa: N802
+        """Override built-in method."""
+        super(ElideDelegate, self).initStyleOption(option, index)
+        text = option.text
+        if len(text) > self.max_chars or '\n' in text:
+            option.text = text[:self.max_chars].replace('\n', ' ')
+        option.textElideMode = Qt.ElideRight
+        return
 
 
 ########################################################################
 class ResultTable(QMainWindow):
     """Table with result set returned by SQL query."""
 
+    # the widest columns get when sized to their values, by kind of values
+    max_column_widths = {
+        INT_COLUMN: 120,
+        FLOAT_COLUMN: 160,
+        DATE_COLUMN: 110,
+        DATETIME_COLUMN: 170,
+        STRING_COLUMN: 320,
+        BINARY_COLUMN: 320,
+        GEOMETRY_COLUMN: 280,
+    }
+    column_padding = 16
+
     # ----------------------------------------------------------------------
     def __init__(self, parent=None):
         """Initialize ResultTable with basic layout."""
         super(ResultTable, self).__init__(parent)
         self.view = QTableView()
         self.view.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.view.setWordWrap(False)
+        self.view.setItemDelegate(ElideDelegate(self.view))
+        # rows are shown in the result order until a column header is clicked
+        self.view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
 
     # ----------------------------------------------------------------------
-    def draw_result(self, result, show_shapes=True):
+    def draw_result(self,
+                    result,
+                    show_shapes=True,
+                    number_layer_rows=None,
+                    reader=None,
+                    first_batch=None):
         """Load and draw result set into the table."""
-        self.table_data = ResultTableModel(result, show_shapes)
+        self.table_data = ResultTableModel(result, show_shapes,
+                                           number_layer_rows, reader,
+                                           first_batch)
+        self.table_data.row_count_changed.connect(self.show_row_count)
+        self.view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
         self.view.setModel(self.table_data)
+        # only rows written into a spill file can be sorted
+        self.view.setSortingEnabled(self.table_data.spill is not None)
         self.setCentralWidget(self.view)
         self.view.installEventFilter(self)
+        self.show_row_count()
         return
 
     # ----------------------------------------------------------------------
-    def get_selected_data_as_df(self):
-        """Get selected data as pandas data frame."""
-        # need to read all OGR layer features that were not read yet
-        if (self.table_data.number_of_fetched_layer_rows <
-                self.table_data.number_layer_rows):
-            (rows_fetched,
-             number_of_fetched_layer_rows) = self.table_data.get_layer_rows(
-                 self.table_data.number_layer_rows -
-                 self.table_data.number_of_fetched_layer_rows)
-
-            internal_rows = self.table_data.rows.copy()
-            for row in rows_fetched:
-                internal_rows.append(row)
-            rows_to_export = internal_rows
-
-            # reset the OGR back to where it was
-            # based on number of rows at that time
-            self.table_data.result.ResetReading()
-            for _i in range(len(self.table_data.rows)):
-                self.table_data.result.GetNextFeature()
-
-        else:
-            rows_to_export = self.table_data.rows
+    def resize_columns(self):
+        """Size columns to a sample of the loaded rows within the limits.
+
+        Unlike `resizeColumnsToContents`, which measures every loaded cell,
+        this takes the same time whatever the number of rows and the size
+        of the values is. Rows read in windows are sampled from the first
+        window only, so no other window is read before the grid is shown.
+        """
+        table_data = self.table_data
+        metrics = QtGui.QFontMetrics(self.view.font())
+        header_metrics = QtGui.QFontMetrics(
+            self.view.horizontalHeader().font())
+        number_of_rows = table_data.rowCount()
+        if table_data.is_windowed():
+            number_of_rows = min(number_of_rows, table_data.window_size)
+        step = max(1, number_of_rows // max(column_width_sample_rows, 1))
+        rows = range(0, number_of_rows, step)[:column_width_sample_rows]
+
+        for col, column in enumerate(table_data.store.columns):
+            max_width = self.max_column_widths[column.kind]
+            max_chars = max_width // max(metrics.averageCharWidth(), 1) + 1
+            width = header_metrics.width(table_data.headers[col])
+            for row in rows:
+                if width >= max_width:
+                    break
+                value = table_data.data(table_data.index(row, col))
+                if value is not None:
+                    width = max(width, metrics.width(str(value)[:max_chars]))
+            self.view.setColumnWidth(
+                col, min(width + self.column_padding, max_width))
+        return
 
-        df = pd.DataFrame.from_records(
-            data=[row.__dict__ for row in rows_to_export],
-            columns=self.table_data.headers,
-            index=range(1,
-                        len(rows_to_export) + 1))
-        return df
+    # ----------------------------------------------------------------------
+    def show_row_count(self):
+        """Show number of loaded rows and the total below the grid."""
+        self.statusBar().showMessage('Showing {0:,} of {1}'.format(
+            self.table_data.rowCount(),
+            self.table_data.get_row_count_label()))
+        return
 
     # ----------------------------------------------------------------------
     def eventFilter(self, src, evt):  # noqa: N802
@@ -92,9 +160,11 @@ class ResultTable(QMainWindow):
 
     # ----------------------------------------------------------------------
     def load_all_rows(self):
-        """Load all layer rows into the table view."""
-        while len(self.table_data.rows) < self.table_data.number_layer_rows:
-            self.table_data.fetchMore()
+        """Load all layer rows into the table view.
+
+        Rows are read in background and are shown as they arrive.
+        """
+        self.table_data.fetch_rows()
         return
 
     # ----------------------------------------------------------------------
@@ -113,12 +183,13 @@ class ResultTable(QMainWindow):
 
             output += '\t'.join(list(headers_to_copy)) + '\n'
             selected_rows = self.chunks(
-                [str(cell.data(0)) for cell in selection], len(headers_to_copy))
+                [str(cell.data(FULL_TEXT_ROLE)) for cell in selection],
+                len(headers_to_copy))
             for selected_row in selected_rows:
                 output += '\t'.join(selected_row)
                 output += '\n'
         else:
-            output = str(selection[0].data(0))
+            output = str(selection[0].data(FULL_TEXT_ROLE))
 
         clipboard = QApplication.clipboard()
         clipboard.setText(output)
@@ -134,32 +205,156 @@ class ResultTable(QMainWindow):
 
 ########################################################################
 class ResultTableModel(QAbstractTableModel):
-    """Result table model."""
+    """Result table model.
+
+    The number of rows may be unknown (None) when the result is drawn;
+    rows are fetched until the OGR cursor is exhausted and the total is
+    set either then or by a row counter running in background. Fetched
+    rows are kept column by column in a `ResultStore`.
+
+    Large results of layers that can seek to a row fast are accessed
+    randomly instead: all rows are shown at once and are read in windows
+    around the rows the view asks for, keeping a few windows in memory.
+
+    Other results are written into a spill file in background and their
+    rows are shown, sorted and exported from the file, also in windows.
+    """
+
+    row_count_changed = pyqtSignal()
+    prefetch_finished = pyqtSignal()
+    fetch_failed = pyqtSignal(str)
+    sort_failed = pyqtSignal(str)
 
     # ----------------------------------------------------------------------
-    def __init__(self, result, show_shapes):
-        """Initialize ResultTableModel with the basic settings."""
+    def __init__(self,
+                 result,
+                 show_shapes,
+                 number_layer_rows=None,
+                 reader=None,
+                 first_batch=None):
+        """Initialize ResultTableModel with the basic settings.
+
+        Rows already read from the result layer with the `reader` are passed
+        with `first_batch` to be shown without waiting for a fetch.
+        """
         super(ResultTableModel, self).__init__()
         self.chunk_size = 200
         self.show_shapes = show_shapes
-        self.number_of_fetched_layer_rows = 0
         self.result = result
-        self.number_layer_rows = self.get_layer_number_of_rows()
+        self.number_layer_rows = number_layer_rows
+        self.is_exhausted = False
         self.geom_column = self.get_geom_column()
+        self.fields = get_result_fields(result)
         self.headers = self.get_layer_columns(show_shapes)
-        self.rows = []
+        self.fetched_geom_column = self.geom_column if show_shapes else ''
+        self.reader = reader or BatchReader(result, self.fields,
+                                            self.fetched_geom_column)
+        self.store = ResultStore(self.fields, self.fetched_geom_column)
+        self.wkt_previews = WktPreviewCache()
         self.headers_index_mapper = {
             idx: header
             for idx, header in enumerate(self.headers)
         }
 
+        self.window_size = random_access_window_rows
+        self.max_windows = random_access_max_windows
+        self.windows = OrderedDict()  # first row -> store with window rows
+        self.is_random_access = self.can_access_randomly()
+        if self.is_random_access:
+            # the first rows are read again as a window when shown
+            self.reader.close()
+            first_batch = None
+
+        self.spill = None
+        self.fetcher = None  # reads rows in background until it finishes
+        self.pending_fetch = None  # (max_rows,) to read once it finishes
+        self.spilled_rows = 0
+        self.fetch_error = None
+        self.pending_sort = None  # (column, order) once all rows are written
+        self.sorter = None  # sorts rows of the spill file in background
+        if not self.is_random_access and use_spill_file:
+            self.spill = SpillFile(self.fields, self.fetched_geom_column)
+            if first_batch is not None:
+                self.spill.append_batch(*first_batch)
+                self.spilled_rows = self.spill.row_count
+                first_batch = None
+            if self.reader.is_exhausted:
+                self.is_exhausted = True
+                self.number_layer_rows = self.spilled_rows
+
+        if first_batch is not None:
+            number_of_rows, columns = first_batch
+            self.store.append_batch(number_of_rows, columns)
+            if self.reader.is_exhausted:
+                self.is_exhausted = True
+                self.number_layer_rows = self.store.row_count
+
+        self.prefetch_max_rows = 0
+
     # ----------------------------------------------------------------------
-    def get_layer_number_of_rows(self):
-        """Get the number of rows in the returned OGR layer."""
-        # TODO: any faster way to count features?
-        # on the source tables (select * from streets is fast;
-        # on views created on-the-fly is terribly slow)
-        return len(self.result)
+    def is_row_count_known(self):
+        """Check whether the total number of rows is known."""
+        return self.number_layer_rows is not None
+
+    # ----------------------------------------------------------------------
+    def set_number_layer_rows(self, number_layer_rows):
+        """Set the total number of rows once it has been counted."""
+        if self.is_row_count_known():
+            return
+        self.number_layer_rows = number_layer_rows
+        self.row_count_changed.emit()
+        return
+
+    # ----------------------------------------------------------------------
+    def can_access_randomly(self):
+        """Check whether rows should be read in windows as they are shown."""
+        return bool(self.is_row_count_known()
+                    and self.number_layer_rows > random_access_min_rows
+                    and not self.reader.is_remote
+                    and self.result.TestCapability(
+                        ogr.OLCFastSetNextByIndex))
+
+    # ----------------------------------------------------------------------
+    def is_windowed(self):
+        """Check whether rows are read in windows as they are shown."""
+        return self.is_random_access or self.spill is not None
+
+    # ----------------------------------------------------------------------
+    def get_window(self, row):
+        """Get (first row, store) of the window with the row.
+
+        The window is read from the layer or the spill file unless it is in
+        memory; the least recently used window is dropped when there are
+        too many of them.
+        """
+        start = row - row % self.window_size
+        window = self.windows.get(start)
+        # the last window of a spill file being written may miss rows
+        if window is not None and row - start < window.row_count:
+            self.windows.move_to_end(start)
+            return start, window
+
+        if self.spill is not None:
+            window = self.spill.read_rows(start, self.window_size)
+        else:
+            self.reader.close()  # the layer cannot seek while streamed
+            self.result.SetNextByIndex(start)
+            window = ResultStore(self.fields, self.fetched_geom_column)
+            window.append_batch(*read_batch(self.result, self.fields,
+                                            self.fetched_geom_column,
+                                            self.window_size))
+        self.windows[start] = window
+        self.windows.move_to_end(start)
+        if len(self.windows) > self.max_windows:
+            self.windows.popitem(last=False)
+        return start, window
+
+    # ----------------------------------------------------------------------
+    def get_row_count_label(self):
+        """Get number of rows to show to user; e.g. `1,000+ rows`."""
+        if self.is_row_count_known():
+            return '{0:,} rows'.format(self.number_layer_rows)
+        return '{0:,}+ rows (counting...)'.format(self.rowCount())
 
     # ----------------------------------------------------------------------
     def get_geom_column(self):
@@ -180,66 +375,251 @@ class ResultTableModel(QAbstractTableModel):
 
     # ----------------------------------------------------------------------
     def get_layer_rows(self, limit):
-        """Fetch result rows from an OGR layer, push into table data object."""
-        rows_fetched = []
-        number_of_fetched_layer_rows = 0
-        for _i in range(limit):
-            feat = self.result.GetNextFeature()
-            if feat:
-                attributes = feat.items()
-                if self.geom_column and self.show_shapes:
-                    geom = feat.geometry()
-                    if geom:
-                        attributes[self.geom_column] = geom.ExportToWkt()
-                rows_fetched.append(Row(**attributes))
-            else:
-                break
-        number_of_fetched_layer_rows += _i + 1
+        """Fetch result rows from an OGR layer as a columnar batch.
 
-        return rows_fetched, number_of_fetched_layer_rows
+        Return tuple (number of rows fetched, columns).
+        """
+        return self.reader.read(limit)
 
     # ----------------------------------------------------------------------
-    def rowCount(self, index=QMODEL_INDEX):  # noqa: N802
-        """Override built-in method."""
-        if not self.rows:
-            return 0
-
-        if len(self.rows) <= self.number_layer_rows:
-            return len(self.rows)
+    def close(self, release_result=None):
+        """Stop fetching rows and release the result layer with the callback.
+
+        Rows being read in background are not waited for; the reader is
+        closed and the result is released by the fetcher thread once it
+        stops.
+        """
+        if self.fetcher is not None:
+            self.fetcher.cancel(lambda: self._release(release_result))
+        elif self.sorter is not None:
+            self.sorter.cancel(lambda: self._release(release_result))
         else:
-            return self.number_layer_rows
+            self._release(release_result)
+        return
 
     # ----------------------------------------------------------------------
-    def canFetchMore(self, index=QMODEL_INDEX):  # noqa: N802
-        """Override built-in method."""
-        if self.number_layer_rows > len(self.rows):
-            return True
+    def _release(self, release_result=None):
+        """Close the reader and the spill file and release the result."""
+        self.reader.close()
+        if self.spill is not None:
+            self.spill.close()
+        if release_result is not None:
+            release_result(self.result)
+        return
+
+    # ----------------------------------------------------------------------
+    def start_prefetch(self, max_rows):
+        """Keep fetching rows behind the drawn table up to the limit.
+
+        Rows are read in a background thread and appended to the store or
+        written into the spill file.
+        """
+        self.prefetch_max_rows = max_rows
+        self.fetch_rows(max_rows)
+        return
+
+    # ----------------------------------------------------------------------
+    def fetch_rows(self, max_rows=None):
+        """Read the rows not read yet in background.
+
+        Up to `max_rows` rows are kept in the store or in the spill file;
+        None reads all rows. A running fetcher gets the higher limit; rows
+        of a stopped one are still being shown, so it is asked again later.
+        """
+        if self.fetch_error is not None:
+            return
+        if self.is_exhausted or self.is_random_access:
+            self.prefetch_finished.emit()
+            return
+        if self.fetcher is not None:
+            if not self.fetcher.set_max_rows(max_rows):
+                if self.pending_fetch is not None and (
+                        self.pending_fetch[0] is None or max_rows is not None
+                        and self.pending_fetch[0] > max_rows):
+                    max_rows = self.pending_fetch[0]
+                self.pending_fetch = (max_rows, )
+            return
+        if self.spill is not None:
+            fetcher = ResultSpiller(
+                self.reader, self.spill, max_rows, parent=self)
+            fetcher.rows_spilled.connect(self._on_rows_spilled)
         else:
-            return False
+            fetcher = RowPrefetcher(
+                self.reader,
+                max_rows,
+                self.store.row_count,
+                self.chunk_size,
+                parent=self)
+            fetcher.batch_read.connect(self._on_batch_read)
+        fetcher.finished.connect(
+            lambda number_of_rows, fetcher=fetcher: self._on_fetch_finished(
+                fetcher, number_of_rows))
+        fetcher.failed.connect(self._on_fetch_failed)
+        self.fetcher = fetcher
+        fetcher.start()
+        return
 
     # ----------------------------------------------------------------------
-    def fetchMore(self, index=QMODEL_INDEX):  # noqa: N802
-        """Override built-in method."""
-        remainder = self.number_layer_rows - len(self.rows)
-        items_to_fetch = min(remainder, self.chunk_size)
+    def is_fetching(self):
+        """Check whether rows are being fetched behind the drawn table."""
+        return self.fetcher is not None
 
-        rows_fetched, number_of_fetched_layer_rows = self.get_layer_rows(
-            limit=self.chunk_size)
-        self.number_of_fetched_layer_rows += number_of_fetched_layer_rows
-        for row in rows_fetched:
-            self.add_row(row)
+    # ----------------------------------------------------------------------
+    def _on_batch_read(self, number_of_rows, columns):
+        """Show the rows of a batch read behind the drawn table."""
+        # not using  self.beginResetModel() and self.endResetModel()
+        # as it will put the the current selected row to the top
+        first_row = self.store.row_count
+        self.beginInsertRows(QMODEL_INDEX, first_row,
+                             first_row + number_of_rows - 1)
+        self.store.append_batch(number_of_rows, columns)
+        self.endInsertRows()
+        if not self.is_row_count_known():
+            self.row_count_changed.emit()
+        return
 
-        self.beginInsertRows(QModelIndex(), len(self.rows),
-                             len(self.rows) + items_to_fetch - 1)
+    # ----------------------------------------------------------------------
+    def _on_rows_spilled(self, number_of_rows):
+        """Show the rows that have been written into the spill file."""
+        if number_of_rows <= self.spilled_rows:
+            return
+        self.beginInsertRows(QMODEL_INDEX, self.spilled_rows,
+                             number_of_rows - 1)
+        self.spilled_rows = number_of_rows
         self.endInsertRows()
+        if not self.is_row_count_known():
+            self.row_count_changed.emit()
         return
 
     # ----------------------------------------------------------------------
-    def add_row(self, row):
-        """Add row to the grid of cells with rows."""
-        # not using  self.beginResetModel() and self.endResetModel()
-        # as it will put the the current selected row to the top
-        self.rows.append(row)
+    def _on_fetch_finished(self, fetcher, number_of_rows):
+        """Set the total number of rows once all of them have been read.
+
+        A fetcher stopped at the limit of rows leaves the rest to be read
+        when the view fetches more rows.
+        """
+        if fetcher is not self.fetcher:
+            return
+        self.fetcher = None
+        if self.spill is not None:
+            self._on_rows_spilled(number_of_rows)
+        if self.reader.is_exhausted:
+            self.is_exhausted = True
+            self.set_number_layer_rows(self.spilled_rows if self.spill
+                                       is not None else self.store.row_count)
+            if self.pending_sort is not None:
+                self.sort(*self.pending_sort)
+        if self.pending_fetch is not None:
+            max_rows, = self.pending_fetch
+            self.pending_fetch = None
+            self.fetch_rows(max_rows)
+            return
+        self.prefetch_finished.emit()
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_fetch_failed(self, err):
+        """Keep the error of reading rows; the rows read are shown."""
+        self.fetcher = None
+        self.fetch_error = err
+        self.pending_sort = None
+        self.pending_fetch = None
+        self.fetch_failed.emit(err)
+        return
+
+    # ----------------------------------------------------------------------
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Override built-in method; sort rows of the spill file.
+
+        Rows are sorted once all of them have been written, so the rest of
+        the rows are written first, and in background; the sorted rows are
+        shown when the sort finishes. A negative column brings back the
+        order of the result.
+        """
+        if self.spill is None:
+            return
+        if column >= 0 and (self.spill.names_kinds[column][1] ==
+                            GEOMETRY_COLUMN):
+            return
+        if not self.is_exhausted:
+            self.pending_sort = (column, order) if column >= 0 else None
+            if self.pending_sort is not None:
+                self.fetch_rows()
+            return
+        self.pending_sort = None
+        if column < 0:
+            self.sorter = None
+            self._set_order(None)
+            return
+        sorter = SpillSorter(
+            self.spill, column, order == Qt.DescendingOrder, parent=self)
+        sorter.finished.connect(
+            lambda column, is_descending, sorter=sorter:
+            self._on_sort_finished(sorter, column, is_descending))
+        sorter.failed.connect(
+            lambda err, sorter=sorter: self._on_sort_failed(sorter, err))
+        self.sorter = sorter
+        sorter.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def is_sorting(self):
+        """Check whether rows of the spill file are being sorted."""
+        return self.sorter is not None
+
+    # ----------------------------------------------------------------------
+    def _on_sort_finished(self, sorter, column, is_descending):
+        """Show the rows sorted unless another sort has been asked for."""
+        if sorter is not self.sorter:
+            return
+        self.sorter = None
+        self._set_order(column, is_descending)
+        return
+
+    # ----------------------------------------------------------------------
+    def _on_sort_failed(self, sorter, err):
+        """Keep the rows in the order shown and report the error."""
+        if sorter is not self.sorter:
+            return
+        self.sorter = None
+        self.sort_failed.emit(err)
+        return
+
+    # ----------------------------------------------------------------------
+    def _set_order(self, column, is_descending=False):
+        """Show rows of the spill file in the sorted view."""
+        self.beginResetModel()
+        self.spill.set_order(column, is_descending)
+        self.windows.clear()
+        self.wkt_previews.clear()
+        self.endResetModel()
+        return
+
+    # ----------------------------------------------------------------------
+    def rowCount(self, index=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method."""
+        if self.is_random_access:
+            return self.number_layer_rows
+        if self.spill is not None:
+            return self.spilled_rows
+        if not self.is_row_count_known():
+            return self.store.row_count
+        return min(self.store.row_count, self.number_layer_rows)
+
+    # ----------------------------------------------------------------------
+    def canFetchMore(self, index=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method."""
+        if (self.is_exhausted or self.is_random_access or self.is_fetching()
+                or self.fetch_error is not None):
+            return False
+        if self.spill is not None or not self.is_row_count_known():
+            return True
+        return self.number_layer_rows > self.store.row_count
+
+    # ----------------------------------------------------------------------
+    def fetchMore(self, index=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method; rows are shown once read in background."""
+        self.fetch_rows(self.rowCount() + self.chunk_size)
         return
 
     # ----------------------------------------------------------------------
@@ -250,10 +630,20 @@ class ResultTableModel(QAbstractTableModel):
     # ----------------------------------------------------------------------
     def data(self, index, role=Qt.DisplayRole):  # noqa: N802
         """Override built-in method."""
-        col = index.column()
-        row = self.rows[index.row()]
-        if role == Qt.DisplayRole:
-            return getattr(row, self.headers_index_mapper[col], None)
+        if role not in (Qt.DisplayRole, FULL_TEXT_ROLE):
+            return None
+        row, col = index.row(), index.column()
+        store = self.store
+        if self.is_windowed():
+            start, store = self.get_window(row)
+            row -= start
+        if row >= store.row_count:
+            return None
+
+        column = store.columns[col]
+        if role == Qt.DisplayRole and column.kind == GEOMETRY_COLUMN:
+            return self.wkt_previews.get((col, index.row()), column, row)
+        return column.get_value(row)
 
     # ----------------------------------------------------------------------
     def headerData(self, section, orientation,  # noqa: N802
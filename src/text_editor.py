@@ -46,9 +46,16 @@ customcompleter.py
 #############################################################################
 """
 
+import re
+
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import (QTextCursor, QTextFormat, QColor)
-from PyQt5.QtWidgets import (QApplication, QCompleter, QTextEdit)
+from PyQt5.QtGui import (QTextCursor, QTextDocument, QTextFormat, QColor)
+from PyQt5.QtWidgets import (QApplication, QTextEdit)
+
+from sql_context import get_query_tables
+
+# word being typed after a table name or an alias and a dot
+QUALIFIED_WORD_RE = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)\.[A-Za-z0-9_]*$')
 
 
 ########################################################################
@@ -112,11 +119,6 @@ class TextEditor(QTextEdit):
         else:
             self._completer = completer
             completer.setWidget(self)
-            completer.setCompletionMode(QCompleter.PopupCompletion)
-
-            # PyQt bug? Qt.CaseInsensitive will leave some keywords out;
-            # need to use Qt.CaseSensitive and have duplicates of words
-            completer.setCaseSensitivity(Qt.CaseSensitive)
             completer.activated.connect(self.insert_completion)
         return
 
@@ -126,13 +128,42 @@ class TextEditor(QTextEdit):
         if self._completer.widget() is not self:
             return
 
+        # the prefix is replaced as completions may differ from it in case
         cur = self.textCursor()
-        extra_length = len(completion) - len(self._completer.completionPrefix())
         cur.movePosition(QTextCursor.Left)
         cur.movePosition(QTextCursor.EndOfWord)
-        cur.insertText(completion[-extra_length:])
+        cur.movePosition(QTextCursor.Left, QTextCursor.KeepAnchor,
+                         len(self._completer.completionPrefix()))
+        cur.insertText(completion)
         self.setTextCursor(cur)
 
+    # ----------------------------------------------------------------------
+    def get_completion_context(self):
+        """Get tables of the statement and the word before the dot if any.
+
+        Only the statement the cursor is in is parsed; the word being typed
+        is not taken for a table or an alias.
+        """
+        cur = self.textCursor()
+        document = self.document()
+        start = document.find(';', cur.position(), QTextDocument.FindBackward)
+        end = document.find(';', cur.position())
+        start_pos = start.position() if not start.isNull() else 0
+        end_pos = end.selectionStart() if not end.isNull() else (
+            document.characterCount() - 1)
+
+        statement = QTextCursor(document)
+        statement.setPosition(start_pos)
+        statement.setPosition(end_pos, QTextCursor.KeepAnchor)
+        tables = get_query_tables(
+            statement.selectedText().replace(u'\u2029', '\n'),
+            cur.position() - start_pos)
+
+        line = cur.block().text()[:cur.positionInBlock()]
+        match = QUALIFIED_WORD_RE.search(line)
+        qualifier = match.group(1) if match else None
+        return tables, qualifier
+
     # ----------------------------------------------------------------------
     def get_text_under_cursor(self):
         """Get the text currently under cursor."""
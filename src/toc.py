@@ -0,0 +1,246 @@
+# -*- coding: UTF-8 -*-
+"""Table of contents with geodatabase datasets and their columns."""
+
+import bisect
+
+from PyQt5.QtCore import Qt, QAbstractItemModel, QModelIndex, QVariant
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLineEdit, QTreeView
+
+QMODEL_INDEX = QModelIndex()
+TABLE_ID = 0  # internal id of the top level indexes
+
+
+########################################################################
+class TocModel(QAbstractItemModel):
+    """Tree model of geodatabase datasets and their columns.
+
+    Rows for columns are created only when a dataset is expanded and
+    datasets are filtered with a name index built once per dataset.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, parent=None):
+        """Initialize TocModel with no datasets."""
+        super(TocModel, self).__init__(parent)
+        self.table_font = QFont()
+        self.table_font.setBold(True)
+        self.filter_text = ''
+        self.schemas = {}
+        self._tables = []  # all dataset names sorted case-insensitively
+        self._keys = []  # lowercase dataset names in the same order
+        self._name_index = {}  # table -> lowercase names of table and columns
+        self._visible_tables = []  # datasets passing the filter
+        self._visible_keys = []  # lowercase names of the visible datasets
+        self._children = {}  # table -> column labels that have been fetched
+        self._ids = {}  # table -> stable id used as parent of its columns
+        self._id_tables = []  # tables in order of their ids
+        return
+
+    # ----------------------------------------------------------------------
+    @staticmethod
+    def get_label(name):
+        """Get name to show in the TOC for a dataset or a column."""
+        if name.islower() or name.isupper():
+            return name.title()
+        return name
+
+    # ----------------------------------------------------------------------
+    def set_schemas(self, schemas):
+        """Replace all datasets with the ones provided."""
+        self.beginResetModel()
+        self.schemas = {}
+        self._tables = []
+        self._keys = []
+        self._name_index = {}
+        self._children = {}
+        self._ids = {}
+        self._id_tables = []
+        self._add_to_index(schemas)
+        self._set_visible_tables()
+        self.endResetModel()
+        return
+
+    # ----------------------------------------------------------------------
+    def add_schemas(self, schemas):
+        """Insert datasets keeping them sorted; used while loading a gdb."""
+        new_schemas = {
+            tbl: cols
+            for tbl, cols in schemas.items() if tbl not in self.schemas
+        }
+        self._add_to_index(new_schemas)
+        for tbl in sorted(new_schemas, key=lambda i: i.lower()):
+            if not self._is_match(tbl):
+                continue
+            row = bisect.bisect(self._visible_keys, tbl.lower())
+            self.beginInsertRows(QMODEL_INDEX, row, row)
+            self._visible_tables.insert(row, tbl)
+            self._visible_keys.insert(row, tbl.lower())
+            self.endInsertRows()
+        return
+
+    # ----------------------------------------------------------------------
+    def _add_to_index(self, schemas):
+        """Add datasets to the sorted list and to the name index."""
+        for tbl, cols in schemas.items():
+            self.schemas[tbl] = cols
+            idx = bisect.bisect(self._keys, tbl.lower())
+            self._keys.insert(idx, tbl.lower())
+            self._tables.insert(idx, tbl)
+            self._name_index[tbl] = '\n'.join([tbl] + list(cols)).lower()
+            self._ids[tbl] = len(self._id_tables) + 1
+            self._id_tables.append(tbl)
+        return
+
+    # ----------------------------------------------------------------------
+    def set_filter(self, text):
+        """Show only datasets whose name or any column name contains text."""
+        self.beginResetModel()
+        self.filter_text = text.strip().lower()
+        self._children = {}
+        self._set_visible_tables()
+        self.endResetModel()
+        return
+
+    # ----------------------------------------------------------------------
+    def _set_visible_tables(self):
+        """Collect datasets that pass the current filter."""
+        self._visible_tables = [
+            tbl for tbl in self._tables if self._is_match(tbl)
+        ]
+        self._visible_keys = [tbl.lower() for tbl in self._visible_tables]
+        return
+
+    # ----------------------------------------------------------------------
+    def _is_match(self, tbl):
+        """Check if the dataset passes the current filter."""
+        return self.filter_text in self._name_index[tbl]
+
+    # ----------------------------------------------------------------------
+    def _get_children(self, tbl):
+        """Get column labels of a dataset that pass the current filter."""
+        show_all = (not self.filter_text
+                    or self.filter_text in tbl.lower())
+        return [
+            '{0} ({1})'.format(self.get_label(col_name), col_type)
+            for col_name, col_type in sorted(self.schemas[tbl].items())
+            if show_all or self.filter_text in col_name.lower()
+        ]
+
+    # ----------------------------------------------------------------------
+    def index(self, row, column, parent=QMODEL_INDEX):
+        """Override built-in method."""
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, TABLE_ID)
+        return self.createIndex(row, column,
+                                self._ids[self._visible_tables[parent.row()]])
+
+    # ----------------------------------------------------------------------
+    def parent(self, index):
+        """Override built-in method."""
+        if not index.isValid() or index.internalId() == TABLE_ID:
+            return QModelIndex()
+        tbl = self._id_tables[index.internalId() - 1]
+        row = bisect.bisect_left(self._visible_keys, tbl.lower())
+        return self.createIndex(row, 0, TABLE_ID)
+
+    # ----------------------------------------------------------------------
+    def rowCount(self, parent=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method."""
+        if not parent.isValid():
+            return len(self._visible_tables)
+        if parent.internalId() != TABLE_ID or parent.column() != 0:
+            return 0
+        tbl = self._visible_tables[parent.row()]
+        return len(self._children.get(tbl, []))
+
+    # ----------------------------------------------------------------------
+    def columnCount(self, parent=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method."""
+        return 1
+
+    # ----------------------------------------------------------------------
+    def hasChildren(self, parent=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method."""
+        if not parent.isValid():
+            return bool(self._visible_tables)
+        return parent.internalId() == TABLE_ID
+
+    # ----------------------------------------------------------------------
+    def canFetchMore(self, parent=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method."""
+        if not parent.isValid() or parent.internalId() != TABLE_ID:
+            return False
+        return self._visible_tables[parent.row()] not in self._children
+
+    # ----------------------------------------------------------------------
+    def fetchMore(self, parent=QMODEL_INDEX):  # noqa: N802
+        """Override built-in method; create column rows of a dataset."""
+        if not self.canFetchMore(parent):
+            return
+        tbl = self._visible_tables[parent.row()]
+        children = self._get_children(tbl)
+        if not children:
+            self._children[tbl] = []
+            return
+        self.beginInsertRows(parent, 0, len(children) - 1)
+        self._children[tbl] = children
+        self.endInsertRows()
+        return
+
+    # ----------------------------------------------------------------------
+    def data(self, index, role=Qt.DisplayRole):
+        """Override built-in method."""
+        if not index.isValid():
+            return QVariant()
+        if index.internalId() == TABLE_ID:
+            if role == Qt.DisplayRole:
+                return self.get_label(self._visible_tables[index.row()])
+            if role == Qt.FontRole:
+                return self.table_font
+            return QVariant()
+        if role == Qt.DisplayRole:
+            tbl = self._id_tables[index.internalId() - 1]
+            return self._children[tbl][index.row()]
+        return QVariant()
+
+
+########################################################################
+class Toc(QWidget):
+    """Panel with the filter box and the tree of geodatabase datasets."""
+
+    # ----------------------------------------------------------------------
+    def __init__(self, parent=None):
+        """Initialize Toc with the filter box and the tree view."""
+        super(Toc, self).__init__(parent)
+        self.model = TocModel(self)
+
+        self.filter_box = QLineEdit()
+        self.filter_box.setPlaceholderText('Filter tables and columns')
+        self.filter_box.setClearButtonEnabled(True)
+        self.filter_box.textChanged.connect(self.set_filter)
+
+        self.tree = QTreeView()
+        self.tree.setHeaderHidden(True)
+        self.tree.setUniformRowHeights(True)
+        self.tree.setModel(self.model)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.filter_box)
+        layout.addWidget(self.tree)
+        self.setLayout(layout)
+
+        # expanding datasets is cheap only when a few of them match
+        self.max_expanded_on_filter = 50
+        return
+
+    # ----------------------------------------------------------------------
+    def set_filter(self, text):
+        """Filter datasets showing the matching columns expanded."""
+        self.model.set_filter(text)
+        if text and self.model.rowCount() <= self.max_expanded_on_filter:
+            self.tree.expandAll()
+        return
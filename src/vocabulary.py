@@ -0,0 +1,103 @@
+# -*- coding: UTF-8 -*-
+"""Names of geodatabase items to highlight and complete in queries."""
+
+import bisect
+import itertools
+import threading
+
+
+########################################################################
+class PrefixIndex(object):
+    """Names sorted case-insensitively to find the ones with a prefix.
+
+    Names keep their casing; a lookup is a binary search followed by
+    reading as many names as asked for.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, names):
+        """Initialize PrefixIndex with names to look up."""
+        pairs = sorted(set((name.lower(), name) for name in names))
+        self.keys = [key for key, _name in pairs]
+        self.names = [name for _key, name in pairs]
+        return
+
+    # ----------------------------------------------------------------------
+    def __len__(self):
+        """Get number of names in the index."""
+        return len(self.names)
+
+    # ----------------------------------------------------------------------
+    def get_matches(self, prefix, limit):
+        """Get up to `limit` names starting with the prefix in any case."""
+        prefix = prefix.lower()
+        idx = bisect.bisect_left(self.keys, prefix)
+        matches = []
+        while (idx < len(self.keys) and len(matches) < limit
+               and self.keys[idx].startswith(prefix)):
+            matches.append(self.names[idx])
+            idx += 1
+        return matches
+
+
+########################################################################
+class GdbVocabulary(object):
+    """Immutable set of names of geodatabase tables and their columns.
+
+    One vocabulary is built per geodatabase schema and shared by all tabs
+    connected to the geodatabase.
+    """
+
+    # ----------------------------------------------------------------------
+    def __init__(self, schemas):
+        """Initialize GdbVocabulary with {table_name: {column: type}}."""
+        self.table_names = tuple(sorted(schemas, key=lambda x: x.lower()))
+        self.column_names = tuple(
+            sorted(
+                set(
+                    itertools.chain.from_iterable(
+                        columns.keys() for columns in schemas.values())),
+                key=lambda x: x.lower()))
+        self.tables = frozenset(name.lower() for name in self.table_names)
+        self.columns = frozenset(name.lower() for name in self.column_names)
+        self.index = PrefixIndex(self.table_names + self.column_names)
+        self.tables_index = PrefixIndex(self.table_names)
+        self.columns_indexes = {
+            table_name.lower(): PrefixIndex(columns)
+            for table_name, columns in schemas.items()
+        }
+        return
+
+    # ----------------------------------------------------------------------
+    def get_columns_matches(self, table_names, prefix, limit):
+        """Get columns of the tables starting with the prefix in any case."""
+        matches = set()
+        for table_name in table_names:
+            index = self.columns_indexes.get(table_name.lower())
+            if index is not None:
+                matches.update(index.get_matches(prefix, limit))
+        return sorted(matches, key=lambda x: x.lower())
+
+
+EMPTY_VOCABULARY = GdbVocabulary({})
+
+# the latest vocabulary of every geodatabase: {gdb_key: (signature, vocab)}
+_vocabularies = {}
+_vocabularies_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------
+def get_vocabulary(gdb_key, signature, schemas):
+    """Get vocabulary of the geodatabase schemas with the signature.
+
+    The vocabulary is built once per signature of the geodatabase tables
+    files; it is built again once the schema has changed.
+    """
+    with _vocabularies_lock:
+        cached = _vocabularies.get(gdb_key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    vocabulary = GdbVocabulary(schemas)
+    with _vocabularies_lock:
+        _vocabularies[gdb_key] = (signature, vocabulary)
+    return vocabulary
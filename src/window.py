@@ -3,7 +3,7 @@
 
 import io
 import os
-import tempfile
+import shutil
 
 import pkg_resources
 try:
@@ -16,22 +16,30 @@ else:
     tabulate_found = True
 
 from PyQt5.QtWidgets import (QMainWindow, QAction, QFileDialog, QTextEdit,
-                             QApplication)
+                             QApplication, QLabel)
 from PyQt5.Qt import Qt
 from PyQt5.QtGui import QIcon, QKeySequence
 from tab_widget import TabWidget
+from export import export_dataframe, write_markdown, get_export_path
+from file_export import (FileExporter, EXPORT_LAYER_NAME, get_file_formats,
+                         get_file_filter)
 
-from cfg import project_name, test_mode
+from cfg import project_name, test_mode, export_viewer_page_lines
 
 
 ########################################################################
 class ExportResultWindow(QMainWindow):
-    """Window with the result of exporting the data."""
+    """Window with the result of exporting the data.
+
+    Short export text is shown as it is; exported files are shown page by
+    page reading only the lines of the page being shown from the file.
+    """
 
     def __init__(self, parent=None):
         """Initialize ExportResultWindow with basic properties."""
         super(ExportResultWindow, self).__init__(parent)
         self.result = QTextEdit()
+        self.result.setReadOnly(True)
         self.result.setTabStopWidth(20)
         font = self.result.font()
         font.setPointSize(11)
@@ -39,8 +47,116 @@ class ExportResultWindow(QMainWindow):
         self.setWindowTitle('Export result')
         self.setCentralWidget(self.result)
         self.setGeometry(300, 300, 900, 300)
+
+        self.path = None
+        self.page_offsets = []
+        self.page = 0
+
+        toolbar = self.addToolBar('Export result')
+        self.previous_page_action = toolbar.addAction(
+            'Previous page', lambda: self.show_page(self.page - 1))
+        self.page_label = QLabel('')
+        self.page_label_action = toolbar.addWidget(self.page_label)
+        self.next_page_action = toolbar.addAction(
+            'Next page', lambda: self.show_page(self.page + 1))
+        toolbar.addSeparator()
+        toolbar.addAction('Copy all', self.copy_all)
+        toolbar.addAction('Save as...', self.save_as)
+        self._update_pager()
+        return
+
+    # ----------------------------------------------------------------------
+    def set_text(self, text):
+        """Show export text."""
+        self.path = None
+        self.page_offsets = []
+        self.result.setText(text)
+        self.statusBar().showMessage('')
+        self._update_pager()
+        return
+
+    # ----------------------------------------------------------------------
+    def show_file(self, path, message=''):
+        """Show exported file starting with its first page."""
+        self.path = path
+        self.page_offsets = get_page_offsets(path, export_viewer_page_lines)
+        self.statusBar().showMessage(message)
+        self.show_page(0)
+        return
+
+    # ----------------------------------------------------------------------
+    def show_page(self, page):
+        """Show lines of the page of the exported file."""
+        if self.path is None:
+            return
+        self.page = max(0, min(page, len(self.page_offsets) - 1))
+        start = self.page_offsets[self.page]
+        with io.open(self.path, 'rb') as f:
+            f.seek(start)
+            if self.page + 1 < len(self.page_offsets):
+                data = f.read(self.page_offsets[self.page + 1] - start)
+            else:
+                data = f.read()
+        self.result.setPlainText(
+            data.decode('utf-8', errors='replace').rstrip('\n'))
+        self._update_pager()
+        return
+
+    # ----------------------------------------------------------------------
+    def _update_pager(self):
+        """Show page controls only for files of more than one page."""
+        is_paged = len(self.page_offsets) > 1
+        for action in (self.previous_page_action, self.page_label_action,
+                       self.next_page_action):
+            action.setVisible(is_paged)
+        if is_paged:
+            self.page_label.setText(' Page {0:,} of {1:,} '.format(
+                self.page + 1, len(self.page_offsets)))
+            self.previous_page_action.setEnabled(self.page > 0)
+            self.next_page_action.setEnabled(
+                self.page + 1 < len(self.page_offsets))
+        return
+
+    # ----------------------------------------------------------------------
+    def copy_all(self):
+        """Copy the whole export text or file into the clipboard."""
+        if self.path is None:
+            text = self.result.toPlainText()
+        else:
+            with io.open(self.path, encoding='utf-8') as f:
+                text = f.read()
+        QApplication.clipboard().setText(text)
         return
 
+    # ----------------------------------------------------------------------
+    def save_as(self):
+        """Save the whole export text or file as a new file."""
+        name = QFileDialog.getSaveFileName(
+            self, 'Save as new file', filter='All Files (*)')
+        if not name[0]:
+            return
+        if self.path is None:
+            with io.open(name[0], 'w', encoding='utf-8') as f:
+                f.write(self.result.toPlainText())
+        else:
+            shutil.copyfile(self.path, name[0])
+        return
+
+
+# ----------------------------------------------------------------------
+def get_page_offsets(path, page_lines):
+    """Get byte offsets in the file of the first line of every page."""
+    offsets = [0]
+    position = 0
+    with io.open(path, 'rb') as f:
+        for line_number, line in enumerate(f, 1):
+            position += len(line)
+            if line_number % page_lines == 0:
+                offsets.append(position)
+    if len(offsets) > 1 and offsets[-1] == position:
+        offsets.pop()
+    return offsets
+
 
 ########################################################################
 class Window(QMainWindow):
@@ -95,14 +211,15 @@ class Window(QMainWindow):
 
         export_action_qgis = result_export_menu.addAction('&QGIS')
         export_action_qgis.setToolTip(
-            'Get plain WKT to use with the QuickWKT plugin')
+            'Get PyQGIS code to add a layer from a temp GeoPackage')
 
         export_action_arc = result_export_menu.addAction('&ArcMap')
-        export_action_arc.setToolTip('Get arcpy code to create in_memory layer')
+        export_action_arc.setToolTip(
+            'Get arcpy code to create in_memory layer from a temp GeoPackage')
 
         export_action_df = result_export_menu.addAction('&DataFrame')
         export_action_df.setToolTip(
-            'Get Python code to create a pandas df using a temp csv file')
+            'Get Python code to create a pandas df using a temp Feather file')
 
         export_action_md = result_export_menu.addAction('&Markdown')
         export_action_md.setToolTip('Get table formatted in Markdown')
@@ -121,6 +238,20 @@ class Window(QMainWindow):
             lambda evt, arg=option: self.export_result(
                 evt, export_action_md.text()))
 
+        export_file_action = QAction('Export to &file...', self)
+        export_file_action.setToolTip(
+            'Write result into GeoPackage, FlatGeobuf, GeoParquet or '
+            'GeoJSONSeq with GDAL')
+        export_file_action.triggered.connect(self.export_result_to_file)
+        result_menu.addAction(export_file_action)
+        self.cancel_export_action = QAction('&Cancel export', self)
+        self.cancel_export_action.setToolTip(
+            'Stop writing the file being exported')
+        self.cancel_export_action.setEnabled(False)
+        self.cancel_export_action.triggered.connect(self.cancel_file_export)
+        result_menu.addAction(self.cancel_export_action)
+        result_menu.setToolTipsVisible(True)
+
         settings_menu = menu.addMenu('&Settings')
         settings_menu.setToolTipsVisible(True)
         self.do_include_geometry = QAction(
@@ -137,6 +268,7 @@ class Window(QMainWindow):
         self.show()
 
         self.export_result_window = None
+        self.file_exporter = None
         return
 
     # ----------------------------------------------------------------------
@@ -154,59 +286,150 @@ class Window(QMainWindow):
             return
 
         QApplication.setOverrideCursor(Qt.WaitCursor)
-        df = current_tab.table.get_selected_data_as_df()
-
         if not self.export_result_window:
             self.export_result_window = ExportResultWindow()
 
-        if option == '&QGIS':
-            if self.window().tab_widget.currentWidget(
-            ).geometry_isin_query and self.window(
-            ).do_include_geometry.isChecked():
-                s = '\n'.join(df[df.columns[-1]].tolist())
-                self.export_result_window.result.setText(s)
-            else:
-                self.export_result_window.result.setText('')
-
-        if option == '&ArcMap':
-            if self.window().tab_widget.currentWidget(
-            ).geometry_isin_query and self.window(
-            ).do_include_geometry.isChecked():
-                # TODO: get the fields data along with the geometries/dump csv
-                snippet = self._get_arcmap_snippet(
-                    geoms=df[df.columns[-1]].tolist())
-                self.export_result_window.result.setText(snippet)
+        # rows are read with a cursor of its own in batches and written to
+        # files; the rows and the cursor of the drawn table are not touched
+        try:
+            if option in ('&QGIS', '&ArcMap'):
+                self._export_layer(current_tab, option)
             else:
-                self.export_result_window.result.setText('')
+                with current_tab.get_export_cursor() as cursor:
+                    self._export_rows(current_tab, cursor, option)
+        except RuntimeError as err:  # the query could not be executed again
+            self.export_result_window.set_text(
+                'Export failed: {0}'.format(err))
+            self.statusBar().showMessage('Export failed')
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.export_result_window.show()
+        return
+
+    # ----------------------------------------------------------------------
+    def export_result_to_file(self, evt=None, out_path=None, file_format=None):
+        """Write result set into a file of a geospatial format with GDAL.
+
+        The query of the drawn result is executed once more by GDAL which
+        copies features into the file in background.
+        """
+        current_tab = self.tab_widget.widget(self.tab_widget.currentIndex())
+        if current_tab is None or current_tab.drawn_query is None:
+            return
+        if self.file_exporter is not None and self.file_exporter.is_running():
+            self.statusBar().showMessage('Another export is running')
+            return
+
+        file_formats = get_file_formats()
+        if out_path is None:
+            out_path, file_filter = QFileDialog.getSaveFileName(
+                self, 'Export result to file',
+                filter=get_file_filter(file_formats))
+            if not out_path:
+                return
+            file_format = file_filter.split(' (')[0]
+        driver_name, ext = file_formats[file_format]
+        if not os.path.splitext(out_path)[1]:
+            out_path += ext
+
+        self._start_file_export(
+            current_tab, out_path, driver_name,
+            lambda path: self.statusBar().showMessage(
+                'Exported to {0}'.format(path)))
+        return
+
+    # ----------------------------------------------------------------------
+    def _start_file_export(self, current_tab, out_path, driver_name,
+                           on_finished, on_failed=None):
+        """Write the drawn result into a file with a FileExporter.
+
+        Progress and errors are shown in the status bar; `on_finished` gets
+        the path of the file once it is written.
+        """
+        sql_query, dialect = current_tab.drawn_query
+        self.file_exporter = FileExporter(current_tab.gdb.path, sql_query,
+                                          dialect, out_path, driver_name)
+        self.file_exporter.progress.connect(
+            lambda complete: self.statusBar().showMessage(
+                'Exporting to {0}... {1:.0%}'.format(out_path, complete)))
+        self.file_exporter.finished.connect(on_finished)
+        self.file_exporter.failed.connect(
+            lambda err: self.statusBar().showMessage(
+                'Export failed: {0}'.format(err)))
+        if on_failed is not None:
+            self.file_exporter.failed.connect(on_failed)
+        for signal in (self.file_exporter.finished,
+                       self.file_exporter.failed):
+            signal.connect(
+                lambda _arg: self.cancel_export_action.setEnabled(False))
+        self.cancel_export_action.setEnabled(True)
+        self.file_exporter.start()
+        return
+
+    # ----------------------------------------------------------------------
+    def cancel_file_export(self):
+        """Stop writing the file being exported in background."""
+        if self.file_exporter is not None and self.file_exporter.is_running():
+            self.file_exporter.cancel()
+            self.statusBar().showMessage('Cancelling export...')
+        return
+
+    # ----------------------------------------------------------------------
+    def _export_layer(self, current_tab, option):
+        """Write result into a GeoPackage and get code to load it as layer.
+
+        GDAL writes the features with all their fields into the file in
+        background; the code only refers to the file, however many features
+        there are, and is shown once the file is written.
+        """
+        if not (current_tab.geometry_isin_query
+                and self.do_include_geometry.isChecked()):
+            self.export_result_window.set_text('')
+            return
+        if self.file_exporter is not None and self.file_exporter.is_running():
+            self.export_result_window.set_text('Another export is running')
+            return
 
+        if option == '&QGIS':
+            get_snippet = self._get_qgis_snippet
+        else:
+            get_snippet = self._get_arcmap_snippet
+        out_gpkg = get_export_path('.gpkg')
+        self.export_result_window.set_text(
+            'Writing features into {0}...'.format(out_gpkg))
+        self._start_file_export(
+            current_tab, out_gpkg, 'GPKG',
+            lambda path: self.export_result_window.set_text(
+                get_snippet(path)),
+            lambda err: self.export_result_window.set_text(
+                'Export failed: {0}'.format(err)))
+        return
+
+    # ----------------------------------------------------------------------
+    def _export_rows(self, current_tab, cursor, option):
+        """Export rows read with the export cursor into an output format."""
         if option == '&DataFrame':
-            out_csv = os.path.join(tempfile.gettempdir(), 'data.csv')
-            df.to_csv(out_csv, sep=';')
-            s = '{0}{1}'.format(
-                'import pandas as pd\n',
-                'df = pd.read_csv(r"{out_csv}", sep=";", index_col=0)'.format(
-                    out_csv=out_csv))
-            self.export_result_window.result.setText(s)
+            self.export_result_window.set_text(export_dataframe(cursor))
 
         if option == '&Markdown':
+            table_data = current_tab.table.table_data
             if not tabulate_found:
-                self.export_result_window.result.setText(
+                self.export_result_window.set_text(
                     'Tabulate package is not installed.\n'
                     'Get it from https://pypi.python.org/pypi/tabulate')
-            else:
+            elif (table_data.is_row_count_known()
+                  and table_data.number_layer_rows <= 1000):
                 s = tabulate(
-                    df, headers='keys', tablefmt='pipe', floatfmt='.4f')
-                if len(df) > 1000:
-                    out_md = os.path.join(tempfile.gettempdir(), 'data.md')
-                    with io.open(out_md, 'w', encoding='utf-8') as f:
-                        f.write(s)
-                    self.export_result_window.result.setText(
-                        'Markdown file is saved at {0}'.format(out_md))
-                else:
-                    self.export_result_window.result.setText(s)
-
-        QApplication.restoreOverrideCursor()
-        self.export_result_window.show()
+                    cursor.read_dataframe(),
+                    headers='keys',
+                    tablefmt='pipe',
+                    floatfmt='.4f')
+                self.export_result_window.set_text(s)
+            else:
+                out_md = get_export_path('.md')
+                write_markdown(cursor, out_md)
+                self.export_result_window.show_file(
+                    out_md, 'Markdown file is saved at {0}'.format(out_md))
         return
 
     # ----------------------------------------------------------------------
@@ -270,15 +493,15 @@ class Window(QMainWindow):
             pass
 
     # ----------------------------------------------------------------------
-    def _get_arcmap_snippet(self, geoms):
-        """Get arcpy code with received table rows ready to load into ArcMap."""
-        gp_call = "arcpy.CopyFeatures_management(geoms,'in_memory\GDBeeLayer')"
-        base_string = '{geoms}{for_loop}{build_geom}{append_geom}{copy_feats}'
-        snippet = base_string.format(
-            geoms='geoms = []\n',
-            for_loop='for wkt_str in {0}:\n'.format(geoms),
-            build_geom='\tg = arcpy.FromWKT(wkt_str)\n',
-            append_geom='\tgeoms.append(g)\n',
-            copy_feats=gp_call,
-        )
-        return snippet
+    def _get_qgis_snippet(self, gpkg_path):
+        """Get PyQGIS code to add the layer of the GeoPackage to the map."""
+        return ('iface.addVectorLayer(\n'
+                '    r"{0}|layername={1}", "{2}", "ogr")'.format(
+                    gpkg_path, EXPORT_LAYER_NAME, project_name))
+
+    # ----------------------------------------------------------------------
+    def _get_arcmap_snippet(self, gpkg_path):
+        """Get arcpy code to copy features of the GeoPackage into ArcMap."""
+        return ('arcpy.CopyFeatures_management(\n'
+                '    r"{0}\\main.{1}", r"in_memory\\{2}Layer")'.format(
+                    gpkg_path, EXPORT_LAYER_NAME, project_name))
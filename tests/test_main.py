@@ -1,13 +1,20 @@
 # -*- coding: UTF-8 -*-
 """Unit tests for the application."""
+import io
 import os
 import sys
+import time
+import tempfile
 import unittest
 import pkgutil
 
+import ogr
+import numpy as np
+
 from PyQt5.Qt import Qt
 from PyQt5.Qt import QTextCursor, QModelIndex, QItemSelectionModel
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QColor, QFont
 from PyQt5.QtTest import QTest
 
 sys.path.insert(
@@ -18,13 +25,25 @@ sys.path.insert(
     ))
 os.chdir(sys.path[0])
 
-from cfg import test_mode, dev_mode
+from cfg import (test_mode, dev_mode, export_viewer_page_lines,
+                 large_document_blocks, highlight_slice_blocks)
 if not test_mode or dev_mode:
     raise ValueError(
         'Set test/dev mode in config to True before running unit tests')
 
 from window import Window
 from geodatabase import Geodatabase
+from result_store import (BatchReader, ResultStore, WktPreviewCache,
+                          BINARY_COLUMN, pack_bytes, pa)
+from table import FULL_TEXT_ROLE, ResultTableModel
+from row_fetcher import RowPrefetcher
+from highlighter import PENDING_BLOCK
+from export import ExportCursor, write_csv, write_markdown
+from file_export import FileExporter, translate_query
+from query_server import QueryServer
+
+# seconds to wait for work done in background before failing a test
+WAIT_TIMEOUT = 60
 
 
 ########################################################################
@@ -121,7 +140,7 @@ class TestMainWindow(unittest.TestCase):
         self.tab.query.setPlainText(
             'SELECT Name, Type, Oneway, Shape FROM streets LIMIT 3')
 
-        self.tab.run_query()
+        self._run_query()
         self.assertEqual(self.tab.table.table_data.number_layer_rows, 3)
         self.assertEqual(self.tab.table.table_data.columnCount(), 4)
 
@@ -129,24 +148,30 @@ class TestMainWindow(unittest.TestCase):
         self.ui.do_include_geometry.setChecked(False)
         self.assertFalse(self.ui.do_include_geometry.isChecked())
 
-        self.tab.run_query()
+        self._run_query()
         self.assertEqual(self.tab.table.table_data.number_layer_rows, 3)
         self.assertEqual(self.tab.table.table_data.columnCount(), 3)
         return
 
     # ----------------------------------------------------------------------
     def test_export_qgis(self):
-        """Export result of SQL query execution to WKT.
+        """Export result of SQL query execution to a GeoPackage for QGIS.
 
-        The result WKT can be open using QGIS QuickWKT plugin.
+        The result is added as a layer using the PyQGIS code.
         """
         self._prepare_for_export()
         self.ui.export_result(None, '&QGIS')
+        self._wait_for_file_export()
+        text = self.ui.export_result_window.result.toPlainText()
+        self.assertIn('addVectorLayer', text)
+        gpkg_path = text.split('r"')[1].split('|')[0]
+        ds = ogr.Open(gpkg_path)
+        lyr = ds.GetLayer(0)
+        self.assertEqual(lyr.GetFeatureCount(), 3)
+        self.assertEqual(lyr.GetLayerDefn().GetFieldCount(), 3)
         self.assertEqual(
-            len(self.ui.export_result_window.result.toPlainText().split('\n')),
-            3)
-        self.assertIn('MULTILINESTRING',
-                      self.ui.export_result_window.result.toPlainText())
+            ogr.GT_Flatten(lyr.GetGeomType()), ogr.wkbMultiLineString)
+        ds = None
         self.ui.export_result_window.close()
         return
 
@@ -172,7 +197,29 @@ class TestMainWindow(unittest.TestCase):
         self._prepare_for_export()
 
         self.ui.export_result(None, '&DataFrame')
-        self.assertIn('.csv', self.ui.export_result_window.result.toPlainText())
+        text = self.ui.export_result_window.result.toPlainText()
+        if pa is None:
+            self.assertIn('.csv', text)
+        else:
+            self.assertIn('.feather', text)
+            namespace = {}
+            exec(text.split('\n\n')[0], namespace)
+            df = namespace['df']
+            self.assertEqual(len(df), 3)
+            self.assertIsInstance(df[df.columns[-1]].iloc[0], bytes)
+        self.ui.export_result_window.close()
+        return
+
+    # ----------------------------------------------------------------------
+    def test_export_failing_query(self):
+        """Show the error when the query cannot be executed for exporting."""
+        self._prepare_for_export()
+        self.tab.get_export_cursor = lambda **kwargs: ExportCursor(
+            self.local_gdb, 'SELECT * FROM no_such_table', 'sqlite')
+
+        self.ui.export_result(None, '&DataFrame')
+        self.assertIn('Export failed',
+                      self.ui.export_result_window.result.toPlainText())
         self.ui.export_result_window.close()
         return
 
@@ -182,8 +229,11 @@ class TestMainWindow(unittest.TestCase):
         self._prepare_for_export()
 
         self.ui.export_result(None, '&ArcMap')
+        self._wait_for_file_export()
         text = self.ui.export_result_window.result.toPlainText()
-        self.assertTrue([(w in text) for w in ['arcpy', 'MULTILINESTRING']])
+        self.assertIn('arcpy', text)
+        gpkg_path = text.split('r"')[1].split('\\main.')[0]
+        self.assertTrue(os.path.exists(gpkg_path))
         self.ui.export_result_window.close()
         return
 
@@ -212,8 +262,37 @@ class TestMainWindow(unittest.TestCase):
         if not tabulate_found:
             raise ValueError(
                 'Tabulate package should be installed before running this test')
-        self.assertIn('.md', self.ui.export_result_window.result.toPlainText())
-        self.ui.export_result_window.close()
+        export_window = self.ui.export_result_window
+        self.assertIn('.md', export_window.statusBar().currentMessage())
+
+        # 1,003 lines of the file are shown page by page
+        self.assertEqual(len(export_window.page_offsets), 2)
+        self.assertEqual(
+            len(export_window.result.toPlainText().split('\n')),
+            export_viewer_page_lines)
+        export_window.next_page_action.trigger()
+        self.assertEqual(export_window.page, 1)
+        self.assertEqual(
+            len(export_window.result.toPlainText().split('\n')), 3)
+        export_window.close()
+        return
+
+    # ----------------------------------------------------------------------
+    def test_streaming_markdown_table(self):
+        """Write Markdown table in batches with widths of the first rows."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT OBJECTID, Name FROM streets LIMIT 120')
+        out_md = os.path.join(tempfile.gettempdir(), 'export_test.md')
+        with self.tab.get_export_cursor(batch_rows=50) as cursor:
+            self.assertEqual(
+                write_markdown(cursor, out_md, width_sample_rows=10), 120)
+        with io.open(out_md, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        os.remove(out_md)
+        self.assertEqual(len(lines), 122)
+        self.assertTrue(lines[1].startswith('|---:|-'))
+        self.assertEqual(len(set(len(line) for line in lines[:12])), 1)
+        self.assertTrue(all(line.startswith('| ') for line in lines[2:]))
         return
 
     # ----------------------------------------------------------------------
@@ -261,7 +340,7 @@ class TestMainWindow(unittest.TestCase):
         block comment
         */ limit 3 """
         self._prepare_query_text(sql_query_string)
-        self.tab.run_query()
+        self._run_query()
         self.assertTrue(self.tab.table.isVisible())
         self.assertEqual(self.tab.table.table_data.number_layer_rows, 3)
         self.assertEqual(self.tab.table.table_data.columnCount(), 1)
@@ -273,7 +352,7 @@ class TestMainWindow(unittest.TestCase):
         self.tab = self._add_new_query_tab()
         sql_query_string = 'SELECT name FROM streets LIMIT 3\n UPDATE'
         self._prepare_query_text(sql_query_string)
-        self.tab.run_query()
+        self._run_query()
         self.assertTrue(self.tab.errors_panel.isVisible())
         self.assertIn('UPDATE', self.tab.errors_panel.toPlainText())
 
@@ -286,7 +365,7 @@ class TestMainWindow(unittest.TestCase):
         self.assertEqual(self.tab.query.textCursor().selectedText(),
                          sql_query_string[:cur_pos])
 
-        self.tab.run_query()
+        self._run_query()
         self.assertFalse(self.tab.errors_panel.isVisible())
         self.assertTrue(self.tab.table.isVisible())
         self.assertEqual(self.tab.table.table_data.number_layer_rows, 3)
@@ -319,7 +398,7 @@ class TestMainWindow(unittest.TestCase):
 
         self.tab.table.view.model().fetchMore(
         )  # need to load into `rows` from OGR layer
-        self.assertEqual(len(self.tab.table.view.model().rows), 1)
+        self.assertEqual(self.tab.table.view.model().rowCount(), 1)
         self.tab.table.view.selectRow(0)
 
         QTest.keyPress(self.tab.table.view, Qt.Key_C, Qt.ControlModifier)
@@ -358,12 +437,165 @@ class TestMainWindow(unittest.TestCase):
         self.tab = self._add_new_query_tab()
         sql_query_string = 'SELECT name FROM streets LIMIT 3'
         self._execute_sql(sql_query_string)
-        self.tab._set_gdb_items_highlight()
-        self.tab._fill_toc()
+        self._load_gdb_schemas()
+        toc_model = self.tab.toc.model()
         self.assertEqual(
             sorted((i.lower() for i in self.tab.gdb_items)),
-            sorted((self.tab.toc.topLevelItem(i).text(0).lower()
-                    for i in range(self.tab.toc.topLevelItemCount()))))
+            sorted((toc_model.index(i, 0).data().lower()
+                    for i in range(toc_model.rowCount()))))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_highlighting_query_in_one_pass(self):
+        """Highlight keywords, gdb items and comments of a query block."""
+        self.tab = self._add_new_query_tab()
+        self.tab.gdb = self.local_gdb
+        self._load_gdb_schemas()
+        self.tab.query.setPlainText('SELECT Name FROM streets -- streets')
+        block = self.tab.query.document().firstBlock()
+        formats = {(f.start, f.length): f.format
+                   for f in block.layout().formats()}
+        self.assertEqual(formats[(0, 6)].foreground().color(),
+                         QColor(Qt.darkBlue))
+        self.assertEqual(formats[(7, 4)].foreground().color(),
+                         QColor(Qt.darkGray))
+        self.assertEqual(formats[(17, 7)].fontWeight(), QFont.Bold)
+        self.assertEqual(formats[(25, 10)].foreground().color(),
+                         QColor(Qt.darkGreen))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_highlighting_large_document_when_idle(self):
+        """Highlight visible lines of a large query first, the rest later."""
+        self.tab = self._add_new_query_tab()
+        number_of_lines = large_document_blocks * 2
+        self.tab.query.setPlainText('\n'.join(
+            ['SELECT 1 -- line'] * number_of_lines))
+        document = self.tab.query.document()
+        last_block = document.lastBlock()
+        self.assertEqual(last_block.userState(), PENDING_BLOCK)
+        self.assertEqual(document.firstBlock().userState(), 0)
+
+        # one idle pass highlights a single slice of pending blocks
+        highlighter = self.tab.highlighter
+        first_pending = highlighter.fill_block_number
+        highlighter._fill_pending_blocks()
+        self.assertEqual(
+            document.findBlockByNumber(first_pending +
+                                       highlight_slice_blocks - 1).userState(),
+            0)
+        self.assertEqual(
+            document.findBlockByNumber(first_pending +
+                                       highlight_slice_blocks).userState(),
+            PENDING_BLOCK)
+        self.assertEqual(last_block.userState(), PENDING_BLOCK)
+
+        self._wait_until(
+            lambda: not self.tab.highlighter.fill_timer.isActive(),
+            'Pending blocks are not highlighted')
+        self.assertEqual(last_block.userState(), 0)
+        self.assertTrue(last_block.layout().formats())
+        return
+
+    # ----------------------------------------------------------------------
+    def test_loading_schemas_in_background(self):
+        """Stream geodatabase layers into the toc while they are loaded."""
+        self.tab = self._add_new_query_tab()
+        self.local_gdb.schema_cache.clear()
+        self.tab.gdb = Geodatabase(self.local_gdb.path)
+        self._load_gdb_schemas()
+        self.assertEqual(
+            sorted(self.tab.gdb_items), sorted(self.local_gdb.get_items()))
+        self.assertEqual(self.tab.toc.model().rowCount(),
+                         len(self.tab.gdb_items))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_sharing_vocabulary_between_tabs(self):
+        """Share one vocabulary between tabs connected to the same gdb."""
+        self.tab = self._add_new_query_tab()
+        self.tab.gdb = self.local_gdb
+        self._load_gdb_schemas()
+        vocabulary = self.tab.vocabulary
+        self.assertIs(self.tab.highlighter.vocabulary, vocabulary)
+
+        tab2 = self._add_new_query_tab()
+        self._wait_until(lambda: not tab2.schema_loader,
+                         'Schemas are not loaded')
+        self.assertIs(tab2.vocabulary, vocabulary)
+
+        # reconnecting keeps the vocabulary unless the schema has changed
+        self.tab.connect_to_geodatabase(evt=None, triggered_with_browse=False)
+        self.assertIs(self.tab.vocabulary, vocabulary)
+        self.assertEqual(
+            sorted(self.tab.gdb_items), sorted(vocabulary.table_names))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_completing_prefix_in_any_case(self):
+        """Complete gdb items keeping their case and keywords in typed case."""
+        self.tab = self._add_new_query_tab()
+        self.tab.gdb = self.local_gdb
+        self._load_gdb_schemas()
+        model = self.tab.completer.model
+        self.assertIs(model.vocabulary, self.tab.vocabulary)
+
+        model.set_prefix('sTrE')
+        self.assertIn('Streets', model.matches)
+        model.set_prefix('SEL')
+        self.assertIn('SELECT', model.matches)
+        model.set_prefix('sel')
+        self.assertIn('select', model.matches)
+        model.set_prefix('s')
+        self.assertEqual(len(model.matches), model.max_items)
+        self.assertEqual(model.matches,
+                         sorted(model.matches, key=lambda x: x.lower()))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_completing_columns_of_query_tables(self):
+        """Suggest columns of the tables the statement being edited uses."""
+        self.tab = self._add_new_query_tab()
+        self.tab.gdb = self.local_gdb
+        self._load_gdb_schemas()
+        query = self.tab.query
+        model = self.tab.completer.model
+        streets_columns = set(
+            name.lower() for name in self.tab.gdb_schemas['Streets'])
+
+        query.setPlainText(
+            'SELECT na FROM streets s; SELECT * FROM homicides h')
+        cur = query.textCursor()
+        cur.setPosition(len('SELECT na'))
+        query.setTextCursor(cur)
+        tables, qualifier = query.get_completion_context()
+        self.assertEqual(tables, {'streets': 'streets', 's': 'streets'})
+        self.assertIsNone(qualifier)
+        model.set_prefix('na', tables, qualifier)
+        self.assertIn(model.matches[0].lower(), streets_columns)
+
+        query.setPlainText('SELECT s.one FROM streets s')
+        cur = query.textCursor()
+        cur.setPosition(len('SELECT s.one'))
+        query.setTextCursor(cur)
+        tables, qualifier = query.get_completion_context()
+        self.assertEqual(qualifier, 's')
+        model.set_prefix('one', tables, qualifier)
+        self.assertEqual([m.lower() for m in model.matches], ['oneway'])
+
+        query.setPlainText('SELECT * FROM (SELECT 1) sub, DB1.Streets wh')
+        query.moveCursor(QTextCursor.End)
+        tables, qualifier = query.get_completion_context()
+        self.assertEqual(tables, {
+            'db1.streets': 'DB1.Streets',
+            'streets': 'DB1.Streets'
+        })
+        model.set_prefix('one', tables, qualifier)
+        self.assertEqual(model.matches[0].lower(), 'oneway')
+
+        # columns of all tables are suggested for tables not in the gdb
+        model.set_prefix('one', {'nowhere': 'nowhere'}, None)
+        self.assertIn('oneway', [m.lower() for m in model.matches])
         return
 
     # ----------------------------------------------------------------------
@@ -372,16 +604,38 @@ class TestMainWindow(unittest.TestCase):
         self.tab = self._add_new_query_tab()
         sql_query_string = 'SELECT name FROM streets LIMIT 3'
         self._execute_sql(sql_query_string)
-        self.tab._set_gdb_items_highlight()
-        self.tab._fill_toc()
+        self._load_gdb_schemas()
+        toc_model = self.tab.toc.model()
         self.ui.toc_expand_all()
         self.assertTrue(
-            all((self.tab.toc.topLevelItem(i).isExpanded()
-                 for i in range(self.tab.toc.topLevelItemCount()))))
+            all((self.tab.toc.isExpanded(toc_model.index(i, 0))
+                 for i in range(toc_model.rowCount()))))
         self.ui.toc_collapse_all()
         self.assertTrue(not any((
-            self.tab.toc.topLevelItem(i).isExpanded()
-            for i in range(self.tab.toc.topLevelItemCount()))))
+            self.tab.toc.isExpanded(toc_model.index(i, 0))
+            for i in range(toc_model.rowCount()))))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_filtering_toc(self):
+        """Filter the toc by a table name and by a column name."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT name FROM streets LIMIT 3')
+        self._load_gdb_schemas()
+        toc_model = self.tab.toc.model()
+
+        self.tab.toc_panel.filter_box.setText('STREET')
+        self.assertEqual(toc_model.rowCount(), 1)
+        self.assertEqual(toc_model.index(0, 0).data(), 'Streets')
+
+        self.tab.toc_panel.filter_box.setText('oneway')
+        streets = toc_model.index(0, 0)
+        self.assertEqual(toc_model.rowCount(), 1)
+        self.assertTrue(self.tab.toc.isExpanded(streets))
+        self.assertEqual(toc_model.rowCount(streets), 1)
+
+        self.tab.toc_panel.filter_box.clear()
+        self.assertEqual(toc_model.rowCount(), len(self.tab.gdb_items))
         return
 
     # ----------------------------------------------------------------------
@@ -406,6 +660,431 @@ class TestMainWindow(unittest.TestCase):
         self.assertEqual(self.tab.table.table_data.number_layer_rows, 5)
         return
 
+    # ----------------------------------------------------------------------
+    def test_cancel_query(self):
+        """Cancel a running query and execute another one afterwards."""
+        self.tab = self._add_new_query_tab()
+        self.tab.gdb = self.local_gdb
+        self.tab.query.setPlainText(
+            'SELECT count(*) FROM streets a, streets b')
+        self.tab.run_query()
+        self.assertTrue(self.tab.is_query_running())
+        self.assertTrue(self.tab.cancel_query_button.isEnabled())
+
+        QTest.mouseClick(self.tab.cancel_query_button, Qt.LeftButton)
+        self.assertFalse(self.tab.is_query_running())
+        self.assertIn('Cancelled', self.ui.statusBar().currentMessage())
+        # GDAL cannot be interrupted in the application process
+        self.assertFalse(self.tab.execute.isEnabled())
+        self.tab.run_query()
+        self.assertFalse(self.tab.is_query_running())
+
+        # worker processes are killed, so queries can be run at once
+        self.tab = self._add_new_query_tab()
+        self.tab.gdb = Geodatabase(self.local_gdb.path)
+        self.tab.gdb.execution_mode = 'process'
+        self.tab.query.setPlainText(
+            'SELECT count(*) FROM streets a, streets b')
+        self.tab.run_query()
+        QTest.mouseClick(self.tab.cancel_query_button, Qt.LeftButton)
+        self.assertTrue(self.tab.execute.isEnabled())
+        self.tab.query.setPlainText('SELECT Name FROM streets LIMIT 3')
+        self._run_query()
+        self.assertEqual(self.tab.table.table_data.number_layer_rows, 3)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_execute_sql_in_worker_process(self):
+        """Execute SQL query in a worker process getting columnar batches."""
+        gdb = Geodatabase(self.local_gdb.path)
+        gdb.execution_mode = 'process'
+        res, errors = gdb.execute_sql(
+            'SELECT Name, Oneway, Shape FROM streets LIMIT 3')
+        self.assertIsNone(errors)
+        self.assertEqual(len(res), 3)
+
+        number_of_rows, columns = res.fetch_batch(10)
+        self.assertEqual(number_of_rows, 3)
+        self.assertEqual([name for name, _kind, _arrays in columns],
+                         ['NAME', 'ONEWAY', 'SHAPE'])
+        gdb.release_result(res)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_releasing_more_workers_than_kept_idle(self):
+        """Stop worker processes released when the idle pool is full."""
+        server = QueryServer(max_idle=1)
+        results = [
+            server.execute(self.local_gdb.path,
+                           'SELECT Name FROM streets LIMIT 1', 'sqlite')[0]
+            for _idx in range(3)
+        ]
+        workers = [res.worker for res in results]
+        for res in results:
+            res.release()
+
+        self.assertEqual(server._idle, workers[:1])
+        self.assertTrue(workers[0].is_alive())
+        for worker in workers[1:]:
+            self.assertFalse(worker.is_alive())
+        workers[0].stop()
+        return
+
+    # ----------------------------------------------------------------------
+    def test_counting_rows_in_background(self):
+        """Count rows of SQLite view while the first rows are fetched."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT Name FROM streets WHERE Oneway = \'yes\'')
+        table_data = self.tab.table.table_data
+        self.assertTrue(table_data.is_row_count_known())
+        self.assertLessEqual(table_data.rowCount(),
+                             table_data.number_layer_rows)
+        self.assertIn(
+            '{0:,} rows'.format(table_data.number_layer_rows),
+            self.ui.statusBar().currentMessage())
+
+        self.tab.table.load_all_rows()
+        while table_data.is_fetching():
+            QTest.qWait(20)
+        self.assertEqual(table_data.rowCount(), table_data.number_layer_rows)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_fetching_rows_behind_first_rows(self):
+        """Draw the first rows and keep fetching the rest in background."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT Name FROM streets')
+        table_data = self.tab.table.table_data
+        self.assertGreaterEqual(table_data.rowCount(), table_data.chunk_size)
+        self.assertIn('First rows in', self.ui.statusBar().currentMessage())
+
+        while table_data.is_fetching():
+            QTest.qWait(20)
+        self.assertEqual(table_data.rowCount(), table_data.number_layer_rows)
+        self.assertIn('Total', self.ui.statusBar().currentMessage())
+        return
+
+    # ----------------------------------------------------------------------
+    def test_keeping_rows_in_result_store(self):
+        """Keep fetched rows column by column in the result store."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT OBJECTID, Name, Shape FROM streets LIMIT 3')
+        _start, store = self.tab.table.table_data.get_window(0)
+        self.assertEqual(store.row_count, 3)
+        self.assertEqual(store.headers, ['OBJECTID', 'NAME', 'SHAPE'])
+        self.assertIsInstance(store.get_value(0, 0), int)
+        self.assertTrue(store.get_value(0, 2).startswith('MULTILINESTRING'))
+
+        with self.tab.get_export_cursor() as cursor:
+            df = cursor.read_dataframe()
+        self.assertEqual(list(df.columns), store.headers)
+        self.assertEqual(list(df.index), [1, 2, 3])
+        return
+
+    # ----------------------------------------------------------------------
+    @unittest.skipUnless(
+        pa is not None and hasattr(ogr.Layer, 'GetArrowStreamAsPyArrow'),
+        'Reading arrow streams needs pyarrow and GDAL 3.6+')
+    def test_reading_batches_with_arrow_stream(self):
+        """Read the same rows with the arrow stream and feature by feature."""
+        rows = []
+        for use_arrow in (False, True):
+            res, _errors = self.local_gdb.execute_sql(
+                'SELECT OBJECTID, Name, Shape FROM streets LIMIT 5')
+            reader = BatchReader(
+                res, geom_column=res.GetGeometryColumn(), use_arrow=use_arrow)
+            store = ResultStore(reader.fields, reader.geom_column)
+            store.append_batch(*reader.read(10))
+            self.assertTrue(reader.is_exhausted)
+            # the arrow stream is really read rather than falling back
+            self.assertEqual(reader.use_arrow, use_arrow)
+            self.assertEqual(reader._stream is not None, use_arrow)
+            rows.append([[store.get_value(row, col) for col in range(3)]
+                         for row in range(store.row_count)])
+            reader.close()
+            self.local_gdb.release_result(res)
+        self.assertEqual(len(rows[0]), 5)
+        self.assertEqual(rows[0], rows[1])
+        return
+
+    # ----------------------------------------------------------------------
+    def test_keeping_binary_values_as_bytes(self):
+        """Show binary field values as hex and export them as bytes."""
+        arrays = pack_bytes([b'\x01\xab', b''])
+        arrays['nulls'] = np.array([False, True], dtype=np.bool_)
+        store = ResultStore([('BLOB', ogr.OFTBinary)])
+        store.append_batch(2, [('BLOB', BINARY_COLUMN, arrays)])
+        self.assertEqual(store.get_value(0, 0), '01AB')
+        self.assertIsNone(store.get_value(1, 0))
+        if pa is not None:
+            batch = store.to_arrow()
+            self.assertEqual(batch.column(0).type, pa.large_binary())
+            self.assertEqual(batch.column(0).to_pylist(), [b'\x01\xab', None])
+        return
+
+    # ----------------------------------------------------------------------
+    def test_showing_wkt_previews(self):
+        """Show cut WKT of geometries keeping the full WKT for copying."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT Shape FROM streets LIMIT 1')
+        table_data = self.tab.table.table_data
+        table_data.wkt_previews = WktPreviewCache(
+            max_size=10, max_length=20, precision=1)
+        index = table_data.index(0, 0)
+        self.assertTrue(
+            index.data(FULL_TEXT_ROLE).startswith('MULTILINESTRING'))
+        preview = index.data(Qt.DisplayRole)
+        self.assertEqual(len(preview), 20)
+        self.assertTrue(preview.endswith(u'\u2026'))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_sorting_rows_of_spill_file(self):
+        """Write rows into the spill file in background and sort them."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT OBJECTID, Name FROM streets LIMIT 1000')
+        table_data = self.tab.table.table_data
+        while table_data.is_fetching():
+            QTest.qWait(20)
+        self.assertEqual(table_data.spill.row_count, 1000)
+        self.assertEqual(table_data.rowCount(), 1000)
+
+        ids = [table_data.index(row, 0).data() for row in range(1000)]
+        self.tab.table.view.sortByColumn(0, Qt.DescendingOrder)
+        # rows are sorted in background and shown once sorted
+        self.assertTrue(table_data.is_sorting())
+        self.assertEqual(table_data.index(0, 0).data(), ids[0])
+        while table_data.is_sorting():
+            QTest.qWait(20)
+        self.assertEqual(table_data.index(0, 0).data(), max(ids))
+        self.assertEqual(table_data.index(999, 0).data(), min(ids))
+
+        with self.tab.get_export_cursor() as cursor:
+            self.assertIs(cursor.spill, table_data.spill)
+            df = cursor.read_dataframe()
+        self.assertEqual(len(df), 1000)
+        self.assertEqual(df['OBJECTID'].iloc[0], max(ids))
+
+        spill_path = table_data.spill.path
+        self.tab.close_connection()
+        self.assertFalse(os.path.exists(spill_path))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_spilling_rows_up_to_the_limit(self):
+        """Write rows into the spill file up to the limit and keep errors."""
+        res, _errors = self.local_gdb.execute_sql(
+            'SELECT OBJECTID FROM streets LIMIT 1000')
+        table_data = ResultTableModel(res, show_shapes=False)
+        table_data.start_prefetch(300)
+        while table_data.is_fetching():
+            QTest.qWait(20)
+        QTest.qWait(20)
+        self.assertEqual(table_data.rowCount(), 300)
+        self.assertFalse(table_data.is_row_count_known())
+        self.assertTrue(table_data.canFetchMore())
+
+        def fail_reading(limit):
+            raise RuntimeError('Reading failed')
+
+        table_data.reader.read = fail_reading
+        table_data.fetchMore()
+        while table_data.is_fetching():
+            QTest.qWait(20)
+        QTest.qWait(20)
+        self.assertEqual(table_data.fetch_error, 'Reading failed')
+        self.assertFalse(table_data.is_exhausted)
+        self.assertFalse(table_data.is_row_count_known())
+        self.assertFalse(table_data.canFetchMore())
+        table_data.close(self.local_gdb.release_result)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_prefetching_rows_in_background(self):
+        """Read batches of rows in a thread posting them to be stored."""
+        res, _errors = self.local_gdb.execute_sql(
+            'SELECT OBJECTID FROM streets LIMIT 450')
+        reader = BatchReader(res)
+        store = ResultStore(reader.fields)
+        fetcher = RowPrefetcher(reader, max_rows=300, batch_rows=200)
+        fetcher.batch_read.connect(store.append_batch)
+        fetcher.start()
+        while fetcher.is_running():
+            QTest.qWait(20)
+        QTest.qWait(20)
+        self.assertEqual(store.row_count, 300)
+        self.assertFalse(reader.is_exhausted)
+
+        fetcher = RowPrefetcher(reader, row_count=300, batch_rows=200)
+        fetcher.batch_read.connect(store.append_batch)
+        fetcher.start()
+        while fetcher.is_running():
+            QTest.qWait(20)
+        QTest.qWait(20)
+        self.assertEqual(store.row_count, 450)
+        self.assertTrue(reader.is_exhausted)
+        reader.close()
+        self.local_gdb.release_result(res)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_exporting_with_cursor_of_its_own(self):
+        """Write rows into a file in batches leaving the table as it is."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT OBJECTID, Name FROM streets LIMIT 500')
+        table_data = self.tab.table.table_data
+        rows_shown = table_data.rowCount()
+        out_csv = os.path.join(tempfile.gettempdir(), 'export_test.csv')
+        with self.tab.get_export_cursor(batch_rows=100) as cursor:
+            self.assertEqual(write_csv(cursor, out_csv), 500)
+        with io.open(out_csv, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        os.remove(out_csv)
+        self.assertEqual(len(lines), 501)
+        self.assertEqual(lines[0], ';OBJECTID;NAME')
+        self.assertTrue(lines[-1].startswith('500;'))
+        self.assertIs(self.tab.table.table_data, table_data)
+        self.assertGreaterEqual(table_data.rowCount(), rows_shown)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_exporting_into_geopackage(self):
+        """Write rows of the query into a file with the OGR driver."""
+        out_path = os.path.join(tempfile.gettempdir(), 'export_test.gpkg')
+        translate_query(self.local_gdb.path,
+                        'SELECT OBJECTID, Name, Shape FROM streets LIMIT 10',
+                        'SQLite', out_path, 'GPKG')
+        ds = ogr.Open(out_path)
+        lyr = ds.GetLayerByName('result')
+        self.assertEqual(lyr.GetFeatureCount(), 10)
+        self.assertEqual(
+            ogr.GT_Flatten(lyr.GetGeomType()), ogr.wkbMultiLineString)
+        self.assertGreaterEqual(lyr.GetLayerDefn().GetFieldIndex('NAME'), 0)
+        ds = None
+        os.remove(out_path)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_reporting_export_progress(self):
+        """Report export progress by whole percents and stop on cancel."""
+        exporter = FileExporter(self.local_gdb.path, 'SELECT 1', 'SQLite',
+                                'export_test.gpkg', 'GPKG')
+        reports = []
+        exporter.progress.connect(reports.append)
+        for idx in range(1001):
+            self.assertEqual(exporter._on_progress(idx / 1000.0, '', None), 1)
+        self.assertEqual(len(reports), 101)
+
+        exporter.cancel()
+        self.assertEqual(exporter._on_progress(1.0, '', None), 0)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_removing_file_of_stopped_export(self):
+        """Remove the file written partway when the export stops or fails."""
+        out_path = os.path.join(tempfile.gettempdir(), 'export_test.gpkg')
+
+        def fail_writing(complete, message, data):
+            return 0  # GDAL stops as on a failure of the driver
+
+        for stop in ('cancel', 'fail'):
+            exporter = FileExporter(self.local_gdb.path,
+                                    'SELECT OBJECTID FROM streets', 'SQLite',
+                                    out_path, 'GPKG')
+            errors = []
+            exporter.failed.connect(errors.append)
+            if stop == 'cancel':
+                exporter.cancel()
+            else:
+                exporter._on_progress = fail_writing
+            exporter._run()
+            self.assertEqual(len(errors), 1)
+            self.assertEqual(errors[0] == 'Export cancelled',
+                             stop == 'cancel')
+            self.assertFalse(os.path.exists(out_path))
+        return
+
+    # ----------------------------------------------------------------------
+    def test_sizing_columns_to_sampled_rows(self):
+        """Keep columns within the width limits for their kind of values."""
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT OBJECTID, Name, Shape FROM streets')
+        table = self.tab.table
+        for col, column in enumerate(table.table_data.store.columns):
+            self.assertLessEqual(table.view.columnWidth(col),
+                                 table.max_column_widths[column.kind])
+        self.assertEqual(table.view.columnWidth(2),
+                         table.max_column_widths['geom'])
+        return
+
+    # ----------------------------------------------------------------------
+    def test_random_access_to_rows(self):
+        """Read windows of rows around the rows the view asks for."""
+        res, _errors = self.local_gdb.execute_sql(
+            'SELECT OBJECTID FROM streets', 'OGRSQL')
+        number_of_rows = len(res)
+        table_data = ResultTableModel(res, False, number_of_rows)
+        if not table_data.is_random_access:
+            table_data.close()
+            self.local_gdb.release_result(res)
+            self.skipTest('GDAL cannot seek rows of the result fast')
+
+        self.assertEqual(table_data.rowCount(), number_of_rows)
+        self.assertFalse(table_data.canFetchMore())
+        self.assertIsNotNone(table_data.index(number_of_rows - 1, 0).data())
+        self.assertEqual(len(table_data.windows), 1)
+        for row in range(0, number_of_rows, table_data.window_size):
+            self.assertIsNotNone(table_data.index(row, 0).data())
+        self.assertLessEqual(len(table_data.windows), table_data.max_windows)
+        table_data.close()
+        self.local_gdb.release_result(res)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_sizing_columns_of_random_access_rows(self):
+        """Size columns reading only the first window of rows."""
+        self.tab = self._add_new_query_tab()
+        res, _errors = self.local_gdb.execute_sql(
+            'SELECT OBJECTID, Name FROM streets', 'OGRSQL')
+        number_of_rows = len(res)
+        self.tab.draw_result_table(res, number_of_rows, show_shapes=False)
+        table_data = self.tab.table.table_data
+        if not table_data.is_random_access:
+            self.skipTest('GDAL cannot seek rows of the result fast')
+
+        # fewer windows than are kept in memory, so every read is still there
+        self.assertEqual(list(table_data.windows), [0])
+        return
+
+    # ----------------------------------------------------------------------
+    def test_releasing_result_sets(self):
+        """Give pooled connections back after re-executing and closing."""
+        pool = self.local_gdb.pool
+        path = self.local_gdb.path
+        outstanding = pool.get_outstanding_results_count(path)
+        self.tab = self._add_new_query_tab()
+        self._execute_sql('SELECT Name FROM streets LIMIT 3')
+        self._execute_sql('SELECT Name FROM streets LIMIT 5')
+        self.assertEqual(
+            pool.get_outstanding_results_count(path), outstanding + 1)
+
+        self.ui.tab_widget.removeTab(self.ui.tab_widget.currentIndex())
+        self.assertEqual(pool.get_outstanding_results_count(path), outstanding)
+        return
+
+    # ----------------------------------------------------------------------
+    def test_schema_catalog_cache(self):
+        """Read geodatabase schemas from the on-disk catalog cache."""
+        self.local_gdb.schema_cache.clear()
+        schemas = Geodatabase(self.local_gdb.path).get_schemas()
+        self.assertTrue(os.path.exists(self.local_gdb.schema_cache.cache_path))
+
+        files_signature, cached_layers = self.local_gdb.schema_cache.load()
+        self.assertEqual(sorted(cached_layers), sorted(schemas))
+        self.assertEqual(Geodatabase(self.local_gdb.path).get_schemas(),
+                         schemas)
+        return
+
     # ----------------------------------------------------------------------
     def _prepare_query_text(self, sql_query):
         """Put SQL query string into a tab."""
@@ -426,7 +1105,7 @@ class TestMainWindow(unittest.TestCase):
         self.tab.query.setPlainText(
             'SELECT Name, Type, Oneway, Shape FROM streets LIMIT 3')
 
-        self.tab.run_query()
+        self._run_query()
         self.assertEqual(self.tab.table.table_data.number_layer_rows, 3)
         self.assertEqual(self.tab.table.table_data.columnCount(), 4)
 
@@ -441,7 +1120,41 @@ class TestMainWindow(unittest.TestCase):
         else:
             self.tab.gdb = self.local_gdb
         self.tab.query.setPlainText(sql)
+        self._run_query()
+        return
+
+    # ----------------------------------------------------------------------
+    def _run_query(self):
+        """Run query in the current tab and wait for it to be executed."""
         self.tab.run_query()
+        while self.tab.is_query_running() or self.tab.is_counting_rows():
+            QTest.qWait(20)
+        return
+
+    # ----------------------------------------------------------------------
+    def _load_gdb_schemas(self):
+        """Load schemas of the gdb of the current tab and wait for them."""
+        self.tab.load_gdb_schemas()
+        self._wait_until(lambda: not self.tab.schema_loader,
+                         'Schemas are not loaded')
+        return
+
+    # ----------------------------------------------------------------------
+    def _wait_until(self, condition, message, timeout=WAIT_TIMEOUT):
+        """Process events until the condition is met; fail after timeout."""
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail('{0} in {1} secs'.format(message, timeout))
+            QTest.qWait(20)
+        return
+
+    # ----------------------------------------------------------------------
+    def _wait_for_file_export(self):
+        """Wait for the file being exported in background to be written."""
+        while self.ui.file_exporter.is_running():
+            QTest.qWait(20)
+        QTest.qWait(20)
         return
 
     # ----------------------------------------------------------------------